@@ -0,0 +1,228 @@
+"""
+Offline benchmarks of the Observe query client against a local stub of the Observe API (stub_observe.py).
+
+Measures end-to-end latency, peak RSS and throughput of query_dataset() and validate_azure_data() in each
+mode for a range of response sizes. Every case runs in a fresh interpreter so peak RSS is not shared
+between cases. Results are written as JSON and can be compared to an earlier run:
+
+    python benchmark.py --rows 10,10000,1000000 --output benchmark.json
+    python benchmark.py --baseline benchmark.json --tolerance 0.2
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timezone
+
+from stub_observe import StubObserve # type: ignore
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODES = {
+    "query_buffered": "query_dataset() reading the whole response into a list",
+    "query_stream": "query_dataset(stream=True) iterating over all rows",
+    "validate_stream": "validate_azure_data() for one source, stopping at the first row",
+    "validate_sequential": "validate_sources() one source after another",
+    "validate_concurrent": "validate_sources() with the sources in parallel",
+    "validate_fused": "validate_sources() with one fused query",
+    "validate_sliced": "validate_sources() with each query split into 4 parallel slices",
+}
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(mode: str) -> dict:
+    """
+    Runs one benchmark case in this process against the stub configured in the environment.
+
+    @param mode: key of MODES
+    @return: measurements of the case
+    """
+    sys.path.insert(0, SCRIPTS_DIR)
+    import query_observe # type: ignore
+    from instrumentation import metrics # type: ignore
+
+    rss_before = _peak_rss_bytes()
+    start = time.perf_counter()
+    if mode in ("query_buffered", "query_stream"):
+        token_manager = query_observe.get_token_manager()
+        rows = query_observe.query_dataset(token_manager.get(), os.environ["AZURE_DATASET_ID"],
+                                           pipeline=query_observe.pipeline_config.build_pipeline("EventHub"),
+                                           startTime=os.environ["CURRENT_TIME_ISO"],
+                                           endTime=datetime.datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                           stream=mode == "query_stream")
+        count = sum(1 for _ in rows) if rows is not None else 0
+        ok = rows is not None
+    elif mode == "validate_stream":
+        ok = query_observe.validate_azure_data("EventHub", stale_checks_mins=30)
+        count = None
+    else:
+        results = query_observe.validate_sources(query_observe.SOURCES, stale_checks_mins=30,
+                                                 concurrent=mode != "validate_sequential",
+                                                 fused=mode == "validate_fused",
+                                                 slices=4 if mode == "validate_sliced" else 1)
+        ok = all(results.values())
+        count = None
+    latency = time.perf_counter() - start
+
+    queries = [entry for entry in metrics.summary() if entry["phase"] == "query"]
+    received_rows = sum(entry.get("rows", 0) for entry in queries)
+    received_bytes = sum(entry.get("bytes", 0) for entry in queries)
+    return {
+        "ok": ok,
+        "latency_secs": latency,
+        "rows": count if count is not None else received_rows,
+        "bytes": received_bytes,
+        "rows_per_sec": received_rows / latency if latency else 0.0,
+        "bytes_per_sec": received_bytes / latency if latency else 0.0,
+        "baseline_rss_bytes": rss_before,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "http_retries": query_observe.get_client().retries,
+    }
+
+
+def _run_child(mode: str, stub_url: str, workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "OBSERVE_BASE_URL": stub_url,
+        "OBSERVE_CUSTOMER": "123456789",
+        "OBSERVE_DOMAIN": "stub.local",
+        "OBSERVE_USER_EMAIL": "benchmark@stub.local",
+        "OBSERVE_USER_PASSWORD": "benchmark",
+        "OBSERVE_TOKEN_CACHE": "",
+        "OBSERVE_BACKOFF_SECS": "0.05",
+        "AZURE_DATASET_ID": "41000000",
+        "OBSERVE_TOKEN_ID": "ds1benchmark",
+        "AZURE_COLLECTION_FUNCTION": "benchmark",
+        "CURRENT_TIME_ISO": (datetime.datetime.now(timezone.utc) - datetime.timedelta(minutes=5)).strftime(
+            '%Y-%m-%dT%H:%M:%S.000Z'),
+    })
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode], env=env, cwd=workdir,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_benchmarks(modes: list, row_counts: list, repeat: int, stub_options: dict) -> list:
+    """
+    @param modes: keys of MODES to run
+    @param row_counts: rows returned per export query by the stub, one set of cases per value
+    @param repeat: runs per case, the median latency/throughput and the maximum RSS are reported
+    @param stub_options: passed to StubObserve (row_bytes, latency_secs, throttle_rate, error_rate)
+    @return: one result per mode and row count
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in row_counts:
+            with StubObserve(rows=rows, seed=0, **stub_options) as stub:
+                for mode in modes:
+                    runs = [_run_child(mode, stub.url, workdir) for _ in range(repeat)]
+                    result = {
+                        "mode": mode,
+                        "stub_rows": rows,
+                        "runs": len(runs),
+                        "ok": all(run["ok"] for run in runs),
+                        "latency_secs": statistics.median(run["latency_secs"] for run in runs),
+                        "rows_per_sec": statistics.median(run["rows_per_sec"] for run in runs),
+                        "bytes_per_sec": statistics.median(run["bytes_per_sec"] for run in runs),
+                        "rows": max(run["rows"] for run in runs),
+                        "bytes": max(run["bytes"] for run in runs),
+                        "peak_rss_bytes": max(run["peak_rss_bytes"] for run in runs),
+                        "rss_growth_bytes": max(run["peak_rss_bytes"] - run["baseline_rss_bytes"] for run in runs),
+                        "http_retries": sum(run["http_retries"] for run in runs),
+                    }
+                    logging.info("{mode} rows={stub_rows}: {latency_secs:.3f}s, {rows_per_sec:.0f} rows/s, "
+                                 "peak RSS {peak_rss_bytes} bytes".format(**result))
+                    results.append(result)
+    return results
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """
+    @param results: results of this run
+    @param baseline: results of an earlier run
+    @param tolerance: allowed relative increase of latency and RSS growth, e.g. 0.2 for 20%
+    @return: descriptions of the cases that regressed
+    """
+    previous = {(entry["mode"], entry["stub_rows"]): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry["mode"], entry["stub_rows"]))
+        if before is None:
+            continue
+        for field in ("latency_secs", "rss_growth_bytes"):
+            if before[field] > 0 and entry[field] > before[field] * (1 + tolerance):
+                regressions.append("{} rows={}: {} {} -> {} (+{:.0%})".format(
+                    entry["mode"], entry["stub_rows"], field, before[field], entry[field],
+                    entry[field] / before[field] - 1))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the Observe query client against a local stub API")
+    parser.add_argument("--modes", default=",".join(MODES),
+                        help="Comma separated modes to run (default: all): {}".format(", ".join(MODES)))
+    parser.add_argument("--rows", default="10,10000,1000000",
+                        help="Comma separated rows per export query (default: 10,10000,1000000)")
+    parser.add_argument("--row-bytes", type=int, default=200, help="Padding per row (default: 200)")
+    parser.add_argument("--latency-secs", type=float, default=0.05, help="Stub latency per query (default: 0.05)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of queries answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of queries answered 500")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case (default: 3)")
+    parser.add_argument("--output", default="benchmark.json", help="Results file (default: benchmark.json)")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression against --baseline (default: 0.2)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_case(args.child)))
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    stub_options = {
+        "row_bytes": args.row_bytes,
+        "latency_secs": args.latency_secs,
+        "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate,
+    }
+    modes = args.modes.split(",")
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error("unknown modes: {}".format(", ".join(unknown)))
+
+    results = run_benchmarks(modes, [int(rows) for rows in args.rows.split(",")], args.repeat, stub_options)
+    report = {
+        "created": datetime.datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": dict(stub_options, repeat=args.repeat),
+        "results": results,
+    }
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            regressions = compare(results, json.load(baseline_file)["results"], args.tolerance)
+        report["regressions"] = regressions
+        for regression in regressions:
+            logging.error("Regression: {}".format(regression))
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=4)
+    logging.info("Results written to {}".format(args.output))
+
+    if not all(result["ok"] for result in results) or report.get("regressions"):
+        sys.exit(1)
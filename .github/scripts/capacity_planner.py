@@ -0,0 +1,336 @@
+"""
+Capacity planner for the Event Hub, the function app plan and the timer schedules of this module.
+
+Reads the provisioned sizing from the Terraform files (namespace throughput units, partition count, plan SKU,
+timer schedules), measures ingest rate, event size and ingestion lag in the Observe dataset (or takes them
+from the command line), and recommends the sizing for a target rate and lag SLO with the projected headroom
+of the current and recommended sizing.
+
+Uses the same environment variables as query_observe.py:
+
+    python capacity_planner.py --target-eps 5000 --lag-slo-secs 300 --output capacity_plan.json
+    python capacity_planner.py --ingest-eps 800 --event-bytes 1500 --lag-p95-secs 40   # offline
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import sys
+from contextlib import closing
+from datetime import timezone
+
+from ncrontab import Schedule # type: ignore
+from pipeline_config import TIMER_SOURCES # type: ignore
+from terraform_config import TerraformConfig # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Event Hubs Standard tier limits per throughput unit
+# https://learn.microsoft.com/en-us/azure/event-hubs/event-hubs-quotas
+TU_INGRESS_BYTES_PER_SEC = 1024 * 1024
+TU_INGRESS_EVENTS_PER_SEC = 1000
+# Diagnostic records Azure Monitor batches in one Event Hub event. Observe stores a row per record, while the
+# Event Hub limits and the consumer count events.
+RECORDS_PER_EVENT = 10
+STANDARD_MAX_TUS = 40
+STANDARD_MAX_PARTITIONS = 32
+# Timer intervals that divide an hour evenly, so runs stay aligned to the hour
+TIMER_INTERVALS_MINS = (1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30, 60)
+# Function app plans: Consumption with cold starts, and the smallest Elastic Premium with always ready instances
+CONSUMPTION_SKU = "Y1"
+ELASTIC_PREMIUM_SKU = "EP1"
+
+
+def current_sizing(config: TerraformConfig) -> dict:
+    """
+    @param config: parsed Terraform files of the module
+    @return: provisioned throughput units, partitions, plan SKU and timer schedules
+    """
+    namespace = "azurerm_eventhub_namespace"
+    capacity = config.attribute(namespace, None, "capacity", 1)
+    auto_inflate = config.attribute(namespace, None, "auto_inflate_enabled", False)
+    sizing = {
+        "eventhub_sku": config.attribute(namespace, None, "sku"),
+        "throughput_units": capacity,
+        "auto_inflate": auto_inflate,
+        "maximum_throughput_units": config.attribute(namespace, None, "maximum_throughput_units")
+        if auto_inflate else capacity,
+        "partition_count": config.attribute("azurerm_eventhub", None, "partition_count"),
+        "plan_sku": config.attribute("azurerm_service_plan", None, "sku_name"),
+        "timer_schedules": {source: config.variable(variable) for source, variable in TIMER_SOURCES.items()},
+    }
+    return sizing
+
+
+def measure_ingest(sources: list, start_time: str, end_time: str, records_per_event: float = RECORDS_PER_EVENT) -> dict:
+    """
+    @param records_per_event: records per Event Hub event, converts the per record rows of Observe to events
+    @return: per source mean and peak events/sec and mean event size, from per minute counts in Observe
+    """
+    import pipeline_config # type: ignore
+    import query_observe # type: ignore
+
+    token_manager = query_observe.get_token_manager()
+    rows = query_observe.query_dataset(token_manager.get(), os.environ.get("AZURE_DATASET_ID"),
+                                       pipeline=pipeline_config.build_ingest_rate_pipeline(sources),
+                                       startTime=start_time, endTime=end_time, token_manager=token_manager,
+                                       stream=True)
+    if rows is None:
+        raise RuntimeError("Ingest rate query failed")
+
+    minutes = {}
+    with closing(rows):
+        for item in rows:
+            try:
+                counts = minutes.setdefault(item["source"], {})
+                counts[item["minute"]] = (int(item["events"]), int(item["bytes"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    window_mins = max(1.0, (_parse(end_time) - _parse(start_time)) / 60)
+    measured = {}
+    for source, counts in minutes.items():
+        records = sum(count[0] for count in counts.values())
+        total_bytes = sum(count[1] for count in counts.values())
+        measured[source] = {
+            "mean_eps": records / records_per_event / (window_mins * 60),
+            "peak_eps": max(count[0] for count in counts.values()) / records_per_event / 60,
+            "event_bytes": total_bytes / records * records_per_event if records else 0.0,
+        }
+    return measured
+
+
+def measure_lag_p95(source: str, start_time: str, end_time: str) -> float:
+    import lag_report # type: ignore
+
+    return lag_report.measure_lag(source, start_time, end_time, 3600).total.percentile(0.95)
+
+
+def consumer_eps_from_load_test(path: str) -> float:
+    """
+    @param path: results of load_generator.py
+    @return: highest delivered events/sec per partition among the steps that delivered at least 99%
+    """
+    with open(path) as load_test_file:
+        load_test = json.load(load_test_file)
+    rates = [step["delivered_records_rate"] for step in load_test["steps"] if step["delivered_ratio"] >= 0.99]
+    if not rates:
+        raise ValueError("{}: no step delivered 99% of its records".format(path))
+    return max(rates) / load_test["records_per_event"] / load_test["partitions"]
+
+
+def required_throughput_units(eps: float, event_bytes: float) -> int:
+    """@return: TUs needed for the ingress rate, by events and by bytes"""
+    return max(1, math.ceil(max(eps / TU_INGRESS_EVENTS_PER_SEC, eps * event_bytes / TU_INGRESS_BYTES_PER_SEC)))
+
+
+def headroom(capacity: float, demand: float) -> float:
+    """@return: unused fraction of the capacity at the demand, negative when over capacity"""
+    return 1 - demand / capacity if capacity else -1.0
+
+
+def plan(current: dict, target_eps: float, event_bytes: float, eventhub_lag_secs: float, timer_lag_secs: dict,
+         lag_slo_secs: float, target_headroom: float, consumer_eps_per_partition: float,
+         cold_start_secs: float) -> dict:
+    """
+    @param current: current_sizing()
+    @param target_eps: Event Hub events/sec to plan for
+    @param event_bytes: mean event size
+    @param eventhub_lag_secs: measured p95 ingestion lag of the EventHub source
+    @param timer_lag_secs: measured p95 ingestion lag per timer source, after the function fired
+    @param lag_slo_secs: p95 lag the sizing must meet
+    @param target_headroom: unused capacity to keep at the target rate, e.g. 0.3
+    @param consumer_eps_per_partition: events/sec one function instance drains from a partition
+    @param cold_start_secs: added lag of a consumption plan cold start
+    @return: recommendations and projected headroom of the current and recommended sizing
+    """
+    notes = []
+    planned_eps = target_eps / (1 - target_headroom)
+
+    throughput_units = required_throughput_units(planned_eps, event_bytes)
+    if throughput_units > STANDARD_MAX_TUS:
+        notes.append("{} TUs exceed the Standard tier maximum of {}, use a Premium namespace".format(
+            throughput_units, STANDARD_MAX_TUS))
+    # Each partition takes at most 1 TU of ingress, and each function instance drains one partition.
+    # Fewer partitions than provisioned are never recommended, changing the count recreates the Event Hub.
+    partitions = max(throughput_units, math.ceil(planned_eps / consumer_eps_per_partition),
+                     current["partition_count"])
+    if partitions > STANDARD_MAX_PARTITIONS:
+        notes.append("{} partitions exceed the Standard tier maximum of {}, the consumer needs larger batches or a "
+                     "Premium namespace".format(partitions, STANDARD_MAX_PARTITIONS))
+        partitions = STANDARD_MAX_PARTITIONS
+    if partitions != current["partition_count"]:
+        notes.append("The partition count of a Standard Event Hub cannot be changed, the Event Hub is recreated")
+
+    # Only the cold start is measured, so the plan moves between Consumption and the smallest Elastic Premium
+    # SKU. A larger Elastic Premium SKU is kept as it is, its CPU and memory are not measured.
+    plan_sku = current["plan_sku"] or CONSUMPTION_SKU
+    elastic_premium = plan_sku.startswith("EP")
+    cold_start_fits = eventhub_lag_secs + cold_start_secs <= lag_slo_secs * (1 - target_headroom)
+    if not elastic_premium and not cold_start_fits:
+        notes.append("Measured lag plus a {:.0f}s cold start leaves no headroom within the SLO, upgrade from {} to an "
+                     "Elastic Premium plan with always ready instances".format(cold_start_secs, plan_sku))
+        plan_sku = ELASTIC_PREMIUM_SKU
+    elif elastic_premium and cold_start_fits:
+        notes.append("Downgrade: measured lag plus a {:.0f}s cold start fits the SLO with headroom, the Consumption "
+                     "plan is enough instead of {}".format(cold_start_secs, plan_sku))
+        plan_sku = CONSUMPTION_SKU
+
+    timer_schedules = {}
+    for source, schedule in current["timer_schedules"].items():
+        budget_secs = lag_slo_secs * (1 - target_headroom) - timer_lag_secs.get(source, 0.0)
+        fitting = [mins for mins in TIMER_INTERVALS_MINS if mins * 60 <= budget_secs] or [TIMER_INTERVALS_MINS[0]]
+        if fitting == [TIMER_INTERVALS_MINS[0]] and TIMER_INTERVALS_MINS[0] * 60 > budget_secs:
+            notes.append("{}: no timer interval meets the SLO, its ingestion lag alone is {:.0f}s".format(
+                source, timer_lag_secs.get(source, 0.0)))
+        # Keep the second offset that staggers the timers
+        timer_schedules[source] = "{} */{} * * * *".format(schedule.split()[0], fitting[-1])
+
+    recommended = {
+        "throughput_units": throughput_units,
+        "partition_count": partitions,
+        "plan_sku": plan_sku,
+        "timer_schedules": timer_schedules,
+    }
+
+    def projection(sizing: dict) -> dict:
+        max_tus = sizing.get("maximum_throughput_units") or sizing["throughput_units"]
+        return {
+            "ingress_events_headroom": headroom(max_tus * TU_INGRESS_EVENTS_PER_SEC, target_eps),
+            "ingress_bytes_headroom": headroom(max_tus * TU_INGRESS_BYTES_PER_SEC, target_eps * event_bytes),
+            "consumer_headroom": headroom(sizing["partition_count"] * consumer_eps_per_partition, target_eps),
+            "timer_lag_secs": {
+                source: Schedule(schedule).max_interval_secs() + timer_lag_secs.get(source, 0.0)
+                for source, schedule in sizing["timer_schedules"].items()
+            },
+        }
+
+    return {
+        "target_eps": target_eps,
+        "event_bytes": event_bytes,
+        "lag_slo_secs": lag_slo_secs,
+        "target_headroom": target_headroom,
+        "current": dict(current, projected=projection(current)),
+        "recommended": dict(recommended, projected=projection(recommended)),
+        "tfvars": tfvars(recommended),
+        "notes": notes,
+    }
+
+
+def tfvars(recommended: dict) -> dict:
+    """@return: module variables applying the recommended sizing"""
+    variables = {
+        "eventhub_namespace_capacity": min(recommended["throughput_units"], STANDARD_MAX_TUS),
+        "eventhub_partition_count": recommended["partition_count"],
+        "service_plan_sku_name": recommended["plan_sku"],
+    }
+    for source, variable in TIMER_SOURCES.items():
+        variables[variable] = recommended["timer_schedules"][source]
+    return variables
+
+
+def markdown(result: dict) -> str:
+    current = result["current"]
+    recommended = result["recommended"]
+    lines = [
+        "## Capacity Plan",
+        "",
+        "Target {:.0f} events/s of {:.0f} bytes, p95 lag SLO {:.0f}s, {:.0%} headroom".format(
+            result["target_eps"], result["event_bytes"], result["lag_slo_secs"], result["target_headroom"]),
+        "",
+        "| | Current | Recommended |",
+        "|---|---|---|",
+        "| Throughput units | {} | {} |".format(current["maximum_throughput_units"], recommended["throughput_units"]),
+        "| Partitions | {} | {} |".format(current["partition_count"], recommended["partition_count"]),
+        "| Plan SKU | {} | {} |".format(current["plan_sku"], recommended["plan_sku"]),
+    ]
+    for source in current["timer_schedules"]:
+        lines.append("| {} schedule | `{}` | `{}` |".format(
+            source, current["timer_schedules"][source], recommended["timer_schedules"][source]))
+    for field, label in (("ingress_events_headroom", "Ingress headroom (events)"),
+                         ("ingress_bytes_headroom", "Ingress headroom (bytes)"),
+                         ("consumer_headroom", "Consumer headroom")):
+        lines.append("| {} | {:.0%} | {:.0%} |".format(
+            label, current["projected"][field], recommended["projected"][field]))
+    lines.append("")
+    lines.extend("- {}".format(note) for note in result["notes"])
+    lines.extend(["", "```"] + ["{} = {}".format(name, json.dumps(value)) for name, value in result["tfvars"].items()]
+                 + ["```"])
+    return "\n".join(lines) + "\n"
+
+
+def _parse(iso_time: str) -> float:
+    return datetime.datetime.strptime(iso_time, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recommends Event Hub, plan and timer sizing")
+    parser.add_argument("--terraform-dir", default=os.path.join(os.path.dirname(__file__), "..", ".."),
+                        help="Terraform root module (default: the repository root)")
+    parser.add_argument("--var-file", action="append", default=[], help="tfvars file(s) overriding defaults")
+    parser.add_argument("--window-mins", type=float, default=60, help="Measurement window ending now (default: 60)")
+    parser.add_argument("--ingest-eps", type=float, help="EventHub events/sec, instead of measuring the peak")
+    parser.add_argument("--event-bytes", type=float, help="Mean event size, instead of measuring it")
+    parser.add_argument("--lag-p95-secs", type=float, help="EventHub p95 ingestion lag, instead of measuring it")
+    parser.add_argument("--timer-lag-secs", type=float,
+                        help="p95 ingestion lag of the timer sources, instead of measuring VmMetrics")
+    parser.add_argument("--target-eps", type=float, help="events/sec to plan for (default: measured peak)")
+    parser.add_argument("--lag-slo-secs", type=float, default=300, help="p95 lag SLO (default: 300)")
+    parser.add_argument("--headroom", type=float, default=0.3,
+                        help="Unused capacity to keep at the target rate (default: 0.3)")
+    parser.add_argument("--consumer-eps-per-partition", type=float, default=500,
+                        help="events/sec a function instance drains from one partition (default: 500)")
+    parser.add_argument("--load-test", help="load_generator.py results to derive --consumer-eps-per-partition from")
+    parser.add_argument("--records-per-event", type=float, default=RECORDS_PER_EVENT,
+                        help="Diagnostic records per Event Hub event, converts the rows measured in Observe to "
+                             "events (default: {})".format(RECORDS_PER_EVENT))
+    parser.add_argument("--cold-start-secs", type=float, default=30,
+                        help="Lag added by a consumption plan cold start (default: 30)")
+    parser.add_argument("--output", help="Write the plan as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    current = current_sizing(TerraformConfig.load(args.terraform_dir, args.var_file))
+    logger.info("Current sizing: {}".format(current))
+
+    now = datetime.datetime.now(timezone.utc)
+    end_time = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    start_time = (now - datetime.timedelta(minutes=args.window_mins)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    ingest_eps, event_bytes = args.ingest_eps, args.event_bytes
+    if ingest_eps is None or event_bytes is None:
+        measured = measure_ingest(['EventHub'], start_time, end_time, args.records_per_event).get('EventHub')
+        if measured is None:
+            logger.error("No EventHub rows in the last {} minutes, pass --ingest-eps and --event-bytes".format(
+                args.window_mins))
+            sys.exit(1)
+        logger.info("Measured EventHub ingest: {}".format(measured))
+        ingest_eps = measured["peak_eps"] if ingest_eps is None else ingest_eps
+        event_bytes = measured["event_bytes"] if event_bytes is None else event_bytes
+    eventhub_lag = args.lag_p95_secs
+    if eventhub_lag is None:
+        eventhub_lag = measure_lag_p95('EventHub', start_time, end_time) or 0.0
+    timer_lag = args.timer_lag_secs
+    if timer_lag is None:
+        timer_lag = measure_lag_p95('VmMetrics', start_time, end_time) or 0.0
+    consumer_eps = args.consumer_eps_per_partition
+    if args.load_test:
+        consumer_eps = consumer_eps_from_load_test(args.load_test)
+
+    result = plan(current, args.target_eps or ingest_eps, event_bytes, eventhub_lag,
+                  {source: timer_lag for source in TIMER_SOURCES}, args.lag_slo_secs, args.headroom,
+                  consumer_eps, args.cold_start_secs)
+    result["measured"] = {"ingest_eps": ingest_eps, "eventhub_lag_p95_secs": eventhub_lag,
+                          "timer_lag_p95_secs": timer_lag, "consumer_eps_per_partition": consumer_eps}
+
+    print(markdown(result))
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(result, json_file, indent=4)
+        logger.info("Capacity plan written to {}".format(args.output))
+    if os.environ.get("GITHUB_STEP_SUMMARY"):
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as summary_file:
+            summary_file.write(markdown(result))
@@ -0,0 +1,284 @@
+"""
+Generates the Terraform overrides of ephemeral CI environments, one per branch and region.
+
+The resources to rename are read from the resource blocks of the module (main.tf): every resource whose
+name (display_name for app registrations) is derived from variables or locals gets a name made of a prefix
+for its type and the environment name, plus the CI tags. Characters of the branch other than letters, digits
+and hyphens, like the dots of release-1.2, become hyphens in the names. Storage account and key vault names have no
+separators and at most 24 characters. Names only unique within a renamed parent, like storage containers,
+are kept. All names are checked against the Azure naming rules, and for
+collisions between the environments, before anything is written.
+
+Without --branches the environment is the branch of the workflow run (GITHUB_HEAD_REF or GITHUB_REF):
+override.tf.json is written to the working directory and TF_VAR_branch to $GITHUB_ENV. With --branches
+and/or --regions, every combination gets {output-dir}/{environment}/override.tf.json and
+terraform.tfvars.json (branch and location of .github/terraform), and {output-dir}/matrix.json lists them
+for a GitHub Actions matrix:
+
+    python environment_overrides.py --branches feature-a,feature-b --regions eastus,westeurope --output-dir envs
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+from terraform_config import Expression, TerraformConfig # type: ignore
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+# Name prefix per resource type. Types not listed get "gh-" and the initials of the type, e.g. gh-sc-
+NAME_PREFIXES = {
+    "azurerm_resource_group": "gh-rg-",
+    "azuread_application": "gh-app-",
+    "azurerm_storage_account": "ghsa",
+    "azurerm_key_vault": "ghkv",
+    "azurerm_eventhub_namespace": "gh-ehns-",
+    "azurerm_eventhub": "gh-eh-",
+    "azurerm_eventhub_authorization_rule": "gh-ehap-",
+    "azurerm_service_plan": "gh-sp-",
+    "azurerm_linux_function_app": "gh-fa-",
+    "azurerm_monitor_diagnostic_setting": "gh-fa-ds-",
+}
+# Types whose names only allow lowercase letters and digits, up to 24 characters
+COMPACT_TYPES = ("azurerm_storage_account", "azurerm_key_vault")
+# Types whose names are only unique within their parent resource, which is renamed already
+SCOPED_TYPES = ("azurerm_storage_container",)
+# Types tagged with the CI tags even though main.tf does not set tags on them
+TAGGED_TYPES = tuple(resource_type for resource_type in NAME_PREFIXES
+                     if resource_type != "azurerm_monitor_diagnostic_setting")
+# Azure naming rules: minimum and maximum length, pattern and its description
+# https://learn.microsoft.com/en-us/azure/azure-resource-manager/management/resource-name-rules
+NAME_RULES = {
+    "azurerm_storage_account": (3, 24, r"[a-z0-9]+", "lowercase letters and digits"),
+    "azurerm_key_vault": (3, 24, r"[a-zA-Z](?!.*--)[a-zA-Z0-9-]*[a-zA-Z0-9]",
+                          "letters, digits and single hyphens, starting with a letter and ending with a letter or digit"),
+    "azurerm_eventhub_namespace": (6, 50, r"[a-zA-Z][a-zA-Z0-9-]*[a-zA-Z0-9]",
+                                   "letters, digits and hyphens, starting with a letter and ending with a letter or digit"),
+    "azurerm_linux_function_app": (2, 60, r"[a-zA-Z0-9][a-zA-Z0-9-]*[a-zA-Z0-9]",
+                                   "letters, digits and hyphens, not at the start or end"),
+    "azurerm_resource_group": (1, 90, r"[\w.()-]*[\w()-]", "letters, digits, _ . ( ) and -, not ending with ."),
+}
+COMPACT_MAX_LENGTH = 24
+
+
+def branch_name(ref: str) -> str:
+    """
+    @param ref: GITHUB_HEAD_REF or GITHUB_REF, e.g. refs/heads/nikhil/add-CI-OB-29418
+    @return: branch name with / replaced by -, e.g. nikhil-add-CI-OB-29418
+    """
+    return ref.replace("refs/heads/", "").replace("/", "-")
+
+
+def current_branch() -> str:
+    """@return: branch of the workflow run, from GITHUB_HEAD_REF for pull requests else GITHUB_REF"""
+    ref = os.getenv("GITHUB_HEAD_REF") or os.getenv("GITHUB_REF")
+    if not ref:
+        raise ValueError("Neither GITHUB_HEAD_REF nor GITHUB_REF is set")
+    return branch_name(ref)
+
+
+class Environment:
+    """An ephemeral CI environment: a branch, optionally deployed to a region other than the default"""
+
+    def __init__(self, branch: str, region: str = None, abbreviation: str = None):
+        """
+        @param branch: branch name, see branch_name
+        @param region: Azure location, None for the module's default location
+        @param abbreviation: short name of the region appended to the names, see location_abbreviation
+        """
+        self.branch = branch
+        self.region = region
+        self.abbreviation = abbreviation
+
+    @property
+    def name(self) -> str:
+        """@return: name of the environment, also its Observe token and Terraform state key"""
+        return self.branch if self.abbreviation is None else "{}-{}".format(self.branch, self.abbreviation)
+
+    def compact_name(self, max_length: int) -> str:
+        """
+        @param max_length: characters available after the type prefix
+        @return: lowercase letters and digits of the branch and region abbreviation. Branches that do not fit
+                 keep their start and a hash of the whole branch, so long branches sharing a prefix do not collide
+        """
+        suffix = re.sub(r"[^a-z0-9]", "", (self.abbreviation or "").lower())
+        compact = re.sub(r"[^a-z0-9]", "", self.branch.lower())
+        budget = max_length - len(suffix)
+        if len(compact) > budget:
+            digest = hashlib.sha1(self.branch.encode()).hexdigest()[:4]
+            compact = compact[:budget - len(digest)] + digest
+        return compact + suffix
+
+    def resource_name(self, resource_type: str) -> str:
+        prefix = NAME_PREFIXES.get(resource_type) or "gh-{}-".format(
+            "".join(word[0] for word in resource_type.split("_")[1:]))
+        if resource_type in COMPACT_TYPES:
+            return prefix + self.compact_name(COMPACT_MAX_LENGTH - len(prefix))
+        # Event Hub namespace and function app names only allow letters, digits and hyphens
+        return prefix + re.sub(r"[^a-zA-Z0-9-]", "-", self.name)
+
+    def tfvars(self) -> dict:
+        """@return: variables of .github/terraform for the environment"""
+        variables = {"branch": self.name}
+        if self.region is not None:
+            variables["location"] = self.region
+        return variables
+
+
+def renamed_resources(config: TerraformConfig) -> list:
+    """
+    @param config: parsed module
+    @return: (resource type, resource name, name attribute, tagged) of the resources whose names are derived
+             from variables or locals
+    """
+    resources = []
+    for block in config.resources():
+        if block.labels[0] in SCOPED_TYPES:
+            continue
+        attribute = "display_name" if "display_name" in block.attributes else "name"
+        value = block.attributes.get(attribute)
+        if isinstance(value, Expression) and re.search(r"\b(var|local)\.", value):
+            tagged = block.labels[0] in TAGGED_TYPES or "tags" in block.attributes
+            resources.append((block.labels[0], block.labels[1], attribute, tagged))
+    return resources
+
+
+def override(environment: Environment, resources: list) -> dict:
+    """
+    @param environment: environment to generate the override for
+    @param resources: see renamed_resources
+    @return: content of override.tf.json
+    """
+    ## See https://learn.microsoft.com/en-us/answers/questions/1437283/azure-policy-issue
+    config = {"resource": {}}
+    for resource_type, name, attribute, tagged in resources:
+        entry = {attribute: environment.resource_name(resource_type)}
+        if tagged:
+            # azuread_application takes tags as a list
+            entry["tags"] = ["terraform-ci", environment.branch] if resource_type.startswith("azuread_") else {
+                "created_by": "terraform-ci",
+                "branch": environment.branch,
+            }
+        config["resource"].setdefault(resource_type, {})[name] = entry
+    return config
+
+
+def validate(overrides: dict) -> list:
+    """
+    @param overrides: override per environment name
+    @return: errors: names breaking the Azure naming rules, and names used by more than one environment
+    """
+    errors = []
+    owners = {}
+    for environment_name, config in overrides.items():
+        for resource_type, resources in config["resource"].items():
+            for name, entry in resources.items():
+                value = entry.get("name") or entry.get("display_name")
+                owners.setdefault((resource_type, value), []).append(environment_name)
+                if resource_type not in NAME_RULES:
+                    continue
+                min_length, max_length, pattern, description = NAME_RULES[resource_type]
+                if not min_length <= len(value) <= max_length:
+                    errors.append("{}: {}.{} name {} has {} characters, {}-{} are allowed".format(
+                        environment_name, resource_type, name, value, len(value), min_length, max_length))
+                elif not re.fullmatch(pattern, value):
+                    errors.append("{}: {}.{} name {} may only contain {}".format(
+                        environment_name, resource_type, name, value, description))
+    for (resource_type, value), environment_names in sorted(owners.items()):
+        if len(environment_names) > 1:
+            errors.append("{} name {} is used by {}".format(resource_type, value, ", ".join(environment_names)))
+    return errors
+
+
+def environments(branches: list, regions: list, config: TerraformConfig) -> list:
+    """
+    @param branches: branch names
+    @param regions: Azure locations, empty for the module's default location without a region suffix
+    @param config: parsed module, for the region abbreviations
+    @return: one environment per branch and region
+    """
+    if not regions:
+        return [Environment(branch) for branch in branches]
+    abbreviations = config.variable("location_abbreviation")
+    unknown = [region for region in regions if region not in abbreviations]
+    if unknown:
+        raise ValueError("No location_abbreviation for {}".format(", ".join(unknown)))
+    return [Environment(branch, region, abbreviations[region]) for branch in branches for region in regions]
+
+
+def generate(branches: list, regions: list = (), terraform_dir: str = REPO_ROOT) -> dict:
+    """
+    @return: {environment name: (environment, override)}
+    @raise ValueError: if a name breaks the naming rules or collides between environments
+    """
+    config = TerraformConfig.load(terraform_dir)
+    resources = renamed_resources(config)
+    generated = {}
+    for environment in environments(branches, list(regions), config):
+        generated[environment.name] = (environment, override(environment, resources))
+    errors = validate({name: config for name, (_, config) in generated.items()})
+    if errors:
+        raise ValueError("Invalid overrides:\n" + "\n".join(errors))
+    return generated
+
+
+def write_environment(environment: Environment, config: dict, directory: str) -> dict:
+    """@return: matrix entry of the environment with the paths of its override.tf.json and terraform.tfvars.json"""
+    os.makedirs(directory, exist_ok=True)
+    paths = {"override": os.path.join(directory, "override.tf.json"),
+             "tfvars": os.path.join(directory, "terraform.tfvars.json")}
+    with open(paths["override"], "w") as json_file:
+        json.dump(config, json_file, indent=3)
+    with open(paths["tfvars"], "w") as json_file:
+        json.dump(environment.tfvars(), json_file, indent=3)
+    return dict(name=environment.name, branch=environment.branch, region=environment.region, **paths)
+
+
+def set_github_env(variables: dict):
+    """Appends TF_VAR_{name} for each variable to $GITHUB_ENV"""
+    env_file = os.getenv("GITHUB_ENV")
+    if not env_file:
+        return
+    with open(env_file, "a") as github_env:
+        for name, value in variables.items():
+            github_env.write("TF_VAR_{}={}\n".format(name, value))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Generates Terraform overrides for ephemeral CI environments")
+    parser.add_argument("--branches", help="Comma separated branches (default: the branch of the workflow run)")
+    parser.add_argument("--regions", help="Comma separated Azure locations, each environment gets a region suffix")
+    parser.add_argument("--terraform-dir", default=REPO_ROOT, help="Module with the resources (default: repository root)")
+    parser.add_argument("--output-dir", help="Directory of the per environment files and matrix.json, required with "
+                                             "--branches or --regions")
+    args = parser.parse_args()
+
+    branches = args.branches.split(",") if args.branches else [current_branch()]
+    regions = args.regions.split(",") if args.regions else []
+    try:
+        generated = generate([branch_name(branch) for branch in branches], regions, args.terraform_dir)
+    except ValueError as err:
+        logger.error(err)
+        sys.exit(1)
+
+    if args.output_dir is None:
+        if len(generated) > 1 or regions:
+            parser.error("--output-dir is required with several branches or --regions")
+        environment, config = next(iter(generated.values()))
+        with open("override.tf.json", "w") as json_file:
+            json.dump(config, json_file, indent=3)
+        set_github_env(environment.tfvars())
+        logger.info("Wrote override.tf.json for {}".format(environment.name))
+        sys.exit(0)
+
+    matrix = [write_environment(environment, config, os.path.join(args.output_dir, name))
+              for name, (environment, config) in generated.items()]
+    with open(os.path.join(args.output_dir, "matrix.json"), "w") as json_file:
+        json.dump({"include": matrix}, json_file, indent=3)
+    logger.info("Wrote {} environments to {}".format(len(matrix), args.output_dir))
@@ -0,0 +1,276 @@
+"""
+Fleet mode of query_observe.py: validates many deployments of the collection module concurrently.
+
+Deployments are listed in a JSON manifest. Each entry names a `terraform output -json` file of the
+deployment (with the observe_token_id, azure_dataset_id and azure_collection_function outputs of
+.github/terraform) and/or sets those values directly, with the Terraform apply finish time as start_time:
+
+    {
+        "deployments": [
+            {"name": "eastus", "terraform_output": "eastus.json", "start_time": "2024-05-28T12:00:00.000Z"},
+            {"name": "westeurope", "azure_dataset_id": "41000001", "observe_token_id": "ds1abc...",
+             "azure_collection_function": "https://.../azure-collection-functions-0.11.3.zip",
+             "observe_customer": "123456789012", "user_email_env": "OBSERVE_USER_EMAIL_EU",
+             "password_env": "OBSERVE_USER_PASSWORD_EU"}
+        ]
+    }
+
+start_time, observe_customer and observe_domain default to $CURRENT_TIME_ISO, $OBSERVE_CUSTOMER and
+$OBSERVE_DOMAIN. user_email_env and password_env name the environment variables with the Observe login of
+the entry's tenant, by default $OBSERVE_USER_EMAIL and $OBSERVE_USER_PASSWORD. An entry can set "timer_schedules" ({"VmMetrics": "30 */5 * * * *", ...}) for
+--schedule-aware, otherwise the schedules of query_observe.Deployment apply.
+
+Deployments run in a bounded worker pool. All of them share one HTTP session, and one login per Observe
+tenant (customer id and domain) and credentials, and one rate limit per tenant, so adding deployments does
+not add logins or exceed the tenant's query rate:
+
+    python fleet.py --manifest fleet.json --workers 8 --max-requests-per-sec 5 --wait --fused
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import query_observe # type: ignore
+from instrumentation import metrics # type: ignore
+from validation_state import ValidationState # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Manifest keys, named like the outputs of .github/terraform, to Deployment arguments
+MANIFEST_KEYS = {
+    "azure_dataset_id": "dataset_id",
+    "observe_token_id": "token_id",
+    "azure_collection_function": "collection_version",
+    "start_time": "start_time_iso",
+    "observe_customer": "customer_id",
+    "observe_domain": "domain",
+    "user_email_env": "user_email_env",
+    "password_env": "password_env",
+}
+
+
+def load_manifest(path: str) -> list:
+    """
+    @param path: JSON manifest, {"deployments": [...]} or a list of entries
+    @return: deployments, terraform_output files are resolved relative to the manifest
+    """
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    entries = manifest["deployments"] if isinstance(manifest, dict) else manifest
+
+    deployments = []
+    for index, entry in enumerate(entries):
+        values = {}
+        if entry.get("terraform_output"):
+            with open(os.path.join(os.path.dirname(path), entry["terraform_output"])) as output_file:
+                outputs = json.load(output_file)
+            values.update({key: output["value"] for key, output in outputs.items() if key in MANIFEST_KEYS})
+        values.update({key: value for key, value in entry.items() if key in MANIFEST_KEYS})
+        kwargs = {MANIFEST_KEYS[key]: value for key, value in values.items()}
+        deployment = query_observe.Deployment(name=entry.get("name") or "deployment-{}".format(index),
+                                              timer_schedules=entry.get("timer_schedules"), **kwargs)
+        missing = [key for key, argument in MANIFEST_KEYS.items() if getattr(deployment, argument) is None]
+        missing.extend("${}".format(entry[key]) for key in ("user_email_env", "password_env")
+                       if entry.get(key) and os.environ.get(entry[key]) is None)
+        if missing:
+            raise ValueError("{}: {} not set in the manifest or environment".format(deployment.name,
+                                                                                  ", ".join(missing)))
+        deployments.append(deployment)
+
+    names = [deployment.name for deployment in deployments]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError("Duplicate deployment names: {}".format(", ".join(duplicates)))
+    return deployments
+
+
+def validate_deployment(deployment: query_observe.Deployment, sources: list, stale_checks_mins: int,
+                        wait: bool, poll_schedule_secs: list, deadline_mins: float, concurrent: bool, fused: bool,
+                        state_dir: str = None, slices: int = 1, ingest_lag_secs: float = None) -> dict:
+    """
+    @param deployment: deployment to validate
+    @param state_dir: directory of the per deployment incremental state files, None queries full windows
+    @param slices: sub-windows each query is split into, see query_observe.query_sliced
+    @param ingest_lag_secs: with wait, hold off timer sources until their first data can arrive, see
+                            query_observe.poll_sources
+    @return: {name, results: {source: True/False}, valid, duration_secs, error}
+    """
+    state = None
+    if state_dir is not None:
+        state = ValidationState(os.path.join(state_dir, deployment.output_file("validation_state")),
+                                deployment.run_key())
+    start = time.monotonic()
+    error = None
+    with metrics.timed("deployment", deployment=deployment.name) as call:
+        try:
+            if wait:
+                results = query_observe.poll_sources(sources, stale_checks_mins, poll_schedule_secs, deadline_mins,
+                                                     concurrent=concurrent, state=state, fused=fused,
+                                                     deployment=deployment, slices=slices,
+                                                     ingest_lag_secs=ingest_lag_secs)
+            else:
+                results = query_observe.validate_sources(sources, stale_checks_mins, concurrent=concurrent,
+                                                         state=state, fused=fused, deployment=deployment,
+                                                         slices=slices)
+        except Exception as err:
+            logger.error("{}: Validation raised {!r}".format(deployment.name, err))
+            results = {source: False for source in sources}
+            error = repr(err)
+        call["result"] = all(results.values())
+    return {
+        "name": deployment.name,
+        "customer_id": deployment.customer_id,
+        "results": results,
+        "valid": all(results.values()),
+        "duration_secs": time.monotonic() - start,
+        "error": error,
+    }
+
+
+def validate_fleet(deployments: list, sources: list, workers: int, **kwargs) -> list:
+    """
+    Validates the deployments in a pool of worker threads, logging in once per tenant first.
+
+    @param deployments: see load_manifest
+    @param sources: sources to validate in each deployment
+    @param workers: deployments validated at the same time
+    @param kwargs: passed to validate_deployment
+    @return: result per deployment, in manifest order. Deployments of a tenant whose login failed are not
+             validated and fail with the login error
+    """
+    # Size the shared session's connection pool for the workers and their per source and slice threads
+    query_observe.configure_session(pool_size=workers * len(sources) * kwargs.get("slices", 1))
+    # A tenant whose login fails fails its own deployments only
+    login_errors = {}
+    for tenant in sorted({_login(deployment) for deployment in deployments}):
+        try:
+            query_observe.get_token_manager(*tenant).get()
+        except Exception as err:
+            logger.error("Login to {}.{} as ${} raised {!r}, failing its deployments".format(
+                tenant[0], tenant[1], tenant[2], err))
+            login_errors[tenant] = repr(err)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fleet") as executor:
+        futures = {deployment.name: executor.submit(validate_deployment, deployment, sources, **kwargs)
+                   for deployment in deployments if _login(deployment) not in login_errors}
+        reports = []
+        for deployment in deployments:
+            error = login_errors.get(_login(deployment))
+            if error is None:
+                reports.append(futures[deployment.name].result())
+                continue
+            reports.append({
+                "name": deployment.name,
+                "customer_id": deployment.customer_id,
+                "results": {source: False for source in sources},
+                "valid": False,
+                "duration_secs": 0.0,
+                "error": "Login failed: {}".format(error),
+            })
+        return reports
+
+
+def _login(deployment: query_observe.Deployment) -> tuple:
+    """@return: tenant and credential variables the deployment logs in with, see query_observe.get_token_manager"""
+    return deployment.customer_id, deployment.domain, deployment.user_email_env, deployment.password_env
+
+
+def markdown(reports: list, sources: list) -> str:
+    lines = [
+        "## Fleet Data Validation",
+        "",
+        "| Deployment | {} | Duration (s) | Result |".format(" | ".join(sources)),
+        "|---|{}---|---|".format("---|" * len(sources)),
+    ]
+    for report in reports:
+        lines.append("| {} | {} | {:.1f} | {} |".format(
+            report["name"],
+            " | ".join(":white_check_mark:" if report["results"].get(source) else ":x:" for source in sources),
+            report["duration_secs"], "Passed" if report["valid"] else "Failed"))
+    passed = sum(report["valid"] for report in reports)
+    lines.extend(["", "{} of {} deployments passed".format(passed, len(reports))])
+    return "\n".join(lines) + "\n"
+
+
+def table(reports: list, sources: list) -> str:
+    """@return: plain text table of the reports for the log"""
+    name_width = max([len("Deployment")] + [len(report["name"]) for report in reports])
+    widths = [max(len(source), 4) for source in sources]
+    rows = [["Deployment".ljust(name_width)] + [source.ljust(width) for source, width in zip(sources, widths)]
+            + ["Secs".rjust(7), "Result"]]
+    for report in reports:
+        rows.append([report["name"].ljust(name_width)]
+                    + [("pass" if report["results"].get(source) else "FAIL").ljust(width)
+                       for source, width in zip(sources, widths)]
+                    + ["{:7.1f}".format(report["duration_secs"]), "Passed" if report["valid"] else "Failed"])
+    return "\n".join("  ".join(row) for row in rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validates Azure collection data of many deployments in Observe")
+    parser.add_argument("--manifest", required=True, help="JSON manifest of the deployments")
+    parser.add_argument("--workers", type=int, default=4, help="Deployments validated at the same time (default: 4)")
+    parser.add_argument("--max-requests-per-sec", type=float,
+                        help="Rate limit of requests per Observe tenant (default: $OBSERVE_MAX_REQUESTS_PER_SEC or "
+                             "unlimited)")
+    parser.add_argument("--sources", default=",".join(query_observe.SOURCES),
+                        help="Comma separated sources (default: {})".format(",".join(query_observe.SOURCES)))
+    parser.add_argument("--sequential", action="store_true",
+                        help="Validate the sources of a deployment one after another instead of concurrently")
+    parser.add_argument("--fused", action="store_true",
+                        help="Validate the sources of a deployment with a single fused query")
+    parser.add_argument("--wait", action="store_true",
+                        help="Keep polling each deployment until it passes or --deadline-mins expires")
+    parser.add_argument("--deadline-mins", type=float, default=40,
+                        help="Deadline per deployment for --wait (default: 40)")
+    parser.add_argument("--poll-schedule-secs", default="60",
+                        help="Comma separated waits between polls for --wait, the last one repeats (default: 60)")
+    parser.add_argument("--schedule-aware", action="store_true",
+                        help="With --wait, do not poll timer sources before their schedule first fires plus "
+                             "--ingest-lag-secs")
+    parser.add_argument("--ingest-lag-secs", type=float, default=120,
+                        help="Expected time from a timer firing until its data can be queried (default: 120)")
+    parser.add_argument("--slices", type=int, default=1,
+                        help="Split each query window into this many sub-windows queried in parallel (default: 1)")
+    parser.add_argument("--state-dir", default=".",
+                        help="Directory of the per deployment incremental state files (default: .)")
+    parser.add_argument("--full-window", action="store_true",
+                        help="Query the whole window since start_time on every poll instead of incrementally")
+    parser.add_argument("--output", help="Write the consolidated results as JSON")
+    parser.add_argument("--metrics-json", help="Write timings of logins, queries and validations as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+    if args.max_requests_per_sec is not None:
+        os.environ["OBSERVE_MAX_REQUESTS_PER_SEC"] = str(args.max_requests_per_sec)
+
+    deployments = load_manifest(args.manifest)
+    sources = args.sources.split(",")
+    logger.info("Validating {} deployments with {} workers".format(len(deployments), args.workers))
+
+    reports = validate_fleet(deployments, sources, args.workers, stale_checks_mins=30, wait=args.wait,
+                             poll_schedule_secs=[float(secs) for secs in args.poll_schedule_secs.split(",")],
+                             deadline_mins=args.deadline_mins, concurrent=not args.sequential, fused=args.fused,
+                             state_dir=None if args.full_window else args.state_dir, slices=args.slices,
+                             ingest_lag_secs=args.ingest_lag_secs if args.schedule_aware else None)
+
+    logger.info("Fleet validation results:\n{}".format(table(reports, sources)))
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump({"deployments": reports}, json_file, indent=4)
+        logger.info("Results written to {}".format(args.output))
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if os.environ.get("GITHUB_STEP_SUMMARY"):
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as summary_file:
+            summary_file.write(markdown(reports, sources))
+
+    failed = [report["name"] for report in reports if not report["valid"]]
+    if failed:
+        logger.error("Failed deployments: {}".format(", ".join(failed)))
+        sys.exit(1)
+    logger.info("All {} deployments are valid".format(len(reports)))
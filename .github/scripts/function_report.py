@@ -0,0 +1,227 @@
+"""
+Execution performance of the collection function app from its FunctionAppLogs, which are sent to Observe
+through the Event Hub when function_app_debug_logs is enabled.
+
+Per function (the Event Hub trigger and the two timer functions) it reports invocations, failures, the
+duration distribution of cold and warm invocations, and for the Event Hub trigger the distribution of
+events per batch, over a window and per time bin. Host starts are reported as cold starts with their
+startup time. An invocation is cold when it is the first of its function on a host instance that started
+within the window.
+
+Uses the same environment variables as query_observe.py:
+
+    python function_report.py --window-mins 360 --bin-mins 30 --output function_report.json
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+from contextlib import closing
+
+import pipeline_config # type: ignore
+import query_observe # type: ignore
+from histogram import LogHistogram # type: ignore
+from report_common import add_window_arguments, append_step_summary, report_window, run_query # type: ignore
+from validation_state import format_iso # type: ignore
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# Executed 'Functions.timer_resources_func' (Succeeded, Id=0b2c..., Duration=10234ms)
+EXECUTED = re.compile(r"Executed '(?:Functions\.)?(?P<function>[^']+)' \((?P<status>\w+), Id=(?P<id>[^,]+), "
+                      r"Duration=(?P<duration_ms>\d+)ms\)")
+# Host started (1234ms)
+HOST_STARTED = re.compile(r"Host started \((?P<duration_ms>\d+)ms\)")
+# Trigger Details: PartitionId: 3, Offset: 100-200, EnqueueTimeUtc: ..., SequenceNumber: 5-14, Count: 10
+TRIGGER_DETAILS = re.compile(r"Trigger Details:.*?PartitionId: (?P<partition>\d+).*?Count: (?P<count>\d+)")
+
+
+class FunctionStats:
+    """Invocation statistics of one function, in total and per time bin of the invocation end"""
+
+    def __init__(self, function: str, bin_secs: int):
+        self.function = function
+        self.bin_ns = bin_secs * 10 ** 9
+        self.succeeded = 0
+        self.failed = 0
+        self.cold = LogHistogram()
+        self.warm = LogHistogram()
+        self.batch_sizes = LogHistogram(min_value=1)
+        self.bins = {}
+
+    def add_invocation(self, event_ns: int, status: str, duration_secs: float, cold: bool):
+        if status == "Succeeded":
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        (self.cold if cold else self.warm).add(duration_secs)
+        bin_stats = self.bins.setdefault(event_ns - event_ns % self.bin_ns, {"failed": 0, "duration": LogHistogram()})
+        bin_stats["duration"].add(duration_secs)
+        if status != "Succeeded":
+            bin_stats["failed"] += 1
+
+    def report(self) -> dict:
+        duration = LogHistogram()
+        duration.merge(self.cold)
+        duration.merge(self.warm)
+        invocations = self.succeeded + self.failed
+        report = {
+            "function": self.function,
+            "invocations": invocations,
+            "failed": self.failed,
+            "failure_rate": self.failed / invocations if invocations else 0.0,
+            "cold_invocations": self.cold.count,
+            "duration_secs": duration.summary(PERCENTILES),
+            "cold_duration_secs": self.cold.summary(PERCENTILES),
+            "warm_duration_secs": self.warm.summary(PERCENTILES),
+            "bins": [
+                dict(start=format_iso(bin_start / 1e9), failed=bin_stats["failed"], **bin_stats["duration"].summary(PERCENTILES))
+                for bin_start, bin_stats in sorted(self.bins.items())
+            ],
+        }
+        if self.batch_sizes.count:
+            report["batch_size"] = self.batch_sizes.summary(PERCENTILES)
+        return report
+
+
+class FunctionLogReport:
+    """Folds FunctionAppLogs rows, in time order, into per function statistics"""
+
+    def __init__(self, bin_secs: int):
+        self.bin_secs = bin_secs
+        self.functions = {}
+        self.host_starts = LogHistogram()
+        self.skipped_rows = 0
+        # Host instances started in the window, and the functions that already ran on each
+        self._warm_functions = {}
+
+    def function(self, name: str) -> FunctionStats:
+        if name not in self.functions:
+            self.functions[name] = FunctionStats(name, self.bin_secs)
+        return self.functions[name]
+
+    def add(self, item: dict):
+        """@param item: row of pipeline_config.build_function_log_pipeline()"""
+        message = item.get("message") or ""
+        host_instance = item.get("host_instance")
+        try:
+            event_ns = int(item["event_time"])
+        except (KeyError, TypeError, ValueError):
+            self.skipped_rows += 1
+            return
+
+        match = EXECUTED.search(message)
+        if match:
+            function = match.group("function")
+            warm_functions = self._warm_functions.get(host_instance)
+            cold = warm_functions is not None and function not in warm_functions
+            if warm_functions is not None:
+                warm_functions.add(function)
+            self.function(function).add_invocation(event_ns, match.group("status"),
+                                                   int(match.group("duration_ms")) / 1000, cold)
+            return
+        match = HOST_STARTED.search(message)
+        if match:
+            self.host_starts.add(int(match.group("duration_ms")) / 1000)
+            self._warm_functions[host_instance] = set()
+            return
+        match = TRIGGER_DETAILS.search(message)
+        if match and item.get("function"):
+            self.function(item["function"].split(".")[-1]).batch_sizes.add(int(match.group("count")))
+            return
+        self.skipped_rows += 1
+
+    def report(self) -> dict:
+        return {
+            "cold_starts": self.host_starts.count,
+            "host_startup_secs": self.host_starts.summary(PERCENTILES),
+            "skipped_rows": self.skipped_rows,
+            "functions": [stats.report() for _, stats in sorted(self.functions.items())],
+        }
+
+
+def measure_functions(start_time: str, end_time: str, bin_secs: int) -> FunctionLogReport:
+    """
+    @param start_time: start of the window as ISO time
+    @param end_time: end of the window as ISO time
+    @param bin_secs: width of the time bins
+    @return: per function statistics
+    """
+    token_manager = query_observe.get_token_manager()
+    rows = query_observe.query_dataset(token_manager.get(), os.environ.get("AZURE_DATASET_ID"),
+                                       pipeline=pipeline_config.build_function_log_pipeline(), startTime=start_time,
+                                       endTime=end_time, token_manager=token_manager, stream=True)
+    if rows is None:
+        raise RuntimeError("FunctionAppLogs query failed")
+
+    # Cold start detection needs the rows in time order, which the export does not guarantee.
+    # Only the matching messages are returned, so sorting them in memory is cheap.
+    with closing(rows):
+        items = sorted(rows, key=lambda item: int(item.get("event_time") or 0))
+    report = FunctionLogReport(bin_secs)
+    for item in items:
+        report.add(item)
+    logger.info("{} log rows, {} functions, {} cold starts".format(len(items), len(report.functions),
+                                                                    report.host_starts.count))
+    return report
+
+
+def markdown(report: dict) -> str:
+    lines = [
+        "## Function Performance",
+        "",
+        "{} cold starts, host startup p95 {}s".format(report["cold_starts"],
+                                                      _fmt(report["host_startup_secs"]["p95"])),
+        "",
+        "| Function | Invocations | Failed | Cold | p50 (s) | p95 (s) | p99 (s) | Max (s) | Cold p95 (s) | Batch p50 | Batch p95 |",
+        "|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    if report.get("errors"):
+        lines[2:2] = [":x: Function log query failed: {}".format(report["errors"]["functions"]), ""]
+    for function in report["functions"]:
+        duration = function["duration_secs"]
+        batch = function.get("batch_size", {})
+        lines.append("| {} | {} | {} | {} | {} | {} | {} | {} | {} | {} | {} |".format(
+            function["function"], function["invocations"], function["failed"], function["cold_invocations"],
+            *(_fmt(duration[field]) for field in ("p50", "p95", "p99", "max")),
+            _fmt(function["cold_duration_secs"]["p95"]), _fmt(batch.get("p50"), 0), _fmt(batch.get("p95"), 0)))
+    return "\n".join(lines) + "\n"
+
+
+def _fmt(value, digits: int = 2) -> str:
+    return "" if value is None else "{:.{}f}".format(value, digits)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reports function durations, cold starts, failures and batch sizes")
+    add_window_arguments(parser)
+    parser.add_argument("--bin-mins", type=float, default=10, help="Width of the time bins (default: 10)")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    start_time, end_time = report_window(args)
+
+    # A failed query still writes a report, with the error and no functions
+    errors = {}
+    report = run_query(errors, "functions", "Function log query",
+                       lambda: measure_functions(start_time, end_time, int(args.bin_mins * 60)),
+                       default=FunctionLogReport(int(args.bin_mins * 60)))
+    result = dict(start=start_time, end=end_time, errors=errors, **report.report())
+    if not result["functions"] and not errors:
+        logger.warning("No FunctionAppLogs in the window, is function_app_debug_logs enabled?")
+    for function in result["functions"]:
+        logger.info("{}: {} invocations, {} failed, duration {}".format(
+            function["function"], function["invocations"], function["failed"], function["duration_secs"]))
+
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(result, json_file, indent=4)
+        logger.info("Function report written to {}".format(args.output))
+    append_step_summary(markdown(result))
+    if errors:
+        sys.exit(1)
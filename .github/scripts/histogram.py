@@ -0,0 +1,78 @@
+import math
+
+
+class LogHistogram:
+    """
+    Fixed-memory histogram of non-negative values with log-spaced buckets, for percentiles over
+    streams too large to keep every value. Percentiles are accurate to within relative_error;
+    count, sum, min and max are exact. Histograms can be merged, e.g. time bins into a total.
+    """
+
+    def __init__(self, relative_error: float = 0.01, min_value: float = 1e-3):
+        """
+        @param relative_error: maximum relative error of reported percentiles
+        @param min_value: values at or below this (including negative ones) share the lowest bucket
+        """
+        self.relative_error = relative_error
+        self.min_value = min_value
+        self._log_gamma = math.log((1 + relative_error) / (1 - relative_error))
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float, count: int = 1):
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other: "LogHistogram"):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        @param fraction: e.g. 0.95 for p95
+        @return: approximate value at the percentile, None if empty
+        """
+        if not self.count:
+            return None
+        if fraction >= 1:
+            return self.max
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else None
+
+    def summary(self, percentiles: tuple = (0.5, 0.95, 0.99)) -> dict:
+        """@return: {count, mean, min, max, p50, p95, p99}"""
+        summary = {"count": self.count, "mean": self.mean(), "min": self.min, "max": self.max}
+        for fraction in percentiles:
+            summary["p{:g}".format(fraction * 100)] = self.percentile(fraction)
+        return summary
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return max(1, math.ceil(math.log(value / self.min_value) / self._log_gamma))
+
+    def _value(self, index: int) -> float:
+        if index == 0:
+            return self.min_value
+        # Midpoint of the bucket, within relative_error of every value in it
+        return self.min_value * 2 * math.exp(self._log_gamma * index) / (1 + math.exp(self._log_gamma))
@@ -0,0 +1,266 @@
+"""
+Performance history of the validation runs and regression detection against it.
+
+`append` adds one record per run to a gzip compressed JSON lines file: time to first data per source and
+poll attempts (query_observe.py --metrics-json), query latency percentiles, and ingestion lag percentiles
+(lag_report.py --output), with the run's collection function URL and commit, whether the run applied
+Terraform and whether validation passed. `compare` checks the latest record against a rolling baseline of
+the previous runs with a robust z-score (median and MAD), so one noisy run in the baseline does not hide or
+fake a regression. Runs that applied Terraform include the function restart and the first timer firings, so
+they are only compared with other runs that applied, and runs without an apply with runs without one.
+Failed runs are kept in the history but are neither compared nor part of a baseline:
+
+    python history.py append --history perf_history.jsonl.gz --metrics-json validation_metrics.json --lag-json lag_report.json --applied true --validation-passed true
+    python history.py compare --history perf_history.jsonl.gz --window 14 --threshold 3.5
+"""
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import os
+import statistics
+import sys
+from datetime import timezone
+
+from histogram import LogHistogram # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Counters of query_observe.py kept in the history, all of them lower-is-better. Fleet runs prefix them
+TRACKED_COUNTERS = ("time_to_data_secs_", "poll_attempts", "http_retries")
+# Scales the median absolute deviation to the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+
+
+def metrics_from_validation(report: dict) -> dict:
+    """
+    @param report: instrumentation.Metrics.report(), as written by --metrics-json
+    @return: time to data, poll attempts and HTTP retries counters and login/query latency percentiles
+    """
+    values = {name: value for name, value in report.get("counters", {}).items()
+              if any(counter in name for counter in TRACKED_COUNTERS)}
+    for phase in ("query", "login"):
+        durations = LogHistogram()
+        ttfbs = LogHistogram()
+        for call in report.get("calls", []):
+            if call.get("phase") == phase and "duration_secs" in call:
+                durations.add(call["duration_secs"])
+                if call.get("ttfb_secs") is not None:
+                    ttfbs.add(call["ttfb_secs"])
+        if durations.count:
+            values["{}_p50_secs".format(phase)] = durations.percentile(0.5)
+            values["{}_p95_secs".format(phase)] = durations.percentile(0.95)
+        if ttfbs.count:
+            values["{}_ttfb_p50_secs".format(phase)] = ttfbs.percentile(0.5)
+    return values
+
+
+def metrics_from_lag(report: dict) -> dict:
+    """
+    @param report: lag_report.py --output
+    @return: lag_{source}_{statistic}_secs
+    """
+    values = {}
+    for source in report.get("sources", []):
+        for statistic in ("p50", "p95", "p99", "max"):
+            value = source["lag_secs"].get(statistic)
+            if value is not None:
+                values["lag_{}_{}_secs".format(source["source"], statistic)] = value
+    return values
+
+
+def make_record(metrics: dict, func_url: str = None, applied: bool = None, validation_passed: bool = None) -> dict:
+    """
+    @param metrics: see metrics_from_validation and metrics_from_lag
+    @param func_url: collection function URL. Defaults to $AZURE_COLLECTION_FUNCTION
+    @param applied: whether the run applied Terraform before validating
+    @param validation_passed: whether the data validation of the run passed
+    @return: history record of this run, with the GitHub Actions run context when available
+    """
+    return {
+        "timestamp": datetime.datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "run_id": os.environ.get("GITHUB_RUN_ID"),
+        "event": os.environ.get("GITHUB_EVENT_NAME"),
+        "ref": os.environ.get("GITHUB_REF"),
+        "sha": os.environ.get("GITHUB_SHA"),
+        "func_url": func_url or os.environ.get("AZURE_COLLECTION_FUNCTION"),
+        "applied": applied,
+        "validation_passed": validation_passed,
+        "metrics": metrics,
+    }
+
+
+def load(path: str) -> list:
+    """@return: records of the history file, oldest first. Empty if the file does not exist yet"""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with gzip.open(path, "rt") as history_file:
+        for line in history_file:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def append(path: str, record: dict, keep: int = None):
+    """
+    Appends the record as a new gzip member, or rewrites the file when it holds more than keep records.
+
+    @param path: history file
+    @param record: see make_record
+    @param keep: number of most recent records to keep, None keeps all
+    """
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    if keep is not None:
+        records = load(path)
+        if len(records) >= keep:
+            tmp_path = path + ".tmp"
+            with gzip.open(tmp_path, "wt") as history_file:
+                for kept in records[len(records) - keep + 1:]:
+                    history_file.write(json.dumps(kept, separators=(",", ":")) + "\n")
+                history_file.write(line)
+            os.replace(tmp_path, path)
+            return
+    with gzip.open(path, "at") as history_file:
+        history_file.write(line)
+
+
+def comparable(record: dict, current: dict) -> bool:
+    """@return: whether the record is part of the baseline of current: a passed run with the same apply state"""
+    return record.get("validation_passed") is True and record.get("applied") == current.get("applied")
+
+
+def compare(records: list, window: int = 14, threshold: float = 3.5, min_runs: int = 5,
+            min_change: float = 0.2) -> list:
+    """
+    Compares the last record with the window of comparable records before it, see comparable. Every metric
+    is lower-is-better.
+
+    @param records: history, oldest first
+    @param window: number of previous comparable records forming the baseline
+    @param threshold: robust z-score above which a metric regressed
+    @param min_runs: baseline values a metric needs to be compared
+    @param min_change: relative increase over the baseline median a regression also needs, so a very
+                       stable baseline does not flag negligible changes
+    @return: one result per metric of the last record, empty if the last run failed
+    """
+    current = records[-1]
+    if current.get("validation_passed") is False:
+        return []
+    baseline = [record for record in records[:-1] if comparable(record, current)][-window:]
+    results = []
+    for name, value in sorted(current["metrics"].items()):
+        history = [record["metrics"][name] for record in baseline if name in record.get("metrics", {})]
+        result = {"metric": name, "value": value, "baseline_runs": len(history), "median": None, "z": None,
+                  "regression": False}
+        if len(history) >= min_runs:
+            median = statistics.median(history)
+            mad = statistics.median(abs(past - median) for past in history)
+            # A constant baseline has no spread, fall back to a tenth of min_change so z stays finite
+            scale = MAD_SCALE * mad or abs(median) * min_change / 10 or 1e-9
+            result["median"] = median
+            result["z"] = (value - median) / scale
+            result["regression"] = result["z"] > threshold and value > median * (1 + min_change)
+        results.append(result)
+    return results
+
+
+def markdown(records: list, results: list) -> str:
+    current = records[-1]
+    lines = ["## Performance History", ""]
+    previous_urls = {record.get("func_url") for record in records[:-1]}
+    if previous_urls and current.get("func_url") not in previous_urls:
+        lines.extend(["New collection function: `{}`".format(current.get("func_url")), ""])
+    if current.get("validation_passed") is False:
+        lines.append("Validation failed, the run is recorded but not compared")
+        return "\n".join(lines) + "\n"
+    regressions = [result for result in results if result["regression"]]
+    if not regressions:
+        compared = sum(result["z"] is not None for result in results)
+        lines.append("No regressions in {} metrics compared with the last {} runs {} a Terraform apply".format(
+            compared, max([result["baseline_runs"] for result in results] or [0]),
+            "with" if current.get("applied") else "without"))
+        return "\n".join(lines) + "\n"
+    lines.extend([
+        "| Metric | Value | Baseline median | Robust z |",
+        "|---|---|---|---|",
+    ])
+    for result in regressions:
+        lines.append("| :x: {} | {:.2f} | {:.2f} | {:.1f} |".format(
+            result["metric"], result["value"], result["median"], result["z"]))
+    return "\n".join(lines) + "\n"
+
+
+def _boolean(value: str) -> bool:
+    """argparse type of true/false flags, as rendered by GitHub Actions expressions"""
+    if value.lower() not in ("true", "false"):
+        raise argparse.ArgumentTypeError("expected true or false, got {!r}".format(value))
+    return value.lower() == "true"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keeps a history of validation performance and detects regressions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    append_parser = subparsers.add_parser("append", help="Append this run's metrics to the history")
+    append_parser.add_argument("--history", default="perf_history.jsonl.gz", help="History file")
+    append_parser.add_argument("--metrics-json", help="query_observe.py --metrics-json output")
+    append_parser.add_argument("--lag-json", help="lag_report.py --output output")
+    append_parser.add_argument("--func-url", help="Collection function URL (default: $AZURE_COLLECTION_FUNCTION)")
+    append_parser.add_argument("--keep", type=int, default=500, help="Most recent records kept (default: 500)")
+    append_parser.add_argument("--applied", type=_boolean, required=True,
+                               help="true if the run applied Terraform before validating, else false")
+    append_parser.add_argument("--validation-passed", type=_boolean, required=True,
+                               help="true if the data validation of the run passed, else false")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare the latest run with the previous ones")
+    compare_parser.add_argument("--history", default="perf_history.jsonl.gz", help="History file")
+    compare_parser.add_argument("--window", type=int, default=14, help="Runs in the baseline (default: 14)")
+    compare_parser.add_argument("--threshold", type=float, default=3.5, help="Robust z-score threshold (default: 3.5)")
+    compare_parser.add_argument("--min-runs", type=int, default=5,
+                                help="Baseline runs needed to compare a metric (default: 5)")
+    compare_parser.add_argument("--min-change", type=float, default=0.2,
+                                help="Relative increase a regression also needs (default: 0.2)")
+    compare_parser.add_argument("--output", help="Write the comparison as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "append":
+        metrics = {}
+        for path, extract in ((args.metrics_json, metrics_from_validation), (args.lag_json, metrics_from_lag)):
+            if path and os.path.exists(path):
+                with open(path) as report_file:
+                    metrics.update(extract(json.load(report_file)))
+            elif path:
+                logger.warning("{} not found, skipping".format(path))
+        if not metrics:
+            logger.error("No metrics to append")
+            sys.exit(1)
+        append(args.history, make_record(metrics, args.func_url, args.applied, args.validation_passed), args.keep)
+        logger.info("Appended {} metrics to {} (applied: {}, validation passed: {})".format(
+            len(metrics), args.history, args.applied, args.validation_passed))
+        sys.exit(0)
+
+    records = load(args.history)
+    if not records:
+        logger.error("{} has no records".format(args.history))
+        sys.exit(1)
+    results = compare(records, args.window, args.threshold, args.min_runs, args.min_change)
+    for result in results:
+        if result["regression"]:
+            logger.error("{}: {:.2f} vs baseline median {:.2f} (robust z {:.1f})".format(
+                result["metric"], result["value"], result["median"], result["z"]))
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump({"record": records[-1], "results": results}, json_file, indent=4)
+    if os.environ.get("GITHUB_STEP_SUMMARY"):
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as summary_file:
+            summary_file.write(markdown(records, results))
+    if any(result["regression"] for result in results):
+        sys.exit(1)
+    if records[-1].get("validation_passed") is False:
+        logger.warning("Validation of the latest run failed, it is recorded but not compared")
+        sys.exit(0)
+    logger.info("No regressions against the last {} comparable runs".format(args.window))
@@ -0,0 +1,239 @@
+import cProfile
+import functools
+import inspect
+import json
+import math
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Fields summed per phase in reports, besides the call durations
+_SUMMED_FIELDS = ("bytes", "rows", "decode_secs")
+
+
+def _percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+class Metrics:
+    """
+    Records timings and sizes of hot-path calls (login, query, validation) and exports them as a JSON
+    report, a Prometheus textfile or a Markdown table. Safe to use from several threads.
+
+    Each call is a dict with phase, labels, start, duration_secs and optional fields such as
+    ttfb_secs, bytes, rows, decode_secs, status and result.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def start(self, phase: str, **labels) -> dict:
+        """Starts recording a call, finish it with finish(). For calls that end later, e.g. streamed responses"""
+        call = {"phase": phase, "labels": labels, "start": time.time(), "_perf_start": time.perf_counter()}
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    def finish(self, call: dict):
+        if "duration_secs" not in call:
+            call["duration_secs"] = time.perf_counter() - call.pop("_perf_start")
+
+    @contextmanager
+    def timed(self, phase: str, **labels):
+        """Records the duration of the with block, yielding the call to add fields to"""
+        call = self.start(phase, **labels)
+        try:
+            yield call
+        finally:
+            self.finish(call)
+
+    def record_calls(self, phase: str, label_args: tuple = ()):
+        """
+        Decorator recording each call of a function, its result and the given arguments as labels
+
+        @param phase: phase name of the calls
+        @param label_args: names of arguments to use as labels
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                labels = {name: bound.arguments.get(name) for name in label_args}
+                with self.timed(phase, **labels) as call:
+                    result = func(*args, **kwargs)
+                    if isinstance(result, (bool, int, float, str)):
+                        call["result"] = result
+                    return result
+            return wrapper
+        return decorator
+
+    def set_counter(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = value
+
+    def summary(self) -> list:
+        """
+        @return: aggregates per phase and labels: calls, total/p50/p95/max duration, p50 time to first byte
+                 and the sums of bytes, rows and decode time
+        """
+        groups = {}
+        with self._lock:
+            calls = [call for call in self.calls if "duration_secs" in call]
+        for call in calls:
+            key = (call["phase"], tuple(sorted((k, str(v)) for k, v in call["labels"].items())))
+            groups.setdefault(key, []).append(call)
+
+        summary = []
+        for (phase, labels), group in groups.items():
+            durations = sorted(call["duration_secs"] for call in group)
+            ttfbs = sorted(call["ttfb_secs"] for call in group if "ttfb_secs" in call)
+            entry = {
+                "phase": phase,
+                "labels": dict(labels),
+                "calls": len(group),
+                "total_secs": sum(durations),
+                "p50_secs": _percentile(durations, 0.5),
+                "p95_secs": _percentile(durations, 0.95),
+                "max_secs": durations[-1],
+            }
+            if ttfbs:
+                entry["ttfb_p50_secs"] = _percentile(ttfbs, 0.5)
+            for field in _SUMMED_FIELDS:
+                if any(field in call for call in group):
+                    entry[field] = sum(call.get(field, 0) for call in group)
+            summary.append(entry)
+        return summary
+
+    def report(self) -> dict:
+        with self._lock:
+            calls = [{k: v for k, v in call.items() if not k.startswith("_")} for call in self.calls]
+            counters = dict(self.counters)
+        return {"summary": self.summary(), "counters": counters, "calls": calls}
+
+    def write_json(self, path: str):
+        with open(path, "w") as json_file:
+            json.dump(self.report(), json_file, indent=4, default=str)
+
+    def write_prometheus(self, path: str, prefix: str = "observe_validator"):
+        """Writes a textfile for the node_exporter textfile collector"""
+        lines = [
+            "# HELP {}_duration_seconds Duration of validator calls by phase".format(prefix),
+            "# TYPE {}_duration_seconds summary".format(prefix),
+        ]
+        summary = self.summary()
+        for entry in summary:
+            labels = dict(entry["labels"], phase=entry["phase"])
+            for quantile, field in (("0.5", "p50_secs"), ("0.95", "p95_secs")):
+                lines.append("{}_duration_seconds{} {}".format(
+                    prefix, _prometheus_labels(dict(labels, quantile=quantile)), entry[field]))
+            lines.append("{}_duration_seconds_sum{} {}".format(prefix, _prometheus_labels(labels), entry["total_secs"]))
+            lines.append("{}_duration_seconds_count{} {}".format(prefix, _prometheus_labels(labels), entry["calls"]))
+        for field, metric in (("bytes", "bytes_received_total"), ("rows", "rows_parsed_total"),
+                              ("decode_secs", "decode_seconds_total")):
+            entries = [entry for entry in summary if field in entry]
+            if entries:
+                lines.append("# TYPE {}_{} counter".format(prefix, metric))
+            for entry in entries:
+                labels = dict(entry["labels"], phase=entry["phase"])
+                lines.append("{}_{}{} {}".format(prefix, metric, _prometheus_labels(labels), entry[field]))
+        for name, value in sorted(self.report()["counters"].items()):
+            lines.append("# TYPE {}_{} gauge".format(prefix, name))
+            lines.append("{}_{} {}".format(prefix, name, value))
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as prom_file:
+            prom_file.write("\n".join(lines) + "\n")
+        # Rename so the textfile collector never reads a partial file
+        os.replace(tmp_path, path)
+
+    def markdown(self, title: str = "Data Validation Timings") -> str:
+        lines = [
+            "## {}".format(title),
+            "",
+            "| Phase | Labels | Calls | Total (s) | p50 (s) | p95 (s) | Max (s) | TTFB p50 (s) | Bytes | Rows | Decode (s) |",
+            "|---|---|---|---|---|---|---|---|---|---|---|",
+        ]
+        for entry in self.summary():
+            labels = ", ".join("{}={}".format(k, v) for k, v in entry["labels"].items())
+            lines.append("| {} | {} | {} | {:.3f} | {:.3f} | {:.3f} | {:.3f} | {} | {} | {} | {} |".format(
+                entry["phase"], labels, entry["calls"], entry["total_secs"], entry["p50_secs"], entry["p95_secs"],
+                entry["max_secs"], _optional(entry, "ttfb_p50_secs", "{:.3f}"), _optional(entry, "bytes", "{}"),
+                _optional(entry, "rows", "{}"), _optional(entry, "decode_secs", "{:.3f}")))
+        counters = self.report()["counters"]
+        if counters:
+            lines.append("")
+            lines.append(", ".join("{}: {}".format(name, value) for name, value in sorted(counters.items())))
+        return "\n".join(lines) + "\n"
+
+    def append_markdown(self, path: str, title: str = "Data Validation Timings"):
+        with open(path, "a") as summary_file:
+            summary_file.write(self.markdown(title))
+
+
+class ThreadProfiler:
+    """
+    cProfile of the enabling thread and of every thread started while it is enabled, such as the source and
+    slice query workers, merged into one stats file. cProfile.Profile alone only sees the thread enabling it.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self._profile_thread()
+        threading.setprofile(self._start_thread)
+
+    def _start_thread(self, frame, event, arg):
+        # Runs once in each new thread, the enabled profiler replaces this hook
+        self._profile_thread()
+
+    def _profile_thread(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ profiles all threads with the one profiler that may be active at a time
+            return
+        with self._lock:
+            self.profiles.append(profile)
+
+    def disable(self):
+        threading.setprofile(None)
+        self.profiles[0].disable()
+
+    def stats(self) -> pstats.Stats:
+        """@return: merged stats of all profiled threads, call after disable() once the threads finished"""
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def dump_stats(self, path: str):
+        self.stats().dump_stats(path)
+
+
+def _prometheus_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = ('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for k, v in sorted(labels.items()))
+    return "{" + ",".join(escaped) + "}"
+
+
+def _optional(entry: dict, field: str, fmt: str) -> str:
+    return fmt.format(entry[field]) if field in entry else ""
+
+
+# Shared recorder for the validation scripts
+metrics = Metrics()
@@ -0,0 +1,178 @@
+"""
+Ingestion lag report per source: the lag between an event's own time and the time Observe ingested it
+(BUNDLE_TIMESTAMP), as p50/p95/p99/max over a window and per time bin, checked against SLO thresholds.
+
+The event time is FIELDS.time for EventHub (parsed like the EventHub validation pipeline) and
+timeseries[0].data[0].timeStamp for VmMetrics. Rows are streamed into fixed-memory histograms, so long
+windows do not need the raw rows in memory.
+
+Uses the same environment variables as query_observe.py:
+
+    python lag_report.py --window-mins 60 --bin-mins 5 --slo-p95-secs 300 --output lag_report.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from contextlib import closing
+
+import pipeline_config # type: ignore
+import query_observe # type: ignore
+from histogram import LogHistogram # type: ignore
+from report_common import add_window_arguments, append_step_summary, report_window, run_query # type: ignore
+from validation_state import format_iso # type: ignore
+
+logger = logging.getLogger(__name__)
+
+LAG_SOURCES = list(pipeline_config.lag_stages)
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class SourceLag:
+    """Lag histograms of one source, in total and per time bin of the ingest time"""
+
+    def __init__(self, source: str, bin_secs: int):
+        self.source = source
+        self.bin_ns = bin_secs * 10 ** 9
+        self.total = LogHistogram()
+        self.bins = {}
+        self.skipped_rows = 0
+
+    def add(self, item: dict):
+        """@param item: row with event_time and BUNDLE_TIMESTAMP in ns"""
+        try:
+            event_ns = int(item["event_time"])
+            ingest_ns = int(item["BUNDLE_TIMESTAMP"])
+        except (KeyError, TypeError, ValueError):
+            self.skipped_rows += 1
+            return
+        # Lag below zero means clock skew between the emitter and Observe, count it as no lag
+        lag_secs = max(0.0, (ingest_ns - event_ns) / 1e9)
+        self.total.add(lag_secs)
+        bin_start = ingest_ns - ingest_ns % self.bin_ns
+        self.bins.setdefault(bin_start, LogHistogram()).add(lag_secs)
+
+    def report(self) -> dict:
+        return {
+            "source": self.source,
+            "skipped_rows": self.skipped_rows,
+            "lag_secs": self.total.summary(PERCENTILES),
+            "bins": [
+                dict(start=format_iso(bin_start / 1e9), **histogram.summary(PERCENTILES))
+                for bin_start, histogram in sorted(self.bins.items())
+            ],
+        }
+
+
+def measure_lag(source: str, start_time: str, end_time: str, bin_secs: int) -> SourceLag:
+    """
+    @param source: key of pipeline_config.lag_stages
+    @param start_time: start of the window as ISO time
+    @param end_time: end of the window as ISO time
+    @param bin_secs: width of the time bins
+    @return: lag histograms of the source
+    """
+    token_manager = query_observe.get_token_manager()
+    rows = query_observe.query_dataset(token_manager.get(), os.environ.get("AZURE_DATASET_ID"),
+                                       pipeline=pipeline_config.build_lag_pipeline(source), startTime=start_time,
+                                       endTime=end_time, token_manager=token_manager, stream=True)
+    if rows is None:
+        raise RuntimeError("{}: Lag query failed".format(source))
+
+    lag = SourceLag(source, bin_secs)
+    with closing(rows):
+        for item in rows:
+            lag.add(item)
+    logger.info("{}: {} rows, lag {}".format(source, lag.total.count, lag.total.summary(PERCENTILES)))
+    return lag
+
+
+def check_slo(report: dict, thresholds: dict) -> list:
+    """
+    @param report: SourceLag.report()
+    @param thresholds: maximum lag in seconds per statistic, e.g. {"p95": 300, "max": 1800}
+    @return: descriptions of the violated thresholds
+    """
+    violations = []
+    lag = report["lag_secs"]
+    if not lag["count"]:
+        return ["{}: no rows in window".format(report["source"])]
+    for statistic, threshold in thresholds.items():
+        if lag[statistic] is not None and lag[statistic] > threshold:
+            violations.append("{}: {} lag {:.1f}s > SLO {:.1f}s".format(
+                report["source"], statistic, lag[statistic], threshold))
+    return violations
+
+
+def markdown(reports: list, violations: list, errors: dict = None) -> str:
+    lines = [
+        "## Ingestion Lag",
+        "",
+        "| Source | Rows | p50 (s) | p95 (s) | p99 (s) | Max (s) |",
+        "|---|---|---|---|---|---|",
+    ]
+    for report in reports:
+        lag = report["lag_secs"]
+        lines.append("| {} | {} | {} | {} | {} | {} |".format(
+            report["source"], lag["count"], *(_fmt(lag[field]) for field in ("p50", "p95", "p99", "max"))))
+    for source in errors or {}:
+        lines.append("| :x: {} | query failed | | | | |".format(source))
+    lines.append("")
+    lines.extend("- :x: {}".format(violation) for violation in violations)
+    if not violations and not errors:
+        lines.append("All sources within SLO")
+    return "\n".join(lines) + "\n"
+
+
+def _fmt(value) -> str:
+    return "" if value is None else "{:.1f}".format(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reports ingestion lag percentiles per source")
+    parser.add_argument("--sources", default=",".join(LAG_SOURCES),
+                        help="Comma separated sources (default: {})".format(",".join(LAG_SOURCES)))
+    add_window_arguments(parser)
+    parser.add_argument("--bin-mins", type=float, default=5, help="Width of the time bins (default: 5)")
+    for statistic in ("p50", "p95", "p99", "max"):
+        parser.add_argument("--slo-{}-secs".format(statistic), type=float,
+                            help="Fail if the {} lag of a source exceeds this".format(statistic))
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    start_time, end_time = report_window(args)
+    thresholds = {statistic: getattr(args, "slo_{}_secs".format(statistic))
+                  for statistic in ("p50", "p95", "p99", "max")
+                  if getattr(args, "slo_{}_secs".format(statistic)) is not None}
+
+    reports = []
+    violations = []
+    # A failed source is recorded in the report, the other sources are still measured and written
+    errors = {}
+    for source in args.sources.split(","):
+        lag = run_query(errors, source, "{}: Lag measurement".format(source),
+                        lambda: measure_lag(source, start_time, end_time, int(args.bin_mins * 60)))
+        if lag is None:
+            continue
+        report = lag.report()
+        reports.append(report)
+        if thresholds:
+            violations.extend(check_slo(report, thresholds))
+
+    result = {"start": start_time, "end": end_time, "slo_secs": thresholds, "sources": reports,
+              "violations": violations, "errors": errors}
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(result, json_file, indent=4)
+        logger.info("Lag report written to {}".format(args.output))
+    append_step_summary(markdown(reports, violations, errors))
+
+    for violation in violations:
+        logger.error(violation)
+    if errors:
+        logger.error("Lag of {} could not be measured".format(", ".join(errors)))
+    if violations or errors:
+        sys.exit(1)
@@ -0,0 +1,341 @@
+"""
+Synthetic load generator for the Event Hub -> collection function -> Observe pipeline.
+
+Publishes Azure diagnostic-log events of the shape eventhub_pipeline parses ({"records": [{time, category,
+resourceId, properties: {appName, message}}]}) at a controlled rate and partition spread, in steps of
+increasing rate. After each step it measures the delivered throughput and end-to-end lag, either in Observe
+through the query client (events are tagged with a per-run appName) or at a local stub sink.
+
+    # Against Azure (requires the azure-eventhub package)
+    EVENTHUB_CONNECTION_STRING=... python load_generator.py --sink eventhub --eventhub-name <name> --rates 100,500,1000
+
+    # Offline, against a stub sink in this process
+    python load_generator.py --sink stub --rates 100,500,1000 --step-secs 10
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests # type: ignore
+
+from histogram import LogHistogram # type: ignore
+from validation_state import format_iso # type: ignore
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ["FunctionAppLogs", "AppServiceHTTPLogs", "AuditEvent", "StorageRead", "StorageWrite"]
+# Pacing granularity of the publisher
+_TICK_SECS = 0.1
+
+
+def make_event(run_id: str, sequence: int, records_per_event: int, message_bytes: int, rng: random.Random) -> dict:
+    """
+    @param run_id: tags the records through properties.appName so they can be found in Observe
+    @param sequence: event number, part of each record's message
+    @param records_per_event: diagnostic records batched in one event, as Azure Monitor does
+    @param message_bytes: approximate size of each record's message
+    @param rng: random source for categories and resources
+    @return: event body
+    """
+    now = datetime.datetime.now(timezone.utc)
+    records = []
+    for index in range(records_per_event):
+        message = "loadgen seq={} rec={} ".format(sequence, index)
+        records.append({
+            "time": now.strftime('%Y-%m-%dT%H:%M:%S.%f0Z'),
+            "category": rng.choice(CATEGORIES),
+            "resourceId": "/SUBSCRIPTIONS/00000000-0000-0000-0000-000000000000/RESOURCEGROUPS/LOADGEN/PROVIDERS/"
+                          "MICROSOFT.WEB/SITES/LOADGEN-{}".format(rng.randrange(8)),
+            "operationName": "Microsoft.Web/sites/functions/log",
+            "level": "Informational",
+            "properties": {
+                "appName": "loadgen-{}".format(run_id),
+                "roleInstance": "loadgen",
+                "message": message + "x" * max(0, message_bytes - len(message)),
+                "category": "Function.loadgen",
+                "level": "Information",
+            },
+        })
+    return {"records": records}
+
+
+class EventHubSink:
+    """Publishes to an Event Hub or the Event Hubs emulator with the azure-eventhub SDK"""
+
+    def __init__(self, connection_string: str, eventhub_name: str):
+        try:
+            from azure.eventhub import EventData, EventHubProducerClient # type: ignore
+        except ImportError:
+            raise SystemExit("The eventhub sink requires the azure-eventhub package: pip install azure-eventhub")
+        self._event_data = EventData
+        self.producer = EventHubProducerClient.from_connection_string(connection_string, eventhub_name=eventhub_name)
+
+    def send(self, partition_id: int, events: list):
+        batch = self.producer.create_batch(partition_id=str(partition_id))
+        for event in events:
+            data = self._event_data(json.dumps(event))
+            try:
+                batch.add(data)
+            except ValueError:
+                # Batch is full, send it and start another
+                self.producer.send_batch(batch)
+                batch = self.producer.create_batch(partition_id=str(partition_id))
+                batch.add(data)
+        self.producer.send_batch(batch)
+
+    def close(self):
+        self.producer.close()
+
+
+class HttpSink:
+    """POSTs each partition's events as a JSON list to {url}/partitions/{id}/messages, e.g. to a StubSink"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def send(self, partition_id: int, events: list):
+        response = self.session.post("{}/partitions/{}/messages".format(self.url, partition_id), json=events,
+                                     timeout=(5, 30))
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class StubSink:
+    """
+    Local stand-in for the Event Hub receiving HttpSink posts. Records per partition counts and the lag
+    between each record's time and its arrival, so the harness can be tested without Azure.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.partitions = {}
+        self.events = []
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                received_ns = time.time_ns()
+                events = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                partition_id = self.path.strip("/").split("/")[1]
+                sink.record(partition_id, events, received_ns)
+                self.send_response(201)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self) -> "StubSink":
+        threading.Thread(target=self.server.serve_forever, name="stub-sink", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record(self, partition_id: str, events: list, received_ns: int):
+        with self._lock:
+            self.partitions[partition_id] = self.partitions.get(partition_id, 0) + len(events)
+            for event in events:
+                for record in event["records"]:
+                    self.events.append((received_ns, record["time"]))
+
+    def measure(self, start_ns: int, end_ns: int) -> dict:
+        """@return: records received in [start_ns, end_ns) and their lag"""
+        lag = LogHistogram()
+        with self._lock:
+            events = [event for event in self.events if start_ns <= event[0] < end_ns]
+        for received_ns, record_time in events:
+            lag.add(max(0.0, received_ns / 1e9 - _parse_record_time(record_time)))
+        return {"delivered": lag.count, "lag_secs": lag.summary()}
+
+
+def _parse_record_time(record_time: str) -> float:
+    # Azure writes 7 fractional digits, trim to microseconds for datetime
+    base, _, fraction = record_time.rstrip("Z").partition(".")
+    parsed = datetime.datetime.strptime(base, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    return parsed.timestamp() + float("0." + (fraction or "0"))
+
+
+class ObserveMeasurer:
+    """Measures delivered records and their lag in Observe, through the query client of query_observe.py"""
+
+    def __init__(self, run_id: str):
+        import query_observe # type: ignore
+        import pipeline_config # type: ignore
+        from opal_pipeline import Filter # type: ignore
+
+        self.query_observe = query_observe
+        self.pipeline = pipeline_config.collection_pipeline(['EventHub']).then(
+            Filter("string(FIELDS.properties.appName) = 'loadgen-{}'".format(run_id)),
+            *pipeline_config.lag_stages['EventHub']
+        ).render()
+
+    def measure(self, start_ns: int, end_ns: int) -> dict:
+        """@return: records ingested in [start_ns, end_ns) and their lag"""
+        token_manager = self.query_observe.get_token_manager()
+        rows = self.query_observe.query_dataset(token_manager.get(), os.environ.get("AZURE_DATASET_ID"),
+                                                pipeline=self.pipeline, startTime=format_iso(start_ns / 1e9),
+                                                endTime=format_iso(end_ns / 1e9), token_manager=token_manager, stream=True)
+        if rows is None:
+            raise RuntimeError("Observe query failed")
+        lag = LogHistogram()
+        with closing(rows):
+            for item in rows:
+                try:
+                    lag.add(max(0.0, (int(item["BUNDLE_TIMESTAMP"]) - int(item["event_time"])) / 1e9))
+                except (KeyError, TypeError, ValueError):
+                    continue
+        return {"delivered": lag.count, "lag_secs": lag.summary()}
+
+
+def publish_step(sink, run_id: str, rate: float, duration_secs: float, partitions: list, records_per_event: int,
+                 message_bytes: int, rng: random.Random, first_sequence: int = 0) -> dict:
+    """
+    Publishes events at a constant rate, spreading them round-robin over the partitions.
+
+    @param sink: EventHubSink, HttpSink or any object with send(partition_id, events)
+    @param rate: events per second
+    @param duration_secs: length of the step
+    @param partitions: partition ids to publish to
+    @return: events and records published and the achieved rate
+    """
+    start = time.monotonic()
+    published = 0
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= duration_secs:
+            break
+        due = min(int(rate * min(elapsed + _TICK_SECS, duration_secs)), int(rate * duration_secs)) - published
+        if due > 0:
+            by_partition = {}
+            for offset in range(due):
+                sequence = first_sequence + published + offset
+                by_partition.setdefault(partitions[sequence % len(partitions)], []).append(
+                    make_event(run_id, sequence, records_per_event, message_bytes, rng))
+            for partition_id, events in by_partition.items():
+                sink.send(partition_id, events)
+            published += due
+        sleep = start + elapsed + _TICK_SECS - time.monotonic()
+        if sleep > 0:
+            time.sleep(sleep)
+    elapsed = time.monotonic() - start
+    return {
+        "events": published,
+        "records": published * records_per_event,
+        "publish_rate": published / elapsed if elapsed else 0.0,
+    }
+
+
+def run_load_test(sink, measurer, rates: list, step_secs: float, settle_secs: float, partitions: list,
+                  records_per_event: int, message_bytes: int, run_id: str, seed: int = None) -> list:
+    """
+    Runs one step per rate and measures each step's delivery once it had settle_secs to arrive.
+
+    @return: one result per step. delivered counts records and delivered_records_rate is in records/sec,
+        delivered_event_rate is in events/sec like target_rate and publish_rate
+    """
+    rng = random.Random(seed)
+    results = []
+    sequence = 0
+    for rate in rates:
+        start_ns = time.time_ns()
+        published = publish_step(sink, run_id, rate, step_secs, partitions, records_per_event, message_bytes, rng,
+                                 sequence)
+        sequence += published["events"]
+        logger.info("Rate {}/s: published {} events ({:.1f}/s), waiting {}s for delivery".format(
+            rate, published["events"], published["publish_rate"], settle_secs))
+        time.sleep(settle_secs)
+        measured = measurer.measure(start_ns, time.time_ns())
+        result = dict(target_rate=rate, step_secs=step_secs, **published, **measured)
+        result["delivered_ratio"] = measured["delivered"] / published["records"] if published["records"] else 0.0
+        # Measurers count records, target_rate and publish_rate count events of records_per_event records each
+        result["delivered_records_rate"] = measured["delivered"] / step_secs
+        result["delivered_event_rate"] = measured["delivered"] / records_per_event / step_secs
+        logger.info("Rate {}/s: delivered {} of {} records ({:.0%}), lag p95 {:.3f}s".format(
+            rate, measured["delivered"], published["records"], result["delivered_ratio"],
+            measured["lag_secs"]["p95"] or 0.0))
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Publishes synthetic diagnostic logs and measures delivery")
+    parser.add_argument("--sink", choices=["eventhub", "http", "stub"], default="stub",
+                        help="eventhub: Azure or emulator via $EVENTHUB_CONNECTION_STRING, http: --sink-url, "
+                             "stub: local stub sink (default)")
+    parser.add_argument("--eventhub-name", default=os.environ.get("EVENTHUB_NAME"), help="Event Hub name")
+    parser.add_argument("--sink-url", help="URL of an HTTP sink, e.g. a stub sink started elsewhere")
+    parser.add_argument("--rates", default="10,50,100", help="Comma separated events/sec per step (default: 10,50,100)")
+    parser.add_argument("--step-secs", type=float, default=60, help="Length of each step (default: 60)")
+    parser.add_argument("--settle-secs", type=float, default=None,
+                        help="Wait after each step before measuring (default: 300 in Observe, 1 for the stub)")
+    parser.add_argument("--partitions", type=int, default=32, help="Partitions to spread events over (default: 32)")
+    parser.add_argument("--records-per-event", type=int, default=10, help="Records per event (default: 10)")
+    parser.add_argument("--message-bytes", type=int, default=200, help="Approximate message size (default: 200)")
+    parser.add_argument("--seed", type=int, help="Seed for repeatable payloads")
+    parser.add_argument("--output", default="load_test.json", help="Results file (default: load_test.json)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    run_id = uuid.uuid4().hex[:12]
+    partitions = list(range(args.partitions))
+
+    stub_sink = None
+    if args.sink == "eventhub":
+        if not args.eventhub_name or not os.environ.get("EVENTHUB_CONNECTION_STRING"):
+            parser.error("--sink eventhub needs --eventhub-name and $EVENTHUB_CONNECTION_STRING")
+        sink = EventHubSink(os.environ["EVENTHUB_CONNECTION_STRING"], args.eventhub_name)
+        measurer = ObserveMeasurer(run_id)
+    elif args.sink == "http":
+        if not args.sink_url:
+            parser.error("--sink http needs --sink-url")
+        sink = HttpSink(args.sink_url)
+        measurer = ObserveMeasurer(run_id)
+    else:
+        stub_sink = StubSink().start()
+        sink = HttpSink(stub_sink.url)
+        measurer = stub_sink
+    settle_secs = args.settle_secs if args.settle_secs is not None else (1 if stub_sink else 300)
+
+    logger.info("Load test run {} publishing to {} sink".format(run_id, args.sink))
+    try:
+        results = run_load_test(sink, measurer, [float(rate) for rate in args.rates.split(",")], args.step_secs,
+                                settle_secs, partitions, args.records_per_event, args.message_bytes, run_id,
+                                args.seed)
+    finally:
+        sink.close()
+        if stub_sink is not None:
+            stub_sink.stop()
+
+    report = {"run_id": run_id, "sink": args.sink, "partitions": args.partitions,
+              "records_per_event": args.records_per_event, "message_bytes": args.message_bytes, "steps": results}
+    if stub_sink is not None:
+        report["partition_counts"] = stub_sink.partitions
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=4)
+    logger.info("Results written to {}".format(args.output))
+    sys.exit(0 if all(step["delivered"] for step in results) else 1)
@@ -0,0 +1,172 @@
+"""
+NCRONTAB expressions of Azure Functions timer triggers, as used by the timer_*_func_schedule variables:
+
+    {second} {minute} {hour} {day} {month} {day-of-week}
+
+Each field is *, a value, a range (a-b), a step (*/n, a-b/n, a/n) or a comma separated list of those.
+Months and days of the week also accept three letter names (JAN, MON); Sunday is 0 or 7. Five field
+expressions without the seconds field fire at second 0. As in the NCrontab library used by the Functions
+host, a time matches when the day of the month AND the day of the week match. Times are UTC, the default
+of the Functions host when WEBSITE_TIME_ZONE is not set.
+
+    schedule = Schedule("30 */5 * * * *")
+    schedule.next_fire(datetime.datetime.now(timezone.utc))
+"""
+import bisect
+import datetime
+from datetime import timezone
+
+# Field name, lowest and highest value, value names
+_FIELDS = (
+    ("second", 0, 59, None),
+    ("minute", 0, 59, None),
+    ("hour", 0, 23, None),
+    ("day", 1, 31, None),
+    ("month", 1, 12, ("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC")),
+    ("day_of_week", 0, 7, ("SUN", "MON", "TUE", "WED", "THU", "FRI", "SAT")),
+)
+# next_fire gives up after this many days without a firing, e.g. for 0 0 0 30 2 *
+_MAX_SEARCH_DAYS = 366 * 8
+
+
+class Schedule:
+    def __init__(self, expression: str):
+        """
+        @param expression: NCRONTAB expression with 6 fields, or 5 without seconds
+        @raise ValueError: if the expression is invalid
+        """
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) == 5:
+            fields = ["0"] + fields
+        if len(fields) != 6:
+            raise ValueError("{!r}: NCRONTAB expressions have 6 fields, got {}".format(expression, len(fields)))
+        values = {}
+        for field, (name, low, high, names) in zip(fields, _FIELDS):
+            values[name] = sorted(_parse_field(field, low, high, names, expression))
+        self.seconds = values["second"]
+        self.minutes = values["minute"]
+        self.hours = values["hour"]
+        self.days = set(values["day"])
+        self.months = set(values["month"])
+        # Sunday is 0 and 7
+        self.days_of_week = {value % 7 for value in values["day_of_week"]}
+
+    def __repr__(self):
+        return "Schedule({!r})".format(self.expression)
+
+    def matches(self, time: datetime.datetime) -> bool:
+        """@return: whether the schedule fires at the second of time (UTC)"""
+        time = _utc(time)
+        return (time.second in self.seconds and time.minute in self.minutes and time.hour in self.hours
+                and self._matches_day(time.date()))
+
+    def next_fire(self, after: datetime.datetime) -> datetime.datetime:
+        """
+        @param after: time, naive times are taken as UTC
+        @return: first firing strictly after the time, in UTC
+        @raise ValueError: if the schedule does not fire within the next years
+        """
+        time = _utc(after).replace(microsecond=0) + datetime.timedelta(seconds=1)
+        limit = time + datetime.timedelta(days=_MAX_SEARCH_DAYS)
+        while time < limit:
+            if not self._matches_day(time.date()):
+                time = _start_of_day(time) + datetime.timedelta(days=1)
+                continue
+            hour = _next_value(self.hours, time.hour)
+            if hour is None:
+                time = _start_of_day(time) + datetime.timedelta(days=1)
+                continue
+            if hour != time.hour:
+                time = time.replace(hour=hour, minute=0, second=0)
+            minute = _next_value(self.minutes, time.minute)
+            if minute is None:
+                time = time.replace(minute=0, second=0) + datetime.timedelta(hours=1)
+                continue
+            if minute != time.minute:
+                time = time.replace(minute=minute, second=0)
+            second = _next_value(self.seconds, time.second)
+            if second is None:
+                time = time.replace(second=0) + datetime.timedelta(minutes=1)
+                continue
+            return time.replace(second=second)
+        raise ValueError("{!r} does not fire within {} days of {}".format(self.expression, _MAX_SEARCH_DAYS, after))
+
+    def fires(self, start: datetime.datetime, end: datetime.datetime):
+        """@return: generator of the firings after start and up to end"""
+        time = self.next_fire(start)
+        while time <= _utc(end):
+            yield time
+            time = self.next_fire(time)
+
+    def max_interval_secs(self, days: int = 8, max_fires: int = 100000) -> float:
+        """
+        Longest time between two consecutive firings, which bounds how stale the data of a timer can get.
+
+        @param days: period examined, 8 days covers the weekly cycle of day-of-week schedules
+        @param max_fires: firings examined at most, schedules firing every second stop early
+        @return: interval in seconds
+        """
+        # A Monday, so the period starts at a week boundary
+        start = datetime.datetime(2024, 1, 1, tzinfo=timezone.utc) - datetime.timedelta(seconds=1)
+        end = start + datetime.timedelta(days=days)
+        previous = None
+        longest = 0.0
+        for count, time in enumerate(self.fires(start, end)):
+            if previous is not None:
+                longest = max(longest, (time - previous).total_seconds())
+            previous = time
+            if count >= max_fires:
+                break
+        if previous is None or longest == 0.0:
+            # At most one firing in the period, e.g. yearly schedules
+            first = self.next_fire(start)
+            return (self.next_fire(first) - first).total_seconds()
+        return longest
+
+    def _matches_day(self, date: datetime.date) -> bool:
+        # isoweekday() is 1 (Monday) to 7 (Sunday)
+        return date.month in self.months and date.day in self.days and date.isoweekday() % 7 in self.days_of_week
+
+
+def _parse_field(field: str, low: int, high: int, names: tuple, expression: str) -> set:
+    values = set()
+    for part in field.split(","):
+        range_part, _, step = part.partition("/")
+        try:
+            step = int(step) if step else 1
+            if range_part == "*":
+                first, last = low, high
+            elif "-" in range_part:
+                first, last = (_parse_value(value, names) for value in range_part.split("-", 1))
+            else:
+                first = _parse_value(range_part, names)
+                # a/n steps from a to the end of the range, a alone is a single value
+                last = high if "/" in part else first
+        except ValueError:
+            raise ValueError("{!r}: invalid field {!r}".format(expression, field))
+        if step < 1 or not low <= first <= last <= high:
+            raise ValueError("{!r}: {!r} is out of range {}-{}".format(expression, part, low, high))
+        values.update(range(first, last + 1, step))
+    return values
+
+
+def _parse_value(value: str, names: tuple) -> int:
+    if names and value.upper() in names:
+        # Month names start at 1, day names at 0
+        return names.index(value.upper()) + (1 if len(names) == 12 else 0)
+    return int(value)
+
+
+def _next_value(values: list, current: int):
+    """@return: first of the sorted values at or after current, None if there is none"""
+    index = bisect.bisect_left(values, current)
+    return values[index] if index < len(values) else None
+
+
+def _start_of_day(time: datetime.datetime) -> datetime.datetime:
+    return time.replace(hour=0, minute=0, second=0)
+
+
+def _utc(time: datetime.datetime) -> datetime.datetime:
+    return time.replace(tzinfo=timezone.utc) if time.tzinfo is None else time.astimezone(timezone.utc)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join("~", ".cache", "observe", "token.json")
+DEFAULT_TTL_MINS = 60
+
+
+class TokenManager:
+    """
+    Keeps an Observe bearer token in memory and in an on-disk cache so repeated runs of the
+    validation script (e.g. retry attempts in the workflow) reuse the same login.
+
+    The token is refreshed only once its TTL has expired or when a caller reports it was
+    rejected (see refresh). Safe to share between threads.
+    """
+
+    def __init__(self, login, cache_key: str, cache_path: str = None, ttl_mins: float = None):
+        """
+        @param login: callable without arguments returning a new bearer token
+        @param cache_key: identifies the account the token belongs to, e.g. customer/domain/user
+        @param cache_path: on-disk cache file. Defaults to $OBSERVE_TOKEN_CACHE or ~/.cache/observe/token.json.
+                           Set $OBSERVE_TOKEN_CACHE to an empty string to disable the disk cache
+        @param ttl_mins: token lifetime in minutes. Defaults to $OBSERVE_TOKEN_TTL_MINS or 60
+        """
+        if cache_path is None:
+            cache_path = os.environ.get("OBSERVE_TOKEN_CACHE", DEFAULT_CACHE_PATH)
+        if ttl_mins is None:
+            ttl_mins = float(os.environ.get("OBSERVE_TOKEN_TTL_MINS", DEFAULT_TTL_MINS))
+
+        self.login = login
+        self.cache_key = hashlib.sha256(cache_key.encode()).hexdigest()
+        self.cache_path = os.path.expanduser(cache_path) if cache_path else None
+        self.ttl_secs = ttl_mins * 60
+
+        self.cache_hits = 0
+        self.disk_hits = 0
+        self.logins = 0
+
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        """Returns a valid bearer token, logging in only if no cached token is usable
+        @return: bearer_token
+        """
+        with self._lock:
+            if self._token is not None and time.time() < self._expires_at:
+                self.cache_hits += 1
+                return self._token
+
+            cached = self._read_disk_cache()
+            if cached is not None:
+                self.disk_hits += 1
+                self._token, self._expires_at = cached
+                return self._token
+
+            return self._login()
+
+    def refresh(self, rejected_token: str) -> str:
+        """
+        Replaces a token the API rejected (401). If another thread already refreshed it, the
+        newer token is returned without logging in again.
+
+        @param rejected_token: the token that was rejected
+        @return: bearer_token
+        """
+        with self._lock:
+            if self._token is not None and self._token != rejected_token and time.time() < self._expires_at:
+                self.cache_hits += 1
+                return self._token
+            logger.info("Bearer token rejected or expired, logging in again")
+            return self._login()
+
+    def stats(self) -> dict:
+        return {
+            "cache_hits": self.cache_hits,
+            "disk_hits": self.disk_hits,
+            "logins": self.logins,
+        }
+
+    def _login(self) -> str:
+        token = self.login()
+        self.logins += 1
+        self._token = token
+        self._expires_at = time.time() + self.ttl_secs
+        self._write_disk_cache()
+        return token
+
+    def _read_disk_cache(self):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                entry = json.load(cache_file).get(self.cache_key)
+        except (OSError, ValueError):
+            return None
+        if not entry or time.time() >= entry.get("expires_at", 0):
+            return None
+        return entry["access_key"], entry["expires_at"]
+
+    def _write_disk_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            try:
+                with open(self.cache_path, "r") as cache_file:
+                    cache = json.load(cache_file)
+            except (OSError, ValueError):
+                cache = {}
+            now = time.time()
+            cache = {key: entry for key, entry in cache.items() if entry.get("expires_at", 0) > now}
+            cache[self.cache_key] = {"access_key": self._token, "expires_at": self._expires_at}
+
+            # Token is a credential, keep the file private to the current user
+            tmp_path = self.cache_path + ".tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as err:
+            logger.warning("Could not write token cache {}: {}".format(self.cache_path, err))
@@ -0,0 +1,152 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests # type: ignore
+from requests.adapters import HTTPAdapter # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: throttling and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+class RateLimiter:
+    """Token bucket shared by the threads of one client: at most rate requests per second, bursts up to burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Blocks until a request may be sent.
+
+        @return: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """
+    @param pool_size: connections kept alive per host, should cover the number of concurrent callers
+    @return: pooled keep-alive session, to share between clients with the session argument of ObserveClient
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ObserveClient:
+    """
+    HTTP client for the Observe API sharing one pooled keep-alive session between calls and threads.
+
+    Requests are retried with jittered exponential backoff on 429/5xx responses and on connection
+    errors (resets, refused or timed out connects). Every request has a connect and read timeout.
+    """
+
+    def __init__(self, customer_id: str, domain: str, base_url: str = None, connect_timeout: float = None,
+                 read_timeout: float = None, max_retries: int = None, backoff_secs: float = None,
+                 backoff_max_secs: float = None, pool_size: int = 10, session: requests.Session = None,
+                 max_requests_per_sec: float = None):
+        """
+        @param customer_id: Observe customer id
+        @param domain: Observe domain
+        @param base_url: overrides https://{customer_id}.{domain}, e.g. to point at a local stub server.
+                         Defaults to $OBSERVE_BASE_URL
+        @param connect_timeout: seconds to establish a connection. Defaults to $OBSERVE_CONNECT_TIMEOUT_SECS or 5
+        @param read_timeout: seconds to wait between bytes of a response. Defaults to $OBSERVE_READ_TIMEOUT_SECS or 120
+        @param max_retries: retries after the first attempt. Defaults to $OBSERVE_MAX_RETRIES or 4
+        @param backoff_secs: base of the exponential backoff. Defaults to $OBSERVE_BACKOFF_SECS or 1
+        @param backoff_max_secs: cap on a single backoff sleep. Defaults to $OBSERVE_BACKOFF_MAX_SECS or 30
+        @param pool_size: connections kept alive per host, should cover the number of concurrent callers
+        @param session: existing session to share, e.g. between clients for several tenants
+        @param max_requests_per_sec: rate limit of this client's requests, including retries. Defaults to
+                                     $OBSERVE_MAX_REQUESTS_PER_SEC, unlimited if unset or 0
+        """
+        self.customer_id = customer_id
+        self.base_url = (base_url or os.environ.get("OBSERVE_BASE_URL") or f"https://{customer_id}.{domain}").rstrip("/")
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else _env_float("OBSERVE_CONNECT_TIMEOUT_SECS", 5),
+            read_timeout if read_timeout is not None else _env_float("OBSERVE_READ_TIMEOUT_SECS", 120),
+        )
+        self.max_retries = max_retries if max_retries is not None else int(_env_float("OBSERVE_MAX_RETRIES", 4))
+        self.backoff_secs = backoff_secs if backoff_secs is not None else _env_float("OBSERVE_BACKOFF_SECS", 1)
+        self.backoff_max_secs = backoff_max_secs if backoff_max_secs is not None \
+            else _env_float("OBSERVE_BACKOFF_MAX_SECS", 30)
+
+        self.session = session if session is not None else make_session(pool_size)
+
+        if max_requests_per_sec is None:
+            max_requests_per_sec = _env_float("OBSERVE_MAX_REQUESTS_PER_SEC", 0)
+        self.rate_limiter = RateLimiter(max_requests_per_sec) if max_requests_per_sec > 0 else None
+
+        self.retries = 0
+        self.rate_limited_secs = 0.0
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """
+        POSTs to base_url + path, retrying transient failures.
+
+        @param path: URL path, e.g. /v1/login
+        @param kwargs: passed to requests.Session.post (json, data, params, headers, stream ...)
+        @return: last response received. Raises the last connection error if no response was received
+        """
+        url = self.base_url + path
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limited_secs += self.rate_limiter.acquire()
+            try:
+                response = self.session.post(url, **kwargs)
+            except requests.exceptions.ConnectionError as err:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("POST {} failed with {!r}, retrying in {:.1f}s".format(path, err, delay))
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                delay = max(self._backoff(attempt), self._retry_after(response))
+                logger.warning("POST {} returned {}, retrying in {:.1f}s".format(path, response.status_code, delay))
+                response.close()
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    def close(self):
+        self.session.close()
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter" backoff: spreads retries of concurrent callers instead of synchronising them
+        return random.uniform(0, min(self.backoff_max_secs, self.backoff_secs * (2 ** attempt)))
+
+    def _retry_after(self, response: requests.Response) -> float:
+        try:
+            return min(float(response.headers.get("Retry-After", 0)), self.backoff_max_secs)
+        except ValueError:
+            return 0.0
@@ -0,0 +1,320 @@
+"""
+Small builder for OPAL pipelines with typed stages.
+
+Pipelines are optimized before rendering:
+ - filters are moved in front of the make_col stages they do not depend on, so rows are dropped
+   before any derived columns are computed for them
+ - pick_col only keeps the columns later stages use
+ - make_col stages whose output is never consumed are dropped, including JSON re-parsing such as
+   make_col FIELDS:parse_json(string(FIELDS)) when no later stage reads FIELDS
+"""
+import re
+import threading
+
+# Identifiers in expressions that are not column names
+_KEYWORDS = {"true", "false", "null", "and", "or", "not", "in"}
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+# Identifiers not preceded by a field access ("FIELDS.time" only references FIELDS) and not function calls
+_IDENTIFIER = re.compile(r"(?<![\w.])([A-Za-z_]\w*)\b(?!\s*\()")
+
+_AGGREGATE = re.compile(r"^\s*(\w+)\((.*)\)\s*$")
+
+# Aggregate function to (aggregate computed per slice, merge of the slice values). count_distinct has no
+# exact partial aggregate: each slice groups by the counted value and the merge counts the union of the values.
+# Without exact_distinct each slice counts its distinct values and the merge sums them instead, see Statsby.partial
+MERGEABLE_AGGREGATES = {
+    "count": ("count", "sum"),
+    "sum": ("sum", "sum"),
+    "min": ("min", "min"),
+    "max": ("max", "max"),
+    "count_distinct": (None, "distinct"),
+}
+
+# Marker for "every column is used", e.g. after a pipeline ending without pick_col/statsby
+ALL_COLUMNS = None
+
+
+def referenced_columns(expr: str) -> set:
+    """
+    @param expr: OPAL expression
+    @return: names of the columns the expression reads
+    """
+    expr = _STRING_LITERAL.sub("''", expr)
+    return {name for name in _IDENTIFIER.findall(expr) if name.lower() not in _KEYWORDS}
+
+
+class Stage:
+    """A pipeline stage. Subclasses describe the columns they read and write"""
+
+    def inputs(self) -> set:
+        return set()
+
+    def outputs(self) -> set:
+        return set()
+
+    def render(self) -> str:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.render())
+
+
+class Filter(Stage):
+    def __init__(self, expr: str):
+        self.expr = expr
+
+    def inputs(self) -> set:
+        return referenced_columns(self.expr)
+
+    def render(self) -> str:
+        return "filter {}".format(self.expr)
+
+
+class MakeCol(Stage):
+    def __init__(self, name: str, expr: str):
+        self.name = name
+        self.expr = expr
+
+    def inputs(self) -> set:
+        return referenced_columns(self.expr)
+
+    def outputs(self) -> set:
+        return {self.name}
+
+    def render(self) -> str:
+        return "make_col {}:{}".format(self.name, self.expr)
+
+
+class PickCol(Stage):
+    def __init__(self, *columns: str):
+        self.columns = list(columns)
+
+    def inputs(self) -> set:
+        return set(self.columns)
+
+    def outputs(self) -> set:
+        return set(self.columns)
+
+    def render(self) -> str:
+        return "pick_col {}".format(", ".join(self.columns))
+
+
+class SetValidFrom(Stage):
+    def __init__(self, column: str, options: str = None):
+        self.column = column
+        self.options = options
+
+    def inputs(self) -> set:
+        return {self.column}
+
+    def render(self) -> str:
+        if self.options:
+            return "set_valid_from options({}), {}".format(self.options, self.column)
+        return "set_valid_from {}".format(self.column)
+
+
+class Statsby(Stage):
+    def __init__(self, aggregates: dict, group_by: list = ()):
+        """
+        @param aggregates: output column name to aggregate expression, e.g. {"msg_count": "count_distinct(message)"}
+        @param group_by: grouping columns
+        """
+        self.aggregates = dict(aggregates)
+        self.group_by = list(group_by)
+
+    def inputs(self) -> set:
+        columns = set(self.group_by)
+        for expr in self.aggregates.values():
+            columns |= referenced_columns(expr)
+        return columns
+
+    def outputs(self) -> set:
+        return set(self.aggregates) | set(self.group_by)
+
+    def render(self) -> str:
+        parts = ["{}: {}".format(name, expr) for name, expr in self.aggregates.items()]
+        if self.group_by:
+            parts.append("group_by({})".format(", ".join(self.group_by)))
+        return "statsby {}".format(", ".join(parts))
+
+    def partial(self, exact_distinct: bool = True) -> list:
+        """
+        @param exact_distinct: return one row per distinct value of count_distinct aggregates, so the merge is
+                               exact. Otherwise each slice returns its distinct count and the merge sums them: an
+                               upper bound that is exact when no value occurs in two slices, and zero only when
+                               the exact count is, in one row per group and slice
+        @return: stages computing this statsby's aggregates per slice of a window, see merge
+        @raise ValueError: if an aggregate is not in MERGEABLE_AGGREGATES
+        """
+        stages = []
+        aggregates = {}
+        group_by = list(self.group_by)
+        for name, expr in self.aggregates.items():
+            function, argument = _split_aggregate(expr)
+            partial_function = MERGEABLE_AGGREGATES[function][0]
+            if partial_function is None and not exact_distinct:
+                aggregates[name] = expr
+            elif partial_function is None:
+                stages.append(MakeCol(_distinct_column(name), argument))
+                group_by.append(_distinct_column(name))
+            else:
+                aggregates[name] = "{}({})".format(partial_function, argument)
+        if not aggregates:
+            aggregates["_rows"] = "count()"
+        return stages + [Statsby(aggregates, group_by)]
+
+    def merge(self, rows, exact_distinct: bool = True) -> list:
+        """
+        @param rows: rows of the partial() stages over all slices, in any order
+        @param exact_distinct: see partial
+        @return: one row per group, with the values this statsby computes over the union of the slices.
+                 Numbers are returned as int or float instead of the strings of the export API
+        """
+        merged = StatsbyMerge(self, exact_distinct)
+        for row in rows:
+            merged.add(row)
+        return merged.rows()
+
+
+class StatsbyMerge:
+    """
+    Running merge of the partial aggregates of a Statsby, fed row by row while the slices are still streaming,
+    so no slice's response is held in memory. add() can be called from several threads.
+    """
+
+    def __init__(self, statsby: Statsby, exact_distinct: bool = True):
+        """
+        @param statsby: statsby whose partial() stages computed the rows
+        @param exact_distinct: see Statsby.partial
+        """
+        self.group_by = statsby.group_by
+        self.exact_distinct = exact_distinct
+        self.merges = {}
+        for name, expr in statsby.aggregates.items():
+            merge = MERGEABLE_AGGREGATES[_split_aggregate(expr)[0]][1]
+            self.merges[name] = "sum" if merge == "distinct" and not exact_distinct else merge
+        self.added = 0
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def add(self, row: dict):
+        """@param row: row of the partial() stages of any slice"""
+        key = tuple(row.get(column) for column in self.group_by)
+        with self._lock:
+            self.added += 1
+            merged = self._groups.setdefault(key, {name: set() if merge == "distinct" else None
+                                                   for name, merge in self.merges.items()})
+            for name, merge in self.merges.items():
+                if merge == "distinct":
+                    if row.get(_distinct_column(name)) is not None:
+                        merged[name].add(row[_distinct_column(name)])
+                    continue
+                value = _number(row.get(name))
+                if value is None:
+                    continue
+                if merged[name] is None:
+                    merged[name] = value
+                elif merge == "sum":
+                    merged[name] += value
+                else:
+                    merged[name] = min(merged[name], value) if merge == "min" else max(merged[name], value)
+
+    def rows(self) -> list:
+        """@return: merged rows of the rows added so far, see Statsby.merge"""
+        with self._lock:
+            return [dict(zip(self.group_by, key),
+                         **{name: len(value) if isinstance(value, set) else value for name, value in merged.items()})
+                    for key, merged in self._groups.items()]
+
+
+def _split_aggregate(expr: str) -> tuple:
+    """@return: (function, argument) of an aggregate expression such as count_distinct(message)"""
+    match = _AGGREGATE.match(expr)
+    if not match or match.group(1) not in MERGEABLE_AGGREGATES:
+        raise ValueError("{} cannot be merged across slices".format(expr))
+    return match.group(1), match.group(2)
+
+
+def _distinct_column(name: str) -> str:
+    return "_distinct_{}".format(name)
+
+
+def _number(value):
+    """@return: value of an export API row as int or float, None for null"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+# Stages that replace the set of columns, nothing can be moved across them
+_BARRIERS = (PickCol, Statsby, SetValidFrom)
+
+
+class Pipeline:
+    def __init__(self, stages: list = ()):
+        self.stages = list(stages)
+
+    def then(self, *stages: Stage) -> "Pipeline":
+        """Returns a new pipeline with stages appended"""
+        return Pipeline(self.stages + list(stages))
+
+    def partial(self, exact_distinct: bool = True) -> "Pipeline":
+        """
+        @param exact_distinct: see Statsby.partial
+        @return: pipeline computing the partial aggregates of the final statsby per slice, see Statsby.partial
+        @raise ValueError: if the pipeline does not end in a statsby
+        """
+        if not self.stages or not isinstance(self.stages[-1], Statsby):
+            raise ValueError("Only pipelines ending in statsby can be merged across slices")
+        return Pipeline(self.stages[:-1] + self.stages[-1].partial(exact_distinct))
+
+    def optimize(self) -> "Pipeline":
+        """Returns an equivalent pipeline with filters pushed down and unused columns pruned"""
+        return Pipeline(self._prune(self._push_filters(self.stages)))
+
+    def render(self, optimize: bool = True) -> str:
+        stages = self.optimize().stages if optimize else self.stages
+        return " | ".join(stage.render() for stage in stages)
+
+    @staticmethod
+    def _push_filters(stages: list) -> list:
+        result = []
+        for stage in stages:
+            position = len(result)
+            if isinstance(stage, Filter):
+                needs = stage.inputs()
+                # Move in front of row-wise stages that do not produce a column it reads
+                while position > 0:
+                    previous = result[position - 1]
+                    if isinstance(previous, _BARRIERS) or previous.outputs() & needs:
+                        break
+                    position -= 1
+                # Filters commute, keep the original order among those already at that position
+                while position < len(result) and isinstance(result[position], Filter):
+                    position += 1
+            result.insert(position, stage)
+        return result
+
+    @staticmethod
+    def _prune(stages: list) -> list:
+        needed = ALL_COLUMNS
+        result = []
+        for stage in reversed(stages):
+            if isinstance(stage, MakeCol):
+                if needed is not ALL_COLUMNS and stage.name not in needed:
+                    continue
+                if needed is not ALL_COLUMNS:
+                    needed = (needed - {stage.name}) | stage.inputs()
+            elif isinstance(stage, PickCol):
+                if needed is not ALL_COLUMNS:
+                    stage = PickCol(*[column for column in stage.columns if column in needed])
+                needed = set(stage.columns)
+            elif isinstance(stage, Statsby):
+                needed = stage.inputs()
+            elif needed is not ALL_COLUMNS:
+                needed = needed | stage.inputs()
+            result.append(stage)
+        return list(reversed(result))
@@ -1,47 +1,232 @@
 import os
 
-AZURE_COLLECTION_FUNCTION = os.environ.get("AZURE_COLLECTION_FUNCTION")
-OBSERVE_TOKEN_ID = os.environ.get("OBSERVE_TOKEN_ID")
+from opal_pipeline import Filter, MakeCol, PickCol, Pipeline, SetValidFrom, Statsby # type: ignore
 
 # OPAL PIPELINEs to execute on Dataset
+#
+# Each source is defined by the stages that follow the shared collection filter (token and collection version),
+# see build_pipeline. earliest_ts is min() rather than first_not_null() so that it also merges exactly across
+# the slices of a time sliced query, see opal_pipeline.Statsby.merge. Pipelines are optimized (filter pushdown,
+# column pruning) and rendered when requested, using the OBSERVE_TOKEN_ID and AZURE_COLLECTION_FUNCTION
+# environment variables set at that time.
 
-eventhub_pipeline = \
-    "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id))| " \
-    "filter _ob_datastream_token_id = '{}'|" \
-    "filter (string(EXTRA.collection_version) = '{}')|" \
-    "filter (string(EXTRA.source) = 'EventHub')| " \
-    "make_col timestamp:parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS')| " \
-    "make_col timestamp:if_null(timestamp,parse_isotime(string(FIELDS.time)))| " \
-    "set_valid_from options(max_time_diff:30m), timestamp|" \
-    "make_col FIELDS:parse_json(string(FIELDS))|" \
-    "make_col source: string(EXTRA.source)|" \
-    "make_col category:string(FIELDS.category)|" \
-    "make_col appName:string(FIELDS.properties.appName)|" \
-    "make_col message:string(FIELDS.properties.message)|" \
-    "make_col time_string:string(FIELDS.time)|" \
-    "pick_col timestamp, time_string, source, category, appName, message|" \
-    "statsby msg_count: count_distinct(message), earliest_ts: first_not_null(timestamp), group_by(source)" \
-    "".format(OBSERVE_TOKEN_ID, AZURE_COLLECTION_FUNCTION)
-
-resource_management_pipeline = \
-    "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id))| " \
-    "filter _ob_datastream_token_id = '{}'|" \
-    "filter (string(EXTRA.collection_version) = '{}')|" \
-    "filter (string(EXTRA.source) = 'ResourceManagement')|" \
-    "make_col source: string(EXTRA.source)|" \
-    "make_col type:string(FIELDS.type)|" \
-    "statsby msg_count: count_distinct(type), earliest_ts: first_not_null(BUNDLE_TIMESTAMP), group_by(source)" \
-    "".format(OBSERVE_TOKEN_ID, AZURE_COLLECTION_FUNCTION)
-
-vm_metrics_pipeline = \
-    "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id))| " \
-    "filter _ob_datastream_token_id = '{}'|" \
-    "filter (string(EXTRA.collection_version) = '{}')|" \
-    "filter (string(EXTRA.source) = 'VmMetrics')| " \
-    "make_col time_string: string(FIELDS.timeseries[0].data[0].timeStamp)|" \
-    "make_col timestamp:parse_isotime(string(FIELDS.timeseries[0].data[0].timeStamp))| " \
-    "make_col metric_name:string(FIELDS.name.value)|" \
-    "make_col FIELDS:parse_json(string(FIELDS))|" \
-    "make_col source: string(EXTRA.source)|" \
-    "statsby msg_count: count_distinct(metric_name), earliest_ts: first_not_null(BUNDLE_TIMESTAMP), group_by(source)" \
-    "".format(OBSERVE_TOKEN_ID, AZURE_COLLECTION_FUNCTION)
+source_stages = {
+    'EventHub': [
+        MakeCol("timestamp", "parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS')"),
+        MakeCol("timestamp", "if_null(timestamp,parse_isotime(string(FIELDS.time)))"),
+        SetValidFrom("timestamp", options="max_time_diff:30m"),
+        MakeCol("FIELDS", "parse_json(string(FIELDS))"),
+        MakeCol("source", "string(EXTRA.source)"),
+        MakeCol("category", "string(FIELDS.category)"),
+        MakeCol("appName", "string(FIELDS.properties.appName)"),
+        MakeCol("message", "string(FIELDS.properties.message)"),
+        MakeCol("time_string", "string(FIELDS.time)"),
+        PickCol("timestamp", "time_string", "source", "category", "appName", "message"),
+        Statsby({"msg_count": "count_distinct(message)", "earliest_ts": "min(timestamp)"},
+                group_by=["source"]),
+    ],
+    'ResourceManagement': [
+        MakeCol("source", "string(EXTRA.source)"),
+        MakeCol("type", "string(FIELDS.type)"),
+        Statsby({"msg_count": "count_distinct(type)", "earliest_ts": "min(BUNDLE_TIMESTAMP)"},
+                group_by=["source"]),
+    ],
+    'VmMetrics': [
+        MakeCol("time_string", "string(FIELDS.timeseries[0].data[0].timeStamp)"),
+        MakeCol("timestamp", "parse_isotime(string(FIELDS.timeseries[0].data[0].timeStamp))"),
+        MakeCol("metric_name", "string(FIELDS.name.value)"),
+        MakeCol("FIELDS", "parse_json(string(FIELDS))"),
+        MakeCol("source", "string(EXTRA.source)"),
+        Statsby({"msg_count": "count_distinct(metric_name)", "earliest_ts": "min(BUNDLE_TIMESTAMP)"},
+                group_by=["source"]),
+    ],
+}
+
+# Per source columns of the fused pipeline, matching source_stages:
+# (distinct value counted as msg_count, timestamp used for earliest_ts)
+fused_source_columns = {
+    'EventHub': ("string(FIELDS.properties.message)", "timestamp"),
+    'ResourceManagement': ("string(FIELDS.type)", "BUNDLE_TIMESTAMP"),
+    'VmMetrics': ("string(FIELDS.name.value)", "BUNDLE_TIMESTAMP"),
+}
+fused_statsby = Statsby({"msg_count": "count_distinct(msg_key)", "earliest_ts": "min(msg_ts)"}, group_by=["source"])
+
+# Sources written by the timer functions of the collection function app, and the Terraform variables
+# holding their NCRONTAB schedules
+TIMER_SOURCES = {
+    'ResourceManagement': 'timer_resources_func_schedule',
+    'VmMetrics': 'timer_vm_metrics_func_schedule',
+}
+
+
+def collection_pipeline(sources: list, token_id: str = None, collection_version: str = None) -> Pipeline:
+    """
+    Stages shared by all pipelines: keeps the rows of this deployment's datastream token and collection
+    function version from the given sources.
+
+    @param sources: values of EXTRA.source to keep
+    @param token_id: Observe datastream token id. Defaults to $OBSERVE_TOKEN_ID
+    @param collection_version: collection function URL. Defaults to $AZURE_COLLECTION_FUNCTION
+    @return: pipeline to append source specific stages to
+    """
+    if token_id is None:
+        token_id = os.environ.get("OBSERVE_TOKEN_ID")
+    if collection_version is None:
+        collection_version = os.environ.get("AZURE_COLLECTION_FUNCTION")
+
+    return Pipeline([
+        MakeCol("_ob_datastream_token_id", "coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id))"),
+        Filter("_ob_datastream_token_id = '{}'".format(token_id)),
+        Filter("(string(EXTRA.collection_version) = '{}')".format(collection_version)),
+        Filter("({})".format(" or ".join("string(EXTRA.source) = '{}'".format(source) for source in sources))),
+    ])
+
+
+def build_pipeline(source: str, token_id: str = None, collection_version: str = None, partial: bool = False,
+                   exact_distinct: bool = True) -> str:
+    """
+    @param source: key of source_stages
+    @param token_id: see collection_pipeline
+    @param collection_version: see collection_pipeline
+    @param partial: compute the per slice aggregates that source_stages[source][-1].merge() combines
+    @param exact_distinct: with partial, see opal_pipeline.Statsby.partial
+    @return: optimized OPAL pipeline computing msg_count and earliest_ts for the source
+    """
+    pipeline = collection_pipeline([source], token_id, collection_version).then(*source_stages[source])
+    return (pipeline.partial(exact_distinct) if partial else pipeline).render()
+
+
+def fused_pipeline(sources: list, token_id: str = None, collection_version: str = None,
+                   partial: bool = False, exact_distinct: bool = True) -> str:
+    """
+    Single pipeline computing msg_count and earliest_ts for several sources in one scan of the dataset,
+    returning one row per source.
+
+    @param sources: sources to include, keys of fused_source_columns
+    @param token_id: see collection_pipeline
+    @param collection_version: see collection_pipeline
+    @param partial: compute the per slice aggregates that fused_statsby.merge() combines
+    @param exact_distinct: with partial, see opal_pipeline.Statsby.partial
+    @return: OPAL pipeline
+    """
+    msg_key_cases = ", ".join("source = '{}', {}".format(source, fused_source_columns[source][0]) for source in sources)
+    msg_ts_cases = ", ".join("source = '{}', {}".format(source, fused_source_columns[source][1]) for source in sources)
+
+    pipeline = collection_pipeline(sources, token_id, collection_version).then(
+        MakeCol("source", "string(EXTRA.source)"),
+        MakeCol("timestamp", "parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS')"),
+        MakeCol("timestamp", "if_null(timestamp,parse_isotime(string(FIELDS.time)))"),
+        MakeCol("msg_key", "case({})".format(msg_key_cases)),
+        MakeCol("msg_ts", "case({})".format(msg_ts_cases)),
+        fused_statsby,
+    )
+    return (pipeline.partial(exact_distinct) if partial else pipeline).render()
+
+
+# Raw rows with the event's own time and the ingest time (BUNDLE_TIMESTAMP) for ingestion lag analysis
+lag_stages = {
+    'EventHub': [
+        MakeCol("event_time", "parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS')"),
+        MakeCol("event_time", "if_null(event_time,parse_isotime(string(FIELDS.time)))"),
+        MakeCol("source", "string(EXTRA.source)"),
+        PickCol("source", "event_time", "BUNDLE_TIMESTAMP"),
+    ],
+    'VmMetrics': [
+        MakeCol("event_time", "parse_isotime(string(FIELDS.timeseries[0].data[0].timeStamp))"),
+        MakeCol("source", "string(EXTRA.source)"),
+        PickCol("source", "event_time", "BUNDLE_TIMESTAMP"),
+    ],
+}
+
+
+def build_lag_pipeline(source: str, token_id: str = None, collection_version: str = None) -> str:
+    """
+    @param source: key of lag_stages
+    @param token_id: see collection_pipeline
+    @param collection_version: see collection_pipeline
+    @return: OPAL pipeline returning source, event_time and BUNDLE_TIMESTAMP per row
+    """
+    return collection_pipeline([source], token_id, collection_version).then(*lag_stages[source]).render()
+
+
+# FunctionAppLogs records of the collection function app, which the diagnostic setting enabled by
+# function_app_debug_logs sends through the Event Hub: invocation results, host starts and trigger batches
+function_log_stages = [
+    Filter("string(FIELDS.category) = 'FunctionAppLogs'"),
+    MakeCol("event_time", "parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS')"),
+    MakeCol("event_time", "if_null(event_time,parse_isotime(string(FIELDS.time)))"),
+    MakeCol("function", "string(FIELDS.properties.functionName)"),
+    MakeCol("invocation_id", "string(FIELDS.properties.functionInvocationId)"),
+    MakeCol("host_instance", "string(FIELDS.properties.hostInstanceId)"),
+    MakeCol("message", "string(FIELDS.properties.message)"),
+    Filter("contains(message, 'Executed ') or contains(message, 'Host started') or "
+           "contains(message, 'Trigger Details')"),
+    PickCol("event_time", "function", "invocation_id", "host_instance", "message"),
+]
+
+
+def build_function_log_pipeline(token_id: str = None, collection_version: str = None) -> str:
+    """
+    @param token_id: see collection_pipeline
+    @param collection_version: see collection_pipeline
+    @return: OPAL pipeline returning event_time, function, invocation_id, host_instance and message per log record
+    """
+    return collection_pipeline(['EventHub'], token_id, collection_version).then(*function_log_stages).render()
+
+
+# Events and bytes ingested per source and minute, for capacity planning
+ingest_rate_stages = [
+    MakeCol("source", "string(EXTRA.source)"),
+    MakeCol("event_bytes", "strlen(string(FIELDS))"),
+    MakeCol("minute", "format_time(BUNDLE_TIMESTAMP, 'YYYY-MM-DD HH24:MI')"),
+    Statsby({"events": "count()", "bytes": "sum(event_bytes)"}, group_by=["source", "minute"]),
+]
+
+
+def build_ingest_rate_pipeline(sources: list, token_id: str = None, collection_version: str = None) -> str:
+    """
+    @param sources: values of EXTRA.source to include
+    @param token_id: see collection_pipeline
+    @param collection_version: see collection_pipeline
+    @return: OPAL pipeline returning source, minute, events and bytes per source and minute
+    """
+    return collection_pipeline(sources, token_id, collection_version).then(*ingest_rate_stages).render()
+
+
+# Events and bytes of the EventHub source per category, appName, emitting resource and minute, for finding
+# the keys that dominate the hub's traffic
+breakdown_stages = [
+    MakeCol("event_bytes", "strlen(string(FIELDS))"),
+    MakeCol("FIELDS", "parse_json(string(FIELDS))"),
+    MakeCol("category", "string(FIELDS.category)"),
+    MakeCol("appName", "string(FIELDS.properties.appName)"),
+    MakeCol("resource", "string(FIELDS.resourceId)"),
+    MakeCol("minute", "format_time(BUNDLE_TIMESTAMP, 'YYYY-MM-DD HH24:MI')"),
+    Statsby({"events": "count()", "bytes": "sum(event_bytes)"},
+            group_by=["category", "appName", "resource", "minute"]),
+]
+
+
+def build_breakdown_pipeline(token_id: str = None, collection_version: str = None, partial: bool = False) -> str:
+    """
+    @param token_id: see collection_pipeline
+    @param collection_version: see collection_pipeline
+    @param partial: compute the per slice aggregates that breakdown_stages[-1].merge() combines
+    @return: OPAL pipeline returning category, appName, resource, minute, events and bytes
+    """
+    pipeline = collection_pipeline(['EventHub'], token_id, collection_version).then(*breakdown_stages)
+    return (pipeline.partial() if partial else pipeline).render()
+
+
+_legacy_names = {
+    'eventhub_pipeline': 'EventHub',
+    'resource_management_pipeline': 'ResourceManagement',
+    'vm_metrics_pipeline': 'VmMetrics',
+}
+
+
+def __getattr__(name):
+    # Pipelines used to be module level strings, keep those names working
+    if name in _legacy_names:
+        return build_pipeline(_legacy_names[name])
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
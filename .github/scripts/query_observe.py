@@ -1,3 +1,4 @@
+import argparse
 import configparser
 import json
 import re
@@ -5,11 +6,26 @@ import logging
 import requests # type: ignore
 import os, sys, json
 import datetime
+import threading
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
 import pipeline_config # type: ignore
+from instrumentation import ThreadProfiler, metrics # type: ignore
+from ncrontab import Schedule # type: ignore
+from observe_auth import TokenManager # type: ignore
+from observe_client import ObserveClient, make_session # type: ignore
+from opal_pipeline import Statsby, StatsbyMerge # type: ignore
+from validation_state import ValidationState, parse_iso # type: ignore
 
+# Sources validated by default, in the order they are reported
+SOURCES = ['EventHub', 'ResourceManagement', 'VmMetrics']
 
 # Create a logger instance
+logger = logging.getLogger(__name__)
+
+
 def setup_logger(log_level, log_format):
     """
     Setup logger with specified log level and format.
@@ -29,17 +45,57 @@ def setup_logger(log_level, log_format):
     logger.addHandler(ch)
 
 
-def get_bearer_token() -> str:
+_clients = {}
+_token_managers = {}
+_session = None
+_shared_lock = threading.Lock()
+
+# Environment variables holding the Observe login, see Deployment for per tenant credentials
+USER_EMAIL_ENV = "OBSERVE_USER_EMAIL"
+PASSWORD_ENV = "OBSERVE_USER_PASSWORD"
+
+
+def configure_session(pool_size: int):
+    """Sizes the HTTP session that the clients of all tenants share, call it before querying
+    @param pool_size: connections kept alive per host, should cover the number of concurrent queries
+    """
+    global _session
+    with _shared_lock:
+        if _session is not None:
+            _session.close()
+        _session = make_session(pool_size)
+        for client in _clients.values():
+            client.session = _session
+
+
+def get_client(customer_id: str = None, domain: str = None) -> ObserveClient:
+    """Returns the shared HTTP client of an Observe tenant. Clients of all tenants share one session, see
+    configure_session
+    @param customer_id: Observe customer id. Defaults to $OBSERVE_CUSTOMER
+    @param domain: Observe domain. Defaults to $OBSERVE_DOMAIN
+    @return: client
+    """
+    global _session
+    key = (customer_id or os.environ.get("OBSERVE_CUSTOMER"), domain or os.environ.get("OBSERVE_DOMAIN"))
+    with _shared_lock:
+        if key not in _clients:
+            if _session is None:
+                _session = make_session()
+            _clients[key] = ObserveClient(*key, session=_session)
+        return _clients[key]
+
+
+def get_bearer_token(client: ObserveClient = None, user_email_env: str = USER_EMAIL_ENV,
+                     password_env: str = PASSWORD_ENV) -> str:
     """Logins into account and gets bearer token
+    @param client: client of the tenant to login to. Defaults to the configured tenant
+    @param user_email_env: environment variable holding the user email
+    @param password_env: environment variable holding the user password
     @return: bearer_token
     """
 
-    customer_id = os.environ.get("OBSERVE_CUSTOMER")
-    domain = os.environ.get("OBSERVE_DOMAIN")
-    user_email = os.environ.get("OBSERVE_USER_EMAIL")
-    user_password = os.environ.get("OBSERVE_USER_PASSWORD")
-
-    url = f"https://{customer_id}.{domain}/v1/login"
+    user_email = os.environ.get(user_email_env)
+    user_password = os.environ.get(password_env)
 
     message = '{"user_email":"$user_email$","user_password":"$user_password$", "tokenName":"terraform-azure-collection"}'
     tokens_to_replace = {
@@ -53,27 +109,177 @@ def get_bearer_token() -> str:
         "Content-Type": "application/json",
     }
 
-    response = json.loads(
-        requests.post(url, data=message, headers=header, timeout=10).text
-    )
+    with metrics.timed("login") as call:
+        raw_response = (client or get_client()).post("/v1/login", data=message, headers=header)
+        call["status"] = raw_response.status_code
+        call["ttfb_secs"] = raw_response.elapsed.total_seconds()
+        call["bytes"] = len(raw_response.content)
+    response = json.loads(raw_response.text)
     bearer_token = response['access_key']
     return bearer_token
 
 
+def get_token_manager(customer_id: str = None, domain: str = None, user_email_env: str = USER_EMAIL_ENV,
+                      password_env: str = PASSWORD_ENV) -> TokenManager:
+    """Returns the shared token manager of an Observe tenant and login, see get_client and get_bearer_token
+    @return: token_manager
+    """
+    client = get_client(customer_id, domain)
+    key = (client, user_email_env, password_env)
+    with _shared_lock:
+        if key not in _token_managers:
+            cache_key = "{}.{}/{}".format(client.customer_id, domain or os.environ.get("OBSERVE_DOMAIN"),
+                                          os.environ.get(user_email_env))
+            _token_managers[key] = TokenManager(
+                login=lambda: get_bearer_token(client, user_email_env, password_env), cache_key=cache_key)
+        return _token_managers[key]
+
+
+class Deployment:
+    """
+    One deployment of the collection module to validate: its Observe tenant, dataset, datastream token,
+    collection function version, timer schedules and the time its Terraform apply finished.
+    """
+
+    def __init__(self, name: str = None, dataset_id: str = None, token_id: str = None,
+                 collection_version: str = None, start_time_iso: str = None, customer_id: str = None,
+                 domain: str = None, timer_schedules: dict = None, user_email_env: str = USER_EMAIL_ENV,
+                 password_env: str = PASSWORD_ENV):
+        """
+        @param name: label used in logs and output file names, None for the single deployment of the environment
+        @param dataset_id: Observe dataset with the collected data. Defaults to $AZURE_DATASET_ID
+        @param token_id: Observe datastream token id. Defaults to $OBSERVE_TOKEN_ID
+        @param collection_version: collection function URL. Defaults to $AZURE_COLLECTION_FUNCTION
+        @param start_time_iso: Terraform script finish time. Defaults to $CURRENT_TIME_ISO
+        @param customer_id: Observe customer id. Defaults to $OBSERVE_CUSTOMER
+        @param domain: Observe domain. Defaults to $OBSERVE_DOMAIN
+        @param timer_schedules: NCRONTAB schedule per timer source, see pipeline_config.TIMER_SOURCES. Defaults to
+                                the variables' upper case environment variables, e.g. $TIMER_RESOURCES_FUNC_SCHEDULE
+        @param user_email_env: environment variable with the email of the Observe user of the tenant
+        @param password_env: environment variable with the password of the Observe user of the tenant
+        """
+        self.name = name
+        self.dataset_id = dataset_id or os.environ.get("AZURE_DATASET_ID")
+        self.token_id = token_id or os.environ.get("OBSERVE_TOKEN_ID")
+        self.collection_version = collection_version or os.environ.get("AZURE_COLLECTION_FUNCTION")
+        self.start_time_iso = start_time_iso or os.environ.get("CURRENT_TIME_ISO")
+        self.customer_id = customer_id or os.environ.get("OBSERVE_CUSTOMER")
+        self.domain = domain or os.environ.get("OBSERVE_DOMAIN")
+        if timer_schedules is None:
+            timer_schedules = {source: os.environ[variable.upper()]
+                               for source, variable in pipeline_config.TIMER_SOURCES.items()
+                               if os.environ.get(variable.upper())}
+        self.timer_schedules = timer_schedules
+        self.user_email_env = user_email_env
+        self.password_env = password_env
+
+    def client(self) -> ObserveClient:
+        return get_client(self.customer_id, self.domain)
+
+    def token_manager(self) -> TokenManager:
+        return get_token_manager(self.customer_id, self.domain, self.user_email_env, self.password_env)
+
+    def run_key(self) -> str:
+        """@return: identifies a validation run of this deployment, see ValidationState"""
+        return "/".join(str(value) for value in
+                        (self.dataset_id, self.token_id, self.collection_version, self.start_time_iso))
+
+    def label(self, source: str) -> str:
+        return source if self.name is None else "{}/{}".format(self.name, source)
+
+    def metric_name(self, name: str) -> str:
+        """@return: metrics counter name, prefixed by the deployment name in fleet runs"""
+        return name if self.name is None else "{}_{}".format(re.sub(r"\W", "_", self.name), name)
+
+    def first_arrivals(self, ingest_lag_secs: float) -> dict:
+        """
+        @param ingest_lag_secs: expected time from a timer firing until its data can be queried
+        @return: earliest time the data of each timer source can arrive: the first firing of its schedule after
+                 the Terraform apply finished plus ingest_lag_secs
+        """
+        start = parse_iso(self.start_time_iso)
+        return {source: Schedule(schedule).next_fire(start) + datetime.timedelta(seconds=ingest_lag_secs)
+                for source, schedule in self.timer_schedules.items()}
+
+    def output_file(self, source: str) -> str:
+        """@return: file the source's rows are saved to"""
+        if self.name is None:
+            return "{}.json".format(source)
+        return "{}-{}.json".format(re.sub(r"[^\w.-]", "_", self.name), source)
+
+
+class NdjsonRows:
+    """
+    Iterator decoding one row at a time from an application/x-ndjson response body. It owns the response
+    and closes it once exhausted, on close() or when it is garbage collected, so a caller that drops the
+    rows before reading them does not leak the streamed connection or leave the metrics call unfinished.
+    """
+
+    def __init__(self, response: requests.Response, call: dict = None):
+        """
+        @param response: response requested with stream=True
+        @param call: metrics call to add bytes, rows and decode time to, finished when the response is closed
+        """
+        self.response = response
+        self.call = call
+        self.received = self.rows = 0
+        self.decode_secs = 0.0
+        self.closed = False
+        self._lines = response.iter_lines(chunk_size=64 * 1024)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        if self.closed:
+            raise StopIteration
+        try:
+            for line in self._lines:
+                self.received += len(line) + 1
+                if line.strip():
+                    decode_start = time.perf_counter()
+                    row = json.loads(line)
+                    self.decode_secs += time.perf_counter() - decode_start
+                    self.rows += 1
+                    return row
+        except BaseException:
+            self.close()
+            raise
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.response.close()
+        if self.call is not None:
+            self.call.update(bytes=self.received, rows=self.rows, decode_secs=self.decode_secs)
+            metrics.finish(self.call)
+
+    def __del__(self):
+        self.close()
+
+
 def send_query(bearer_token: str, query: str, params: dict = None, url_extension: str = '',
-               type='gql') -> list or object:
+               type='gql', token_manager: TokenManager = None, stream: bool = False,
+               client: ObserveClient = None) -> list or object:
     """
     @param bearer_token: generated from credentials
     @param query: graphQL query
     @param params: params for executing a query (startTime, EndTime, interval, paginate)
+    @param token_manager: if set, a rejected (401) bearer token is refreshed and the query sent once more
+    @param stream: for type='openapi', return NdjsonRows decoding rows as the body arrives instead of a list
+    @param client: client of the tenant to query. Defaults to the configured tenant
     @return: response of graphQL query
     """
 
-    customer_id = os.environ.get("OBSERVE_CUSTOMER")
-    domain = os.environ.get("OBSERVE_DOMAIN")
+    if client is None:
+        client = get_client()
+    customer_id = client.customer_id
 
-    # Set the GraphQL API endpoint URL
-    url = f"https://{customer_id}.{domain}/v1/meta{url_extension}"
+    # Set the GraphQL API endpoint path
+    path = f"/v1/meta{url_extension}"
 
     # Set the headers (including authentication)
     headers = {
@@ -92,34 +298,62 @@ def send_query(bearer_token: str, query: str, params: dict = None, url_extension
     else:
         data = {None}
     # Send the POST request
+    stream = stream and type == 'openapi'
+    call = metrics.start("query", path=path, stream=stream)
     try:
-        response = requests.post(url, json=data, params=params, headers=headers)
+        response = client.post(path, json=data, params=params, headers=headers, stream=stream)
+        if response.status_code == 401 and token_manager is not None:
+            response.close()
+            bearer_token = token_manager.refresh(bearer_token)
+            headers["Authorization"] = f"""Bearer {customer_id} {bearer_token}"""
+            response = client.post(path, json=data, params=params, headers=headers, stream=stream)
+        call["status"] = response.status_code
+        call["ttfb_secs"] = response.elapsed.total_seconds()
         response.raise_for_status()
         # result = response.json()
-        if type == 'gql':
+        if stream:
+            logger.debug("Streaming query {} with status code {}".format(query, response.status_code))
+            return NdjsonRows(response, call)
+        elif type == 'gql':
+            call["bytes"] = len(response.content)
+            decode_start = time.perf_counter()
             result = response.json()
+            call["decode_secs"] = time.perf_counter() - decode_start
             logger.debug("Request for query {} successful with status code {}:".format(query, response.status_code))
             logger.debug("Response:{}".format(result))
+            metrics.finish(call)
             return result
         else:
             result = response.text
+            call["bytes"] = len(response.content)
+            decode_start = time.perf_counter()
             json_objects = result.strip().split('\n')
             json_list = []
             if json_objects and result != "":
                 for obj in json_objects:
-                    json_list.append(json.loads(obj))
+                    if obj.strip():
+                        json_list.append(json.loads(obj))
+            call["decode_secs"] = time.perf_counter() - decode_start
+            call["rows"] = len(json_list)
             logger.debug("Request for query {} successful with status code {}:".format(query, response.status_code))
             logger.debug("Response:{}".format(json_list))
+            metrics.finish(call)
             return json_list
     except requests.exceptions.HTTPError as err:
+        metrics.finish(call)
         logging.debug(err.request.url)
         logging.debug(err)
         logging.debug(err.response.text)
+        err.response.close()
         return None
+    except Exception:
+        metrics.finish(call)
+        raise
 
 
 def query_dataset(bearer_token: str, dataset_id: str, pipeline: str = "", interval: str = None, startTime: str = None,
-                  endTime: str = None) -> list:
+                  endTime: str = None, token_manager: TokenManager = None, stream: bool = False,
+                  client: ObserveClient = None) -> list:
     """
 
     Queries the last 30 minutes (default) of a dataset returning result of query. Uses Observe OpenAPI
@@ -130,6 +364,9 @@ def query_dataset(bearer_token: str, dataset_id: str, pipeline: str = "", interv
     @param interval: Length of time window (if start or end is missing). Defaults to 15m (from observe API)
     @param startTime: Beginning of time window as ISO time.
     @param endTime: End of time window as ISO time. Defaults to now.
+    @param token_manager: refreshes bearer_token if it is rejected, see send_query
+    @param stream: return an iterator yielding rows as they are received, see send_query
+    @param client: client of the tenant to query, see send_query
 
     @return: dataset: queried dataset  in json separated by timestamps
 
@@ -183,92 +420,487 @@ def query_dataset(bearer_token: str, dataset_id: str, pipeline: str = "", interv
     else:
         raise ValueError("Invalid interval, startTime or endTime arguments")
 
-    dataset = send_query(bearer_token, query, params, url_extension='/export/query', type='openapi')
+    dataset = send_query(bearer_token, query, params, url_extension='/export/query', type='openapi',
+                         token_manager=token_manager, stream=stream, client=client)
     return dataset
 
 
-def validate_azure_data(source: str, stale_checks_mins: int) -> bool:
+def time_slices(start_time: str, end_time: str, slices: int) -> list:
     """
-
-    :param source: can be 'EventHub`, `ResourceManagement`, `VMMetrics`
-    :param stale_checks_mins: how long should difference be between received data and current query_start_time
-    :return: if source is validated from current time (true, false)
+    @param start_time: start of the window as ISO time
+    @param end_time: end of the window as ISO time
+    @param slices: number of sub-windows, fewer for windows shorter than a second per slice
+    @return: [(start, end)] ISO times of adjacent sub-windows covering the window
     """
+    start = parse_iso(start_time)
+    end = parse_iso(end_time)
+    total_secs = max(int((end - start).total_seconds()), 1)
+    slices = max(1, min(slices, total_secs))
+    bounds = [start + datetime.timedelta(seconds=total_secs * index // slices) for index in range(slices)] + [end]
+    return [(bounds[index].strftime('%Y-%m-%dT%H:%M:%SZ'), bounds[index + 1].strftime('%Y-%m-%dT%H:%M:%SZ'))
+            for index in range(slices)]
+
+
+def query_sliced(bearer_token: str, dataset_id: str, pipeline: str, statsby: Statsby, startTime: str, endTime: str,
+                 slices: int, token_manager: TokenManager = None, client: ObserveClient = None,
+                 exact_distinct: bool = True) -> list:
+    """
+    Splits the window into sub-windows queried in parallel and merges their partial aggregates while they
+    stream in, so the latency is that of the slowest slice rather than of one query over the whole window,
+    and no slice's response is held in memory.
+
+    @param pipeline: OPAL pipeline computing partial aggregates, e.g. pipeline_config.build_pipeline(partial=True)
+    @param statsby: statsby the partial aggregates are merged into
+    @param slices: number of sub-windows, see time_slices
+    @param exact_distinct: whether the pipeline computes exact count_distinct partials, see Statsby.partial
+    @return: merged rows like a single query with the statsby over the whole window, None if any slice failed
+    See query_dataset for the other parameters
+    """
+    windows = time_slices(startTime, endTime, slices)
+    merged = StatsbyMerge(statsby, exact_distinct)
 
-    AZURE_DATASET_ID = os.environ.get("AZURE_DATASET_ID")    
-    CURRENT_TIME_ISO = os.environ.get("CURRENT_TIME_ISO")
-
+    def query_slice(window: tuple) -> bool:
+        rows = query_dataset(bearer_token, dataset_id, pipeline=pipeline, startTime=window[0], endTime=window[1],
+                             token_manager=token_manager, stream=True, client=client)
+        if rows is None:
+            return False
+        with closing(rows):
+            for row in rows:
+                merged.add(row)
+        return True
+
+    with metrics.timed("sliced_query", slices=len(windows)) as call:
+        with ThreadPoolExecutor(max_workers=len(windows), thread_name_prefix="slice") as executor:
+            succeeded = list(executor.map(query_slice, windows))
+        call["rows"] = merged.added
+        if not all(succeeded):
+            logger.error("{} of {} slices failed".format(succeeded.count(False), len(windows)))
+            return None
+        return merged.rows()
+
+
+def query_window(start_time_iso: str) -> tuple:
+    """
+    @param start_time_iso: Terraform script finish time, used as query start time
+    @return: (query start time in ns, query end time (now) as ISO time)
+    """
     # Query Start Time: Uses Terraform script finish time as query Start Time
-    timestamp_dt = datetime.datetime.strptime(CURRENT_TIME_ISO, '%Y-%m-%dT%H:%M:%S.%fZ')
+    timestamp_dt = datetime.datetime.strptime(start_time_iso, '%Y-%m-%dT%H:%M:%S.%fZ')
     unix_timestamp = timestamp_dt.replace(tzinfo=timezone.utc)
     query_start_time_ns = int(unix_timestamp.timestamp() * 1e9)
 
     # Query End Time: Current Time
     current_ts = datetime.datetime.now().timestamp()
     query_end_time = datetime.datetime.fromtimestamp(current_ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return query_start_time_ns, query_end_time
+
+
+@metrics.record_calls("validate", label_args=("source",))
+def validate_azure_data(source: str, stale_checks_mins: int, token_manager: TokenManager = None,
+                        state: ValidationState = None, deployment: Deployment = None, slices: int = 1) -> bool:
+    """
+
+    :param source: can be 'EventHub`, `ResourceManagement`, `VMMetrics`
+    :param stale_checks_mins: how long should difference be between received data and current query_start_time
+    :param token_manager: source of the bearer token. Defaults to the shared token manager of the deployment
+    :param state: if set, only the slice since the source's watermark is queried and merged into the state
+    :param deployment: deployment to validate. Defaults to the one configured by environment variables
+    :param slices: split the query window into this many sub-windows queried in parallel, see query_sliced
+    :return: if source is validated from current time (true, false)
+    """
+    if deployment is None:
+        deployment = Deployment()
+    label = deployment.label(source)
+    CURRENT_TIME_ISO = deployment.start_time_iso
+
+    query_start_time_ns, query_end_time = query_window(CURRENT_TIME_ISO)
+
+    query_start_time = CURRENT_TIME_ISO
+    if state is not None:
+        query_start_time = state.window_start(source, CURRENT_TIME_ISO)
+
+    logger.info("{}: stale_check_mins is: {} mins".format(label, stale_checks_mins))
+    logger.info("{}: query_start_time is: {}".format(label, query_start_time))
+    logger.info("{}: query_end_time is: {}".format(label, query_end_time))
+
+    # Validation only needs msg_count > 0, sliced queries merge per slice distinct counts instead of the values
+    pipeline = pipeline_config.build_pipeline(source, deployment.token_id, deployment.collection_version,
+                                              partial=slices > 1, exact_distinct=False)
+
+    # Query Dataset with pipeline, streaming rows into the JSON file until a verdict is reached
+    if token_manager is None:
+        token_manager = deployment.token_manager()
+    if slices > 1:
+        rows = query_sliced(token_manager.get(), deployment.dataset_id, pipeline,
+                            pipeline_config.source_stages[source][-1], query_start_time, query_end_time, slices,
+                            token_manager=token_manager, client=deployment.client(), exact_distinct=False)
+        rows = None if rows is None else (row for row in rows)
+    else:
+        rows = query_dataset(bearer_token=token_manager.get(), dataset_id=deployment.dataset_id, pipeline=pipeline,
+                             startTime=query_start_time, endTime=query_end_time, token_manager=token_manager,
+                             stream=True, client=deployment.client())
+    if rows is None:
+        logger.error("{}: Query failed".format(label))
+        return False
+
+    ds_file = deployment.output_file(source)
+    verdict = None
+    with closing(rows), open(ds_file, "w") as json_file:
+        json_file.write("[")
+        for index, item in enumerate(rows):
+            json_file.write(("," if index else "") + "\n" + json.dumps(item, indent=4) + "\n")
+            logger.info("{}: {}".format(label, item))
+            if state is not None:
+                state.merge(source, item)
+                continue
+            # The first row decides, the rest of the response is not read
+            verdict = check_data_freshness(label, item, query_start_time_ns, stale_checks_mins)
+            break
+        json_file.write("]\n")
+    logger.info("{}: JSON data has been saved to {}".format(label, ds_file))
+
+    if state is not None:
+        state.advance(source, query_end_time)
+        item = state.aggregate(source)
+        logger.info("{}: Merged since {}: {}".format(label, CURRENT_TIME_ISO, item))
+        if item is not None:
+            verdict = check_data_freshness(label, item, query_start_time_ns, stale_checks_mins)
+
+    if verdict is None:
+        # Return False if no entries found
+        logger.error("{}: Dataset is empty and has no entries within query window".format(label))
+        return False
+    return verdict
+
+
+def check_data_freshness(source: str, item: dict, query_start_time_ns: int, stale_checks_mins: int) -> bool:
+    """
+    Determines pass or fail of a source's query result for data staleness check or no data
+
+    :param source: source the row belongs to, used for logging
+    :param item: row with msg_count and earliest_ts (ns) columns
+    :param query_start_time_ns: start of the query window
+    :param stale_checks_mins: how long should difference be between received data and query_start_time
+    :return: if the row passes (true, false)
+    """
+    # Check if entries exist in query windows (pipeline)
+    msg_count = int(item["msg_count"])
+    if msg_count < 1:
+        logger.error("{}: No msg_count entries returned within query window".format(source))
+        return False
+    else:
+        logger.info("{}: > 0 msg_count entries returned within query window".format(source))
+
+    # If entries exist, then check if timestamps are not stale
+    earliest_ts_data_ns = int(item["earliest_ts"])
+    earliest_ts_data_ns_string = datetime.datetime.fromtimestamp(earliest_ts_data_ns / 1E9, timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+
+    logger.info("{}: Earliest time from data is: {}".format(source, earliest_ts_data_ns_string))
+    difference_minutes = (earliest_ts_data_ns - query_start_time_ns) * 1E-9 * (1 / 60)
+
+    # Check if the difference is less than to 30 minutes (in nanoseconds)
+    # There can be cases where data is few minutes earlier than query window because of valid from timesamp
+    # In that case, just check that its 10 mins. Eg: Query Start Time is 4:15pm but earliest timestamp can 4:10pm
+    # ^ This just means BUNDLE_TIMESTAMP was 4:15pm but we started getting data already
+    if difference_minutes > -10 and difference_minutes < stale_checks_mins:
+        logger.info("{}: earliest_ts_data is less than {} minutes stale".format(source, stale_checks_mins))
+        logger.info(
+            "{}: Difference in minutes (earliest ts - query_start_time) is: {}".format(source, difference_minutes))
+        return True
+
+    else:
+        logger.error("{}: earliest_ts_data is more than {} minutes stale".format(source, stale_checks_mins))
+        logger.info(
+            "{}: Difference in minutes (earliest ts - query_start_time) is: {}".format(source, difference_minutes))
+        return False
 
-    logger.info("{}: stale_check_mins is: {} mins".format(source, stale_checks_mins))
-    logger.info("{}: query_start_time is: {}".format(source, CURRENT_TIME_ISO))
-    logger.info("{}: query_end_time is: {}".format(source, query_end_time))
-
-    pipeline = ''
-    if source == "EventHub":
-        pipeline = pipeline_config.eventhub_pipeline
-    elif source == "ResourceManagement":
-        pipeline = pipeline_config.resource_management_pipeline
-    elif source == "VmMetrics":
-        pipeline = pipeline_config.vm_metrics_pipeline
-
-    # Query Dataset with pipeline and write results to JSON
-    bearer_token = get_bearer_token()
-    ds = query_dataset(bearer_token=bearer_token, dataset_id=AZURE_DATASET_ID, pipeline=pipeline,
-                       startTime=CURRENT_TIME_ISO, endTime=query_end_time)
-    ds_file = "{}.json".format(source)
-    with open(ds_file, "w") as json_file:
-        json.dump(ds, json_file, indent=4)
-    logger.info("{}: JSON data has been saved to {}.json".format(source, source))
-    logger.info("{}: {}".format(source, ds))
-
-    # Iterate through ds and determine if pass or fail for data staleness check or no data
-    for item in ds:
-        # Check if entries exist in query windows (pipeline)
-        msg_count = int(item["msg_count"])
-        if msg_count < 1:
-            logger.error("{}: No msg_count entries returned within query window".format(source))
-            return False
-        else:
-            logger.info("{}: > 0 msg_count entries returned within query window".format(source))
-
-        # If entries exist, then check if timestamps are not stale
-        earliest_ts_data_ns = int(item["earliest_ts"])
-        earliest_ts_data_ns_string = datetime.datetime.fromtimestamp(earliest_ts_data_ns / 1E9, timezone.utc).strftime(
-            '%Y-%m-%dT%H:%M:%SZ')
-
-        logger.info("{}: Earliest time from data is: {}".format(source, earliest_ts_data_ns_string))
-        difference_minutes = (earliest_ts_data_ns - query_start_time_ns) * 1E-9 * (1 / 60)
-
-        # Check if the difference is less than to 30 minutes (in nanoseconds)
-        # There can be cases where data is few minutes earlier than query window because of valid from timesamp
-        # In that case, just check that its 10 mins. Eg: Query Start Time is 4:15pm but earliest timestamp can 4:10pm
-        # ^ This just means BUNDLE_TIMESTAMP was 4:15pm but we started getting data already
-        if difference_minutes > -10 and difference_minutes < stale_checks_mins:
-            logger.info("{}: earliest_ts_data is less than {} minutes stale".format(source, stale_checks_mins))
-            logger.info(
-                "{}: Difference in minutes (earliest ts - query_start_time) is: {}".format(source, difference_minutes))
-            return True
 
+@metrics.record_calls("validate_fused")
+def validate_fused(sources: list, stale_checks_mins: int, token_manager: TokenManager = None,
+                   state: ValidationState = None, deployment: Deployment = None, slices: int = 1) -> dict:
+    """
+    Validates several sources with a single fused query that scans the dataset once and returns
+    one row per source, see pipeline_config.fused_pipeline.
+
+    :param sources: sources to validate, see validate_azure_data
+    :param stale_checks_mins: how long should difference be between received data and current query_start_time
+    :param token_manager: source of the bearer token. Defaults to the shared token manager
+    :param state: if set, only the slice since the earliest watermark of the sources is queried and merged
+    :param deployment: see validate_azure_data
+    :param slices: see validate_azure_data
+    :return: verdict per source {source: True/False}
+    """
+    if deployment is None:
+        deployment = Deployment()
+    fused_label = deployment.label("Fused {}".format(", ".join(sources)))
+    CURRENT_TIME_ISO = deployment.start_time_iso
+
+    query_start_time_ns, query_end_time = query_window(CURRENT_TIME_ISO)
+
+    query_start_time = CURRENT_TIME_ISO
+    if state is not None:
+        query_start_time = min((state.window_start(source, CURRENT_TIME_ISO) for source in sources),
+                               key=parse_iso)
+
+    logger.info("{}: query_start_time is: {}".format(fused_label, query_start_time))
+    logger.info("{}: query_end_time is: {}".format(fused_label, query_end_time))
+
+    if token_manager is None:
+        token_manager = deployment.token_manager()
+    pipeline = pipeline_config.fused_pipeline(sources, deployment.token_id, deployment.collection_version,
+                                              partial=slices > 1, exact_distinct=False)
+    if slices > 1:
+        rows = query_sliced(token_manager.get(), deployment.dataset_id, pipeline, pipeline_config.fused_statsby,
+                            query_start_time, query_end_time, slices, token_manager=token_manager,
+                            client=deployment.client(), exact_distinct=False)
+        rows = None if rows is None else (row for row in rows)
+    else:
+        rows = query_dataset(bearer_token=token_manager.get(), dataset_id=deployment.dataset_id, pipeline=pipeline,
+                             startTime=query_start_time, endTime=query_end_time, token_manager=token_manager,
+                             stream=True, client=deployment.client())
+    if rows is None:
+        logger.error("{}: Query failed".format(fused_label))
+        return {source: False for source in sources}
+
+    # Split the rows back out per source. Without state the first row of each source decides, so the
+    # response is only read until every source has one
+    source_rows = {source: [] for source in sources}
+    with closing(rows):
+        for item in rows:
+            source = item.get("source")
+            if source not in source_rows:
+                continue
+            if state is not None:
+                state.merge(source, item)
+            if not source_rows[source]:
+                source_rows[source].append(item)
+            if state is None and all(source_rows.values()):
+                break
+
+    results = {}
+    for source, items in source_rows.items():
+        label = deployment.label(source)
+        with open(deployment.output_file(source), "w") as json_file:
+            json.dump(items, json_file, indent=4)
+        logger.info("{}: {}".format(label, items))
+
+        if state is not None:
+            state.advance(source, query_end_time)
+            items = [item for item in [state.aggregate(source)] if item is not None]
+
+        if items:
+            results[source] = check_data_freshness(label, items[0], query_start_time_ns, stale_checks_mins)
         else:
-            logger.error("{}: earliest_ts_data is more than {} minutes stale".format(source, stale_checks_mins))
-            logger.info(
-                "{}: Difference in minutes (earliest ts - query_start_time) is: {}".format(source, difference_minutes))
-            return False
-    # Return False if no entries found
-    logger.error("{}: Dataset is empty and has no entries within query window".format(source))
-    return False
+            logger.error("{}: Dataset is empty and has no entries within query window".format(label))
+            results[source] = False
+    return results
+
+
+def validate_sources(sources: list, stale_checks_mins: int, concurrent: bool = True,
+                     state: ValidationState = None, fused: bool = False, deployment: Deployment = None,
+                     slices: int = 1) -> dict:
+    """
+    Validates each source with a single shared login.
+
+    @param sources: sources to validate, see validate_azure_data
+    @param stale_checks_mins: passed through to validate_azure_data
+    @param concurrent: run the source checks in parallel threads instead of one after another
+    @param state: incremental validation state, see validate_azure_data
+    @param fused: validate all sources with one query, see validate_fused
+    @param deployment: see validate_azure_data
+    @param slices: see validate_azure_data
+    @return: verdict per source {source: True/False}
+    """
+    if deployment is None:
+        deployment = Deployment()
+    token_manager = deployment.token_manager()
+    # Login (or load the cached token) once, before the source checks share it
+    try:
+        token_manager.get()
+    except Exception as err:
+        logger.error("{}Login raised {!r}".format("" if deployment.name is None else "{}: ".format(deployment.name),
+                                                  err))
+        return {source: False for source in sources}
+
+    if fused:
+        try:
+            return validate_fused(sources, stale_checks_mins, token_manager, state, deployment, slices)
+        except Exception as err:
+            logger.error("{}: Fused validation raised {!r}".format(deployment.label("Fused"), err))
+            return {source: False for source in sources}
+
+    if not concurrent:
+        results = {}
+        for source in sources:
+            try:
+                results[source] = validate_azure_data(source, stale_checks_mins, token_manager, state, deployment,
+                                                      slices)
+            except Exception as err:
+                logger.error("{}: Validation raised {!r}".format(deployment.label(source), err))
+                results[source] = False
+        return results
+
+    with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="validate") as executor:
+        futures = {source: executor.submit(validate_azure_data, source, stale_checks_mins, token_manager, state,
+                                           deployment, slices)
+                   for source in sources}
+        results = {}
+        for source, future in futures.items():
+            try:
+                results[source] = future.result()
+            except Exception as err:
+                logger.error("{}: Validation raised {!r}".format(deployment.label(source), err))
+                results[source] = False
+        return results
+
+
+def load_timer_schedules(terraform_dir: str, var_files: list = ()) -> dict:
+    """
+    @param terraform_dir: root module whose timer schedule variables are used when their environment variables
+                          (set from terraform outputs) are not, see Deployment
+    @param var_files: *.tfvars files of the deployment
+    @return: NCRONTAB schedule per timer source
+    """
+    from terraform_config import TerraformConfig # type: ignore
+
+    schedules = Deployment().timer_schedules
+    missing = [source for source in pipeline_config.TIMER_SOURCES if source not in schedules]
+    if missing:
+        config = TerraformConfig.load(terraform_dir, var_files)
+        for source in missing:
+            schedules[source] = config.variable(pipeline_config.TIMER_SOURCES[source])
+    return schedules
+
+
+def record_time_to_data(source: str, deployment: Deployment):
+    """Sets the time_to_data_secs_{source} metrics counter: seconds from the end of the Terraform script until
+    the source passed
+    """
+    elapsed_secs = time.time() - parse_iso(deployment.start_time_iso).timestamp()
+    metrics.set_counter(deployment.metric_name("time_to_data_secs_{}".format(source)), round(elapsed_secs, 3))
+
+
+def poll_sources(sources: list, stale_checks_mins: int, poll_schedule_secs: list, deadline_mins: float,
+                 concurrent: bool = True, state: ValidationState = None, fused: bool = False,
+                 deployment: Deployment = None, slices: int = 1, ingest_lag_secs: float = None) -> dict:
+    """
+    Polls the sources in-process until all of them pass or the deadline expires. A source that
+    passed is not queried again, the remaining sources keep polling.
+
+    @param sources: sources to validate, see validate_azure_data
+    @param stale_checks_mins: passed through to validate_azure_data
+    @param poll_schedule_secs: wait before each following poll of a source, the last value repeats. Eg: [15, 30, 60]
+    @param deadline_mins: overall time allowed for all sources to pass
+    @param concurrent: see validate_sources
+    @param state: incremental validation state, see validate_azure_data
+    @param fused: see validate_sources
+    @param deployment: see validate_azure_data
+    @param slices: see validate_azure_data
+    @param ingest_lag_secs: if set, timer sources are not polled before their data can first arrive, see
+                            Deployment.first_arrivals, and their poll schedule starts from then
+    @return: verdict per source {source: True/False}
+    """
+    if deployment is None:
+        deployment = Deployment()
+    prefix = "" if deployment.name is None else "{}: ".format(deployment.name)
+    deadline = time.monotonic() + deadline_mins * 60
+    results = {source: False for source in sources}
+    pending = list(sources)
+    # Polls of each source, which pick its wait from poll_schedule_secs
+    source_attempts = {source: 0 for source in sources}
+    attempt = 0
+
+    hold_until = {}
+    if ingest_lag_secs is not None:
+        hold_until = {source: arrival for source, arrival in deployment.first_arrivals(ingest_lag_secs).items()
+                      if source in sources}
+        for source, arrival in hold_until.items():
+            logger.info("{}: Schedule {} fires first at {}, not polling before {}".format(
+                deployment.label(source), deployment.timer_schedules[source],
+                (arrival - datetime.timedelta(seconds=ingest_lag_secs)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                arrival.strftime('%Y-%m-%dT%H:%M:%SZ')))
+            if arrival > datetime.datetime.now(timezone.utc) + datetime.timedelta(minutes=deadline_mins):
+                logger.warning("{}: First data is expected after the deadline of {} mins".format(
+                    deployment.label(source), deadline_mins))
+
+    while True:
+        now = datetime.datetime.now(timezone.utc)
+        due = [source for source in pending if source not in hold_until or hold_until[source] <= now]
+        if due:
+            attempt += 1
+            logger.info("{}Poll attempt {}: validating {}".format(prefix, attempt, ", ".join(due)))
+            try:
+                attempt_results = validate_sources(due, stale_checks_mins, concurrent=concurrent, state=state,
+                                                   fused=fused, deployment=deployment, slices=slices)
+            except Exception as err:
+                # A transient Observe or network error fails this attempt only, polling goes on until the deadline
+                logger.error("{}Poll attempt {} raised {!r}".format(prefix, attempt, err))
+                attempt_results = {source: False for source in due}
+            for source, valid in attempt_results.items():
+                source_attempts[source] += 1
+                if valid:
+                    logger.info("{}: Passed on attempt {}, no longer polling".format(deployment.label(source),
+                                                                                     attempt))
+                    results[source] = True
+                    record_time_to_data(source, deployment)
+            pending = [source for source in pending if not results[source]]
+            metrics.set_counter(deployment.metric_name("poll_attempts"), attempt)
+            if not pending:
+                return results
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.error("{}Deadline of {} mins reached after {} attempts".format(prefix, deadline_mins, attempt))
+            return results
+        # Wait for the next poll of the polled sources, or until the next held source is due
+        waits = [poll_schedule_secs[min(source_attempts[source], len(poll_schedule_secs)) - 1]
+                 for source in pending if source_attempts[source]]
+        waits += [(hold_until[source] - now).total_seconds() for source in pending if not source_attempts[source]
+                  and source in hold_until]
+        wait_secs = max(min(waits), 0)
+        logger.info("{}Waiting {:.0f}s before next poll ({:.0f}s left)".format(prefix, wait_secs, remaining))
+        time.sleep(min(wait_secs, remaining))
 
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description="Validates Azure collection data in Observe")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Validate sources one after another instead of concurrently")
+    parser.add_argument("--fused", action="store_true",
+                        help="Validate all sources with a single fused query instead of one query per source")
+    parser.add_argument("--wait", action="store_true",
+                        help="Keep polling until all sources pass or --deadline-mins expires")
+    parser.add_argument("--deadline-mins", type=float, default=40,
+                        help="Overall deadline for --wait (default: 40)")
+    parser.add_argument("--poll-schedule-secs", default="60",
+                        help="Comma separated waits between polls for --wait, the last one repeats (default: 60)")
+    parser.add_argument("--schedule-aware", action="store_true",
+                        help="With --wait, do not poll timer sources before their schedule first fires plus "
+                             "--ingest-lag-secs")
+    parser.add_argument("--ingest-lag-secs", type=float, default=120,
+                        help="Expected time from a timer firing until its data can be queried (default: 120)")
+    parser.add_argument("--terraform-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."),
+                        help="Module whose timer schedule variables are used when $TIMER_*_FUNC_SCHEDULE are not set "
+                             "(default: this repository)")
+    parser.add_argument("--var-file", action="append", default=[],
+                        help="tfvars file of the deployment, for the timer schedules. Can be repeated")
+    parser.add_argument("--state-file", default="validation_state.json",
+                        help="Watermarks and partial results kept between polls and runs (default: validation_state.json)")
+    parser.add_argument("--overlap-secs", type=float, default=120,
+                        help="Overlap of each incremental query with the previous one, for late data (default: 120)")
+    parser.add_argument("--full-window", action="store_true",
+                        help="Query the whole window since CURRENT_TIME_ISO on every poll instead of incrementally")
+    parser.add_argument("--slices", type=int, default=1,
+                        help="Split each query window into this many sub-windows queried in parallel (default: 1)")
+    parser.add_argument("--metrics-json", help="Write timings and sizes of logins, queries and validations as JSON")
+    parser.add_argument("--metrics-prom", help="Write timings and sizes as a Prometheus textfile")
+    parser.add_argument("--profile",
+                        help="Write cProfile stats of the run, including the source and slice query threads, to this "
+                             "file")
+    args = parser.parse_args()
+
     logger = logging.getLogger(__name__)
     log_format = '%(asctime)s - %(levelname)s - %(message)s'
     log_level = logging.INFO
@@ -286,15 +918,55 @@ if __name__ == '__main__':
     logger.info("Terraform Script End Time: {}".format(os.environ.get("CURRENT_TIME_ISO")))
     logger.info("------------------------------------\n")
 
-    eh = validate_azure_data(source='EventHub', stale_checks_mins=30)
-    rm = validate_azure_data(source='ResourceManagement', stale_checks_mins=30)
-    vm_metrics = validate_azure_data(source='VmMetrics', stale_checks_mins=30)
-
-    if eh is False or rm is False or vm_metrics is False:
+    profiler = None
+    if args.profile:
+        profiler = ThreadProfiler()
+        profiler.enable()
+
+    # Size the connection pool for the concurrent source and slice queries
+    configure_session(pool_size=max(10, len(SOURCES) * args.slices))
+
+    state = None
+    if not args.full_window:
+        state = ValidationState(args.state_file, Deployment().run_key(), overlap_secs=args.overlap_secs)
+
+    if args.wait:
+        poll_schedule_secs = [float(secs) for secs in args.poll_schedule_secs.split(",")]
+        deployment = None
+        if args.schedule_aware:
+            deployment = Deployment(timer_schedules=load_timer_schedules(args.terraform_dir, args.var_file))
+        results = poll_sources(SOURCES, stale_checks_mins=30, poll_schedule_secs=poll_schedule_secs,
+                               deadline_mins=args.deadline_mins, concurrent=not args.sequential, state=state,
+                               fused=args.fused, deployment=deployment, slices=args.slices,
+                               ingest_lag_secs=args.ingest_lag_secs if args.schedule_aware else None)
+    else:
+        results = validate_sources(SOURCES, stale_checks_mins=30, concurrent=not args.sequential, state=state,
+                                   fused=args.fused, slices=args.slices)
+        for source in (source for source, valid in results.items() if valid):
+            record_time_to_data(source, Deployment())
+        metrics.set_counter("poll_attempts", 1)
+    logger.info("Token manager: {}".format(get_token_manager().stats()))
+    logger.info("HTTP retries: {}".format(get_client().retries))
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        logger.info("cProfile stats written to {}".format(args.profile))
+
+    for name, value in get_token_manager().stats().items():
+        metrics.set_counter("token_{}".format(name), value)
+    metrics.set_counter("http_retries", get_client().retries)
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+    if os.environ.get("GITHUB_STEP_SUMMARY"):
+        metrics.append_markdown(os.environ["GITHUB_STEP_SUMMARY"])
+
+    if not all(results.values()):
         logger.error("One or more sources are not valid")
-        logger.error("EventHub: {}".format(eh))
-        logger.error("ResourceManagement: {}".format(rm))
-        logger.error("VmMetrics: {}".format(vm_metrics))
+        for source, valid in results.items():
+            logger.error("{}: {}".format(source, valid))
         sys.exit(1)
 
     logger.info("All sources are valid")
@@ -0,0 +1,59 @@
+"""
+Command line handling shared by the report scripts (lag_report.py, function_report.py, throughput_report.py):
+the query window arguments, failed queries recorded in the report instead of aborting it, and the GitHub
+step summary.
+"""
+import argparse
+import datetime
+import logging
+import os
+from datetime import timezone
+
+from validation_state import ISO_FORMAT # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def add_window_arguments(parser: argparse.ArgumentParser):
+    """Adds --window-mins, --start and --end, see report_window"""
+    parser.add_argument("--window-mins", type=float, default=60, help="Window ending now (default: 60)")
+    parser.add_argument("--start", help="Start of the window as ISO time, instead of --window-mins")
+    parser.add_argument("--end", help="End of the window as ISO time (default: now)")
+
+
+def report_window(args: argparse.Namespace) -> tuple:
+    """
+    @param args: parsed arguments of a parser set up by add_window_arguments
+    @return: (start, end) of the window as ISO time
+    """
+    now = datetime.datetime.now(timezone.utc)
+    end_time = args.end or now.strftime(ISO_FORMAT)
+    start_time = args.start or (now - datetime.timedelta(minutes=args.window_mins)).strftime(ISO_FORMAT)
+    return start_time, end_time
+
+
+def run_query(errors: dict, key: str, description: str, query, default=None):
+    """
+    Runs one query of a report. A failed query is recorded in errors instead of raising, so the report is
+    still written from whatever was measured.
+
+    @param errors: failed queries of the report, key to the repr of the exception
+    @param key: name of the query in errors
+    @param description: what is queried, for the log
+    @param query: function without arguments running the query
+    @param default: returned if the query raises
+    @return: result of query, or default
+    """
+    try:
+        return query()
+    except Exception as err:
+        logger.error("{} raised {!r}".format(description, err))
+        errors[key] = repr(err)
+        return default
+
+
+def append_step_summary(text: str):
+    """Appends markdown to $GITHUB_STEP_SUMMARY, if it is set"""
+    if os.environ.get("GITHUB_STEP_SUMMARY"):
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as summary_file:
+            summary_file.write(text)
@@ -1,32 +1,15 @@
-import json
-import os
-import re 
+import logging
 
-print( "GITHUB_HEAD_REF: " + os.getenv("GITHUB_HEAD_REF"))
-print( "GITHUB_REF: " + os.getenv("GITHUB_REF"))
+import environment_overrides # type: ignore
 
-# Extract branch name from either GITHUB_HEAD_REF or GITHUB_REF
-if os.getenv("GITHUB_HEAD_REF") is not None and os.getenv("GITHUB_HEAD_REF") != '':
-    branch = os.getenv("GITHUB_HEAD_REF")
-else:
-    branch = os.getenv("GITHUB_REF")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
+# Sets TF_VAR_branch in $GITHUB_ENV for .github/terraform/main.tf, the branch of this workflow run
+# (GITHUB_HEAD_REF or GITHUB_REF) with / replaced by -, e.g. nikhil-add-CI-OB-29418
+branch = environment_overrides.current_branch()
+logger.info("Branch name: {}".format(branch))
 
-# Remove /refs/heads/ from the branch name
-# Replace "/" with "-" in the branch name
-# Example: refs/heads/nikhil/add-CI-OB-29418 becomes nikhil-add-CI-OB-29418
-branch = branch.replace("refs/heads/", "").replace("/", "-")
+environment_overrides.set_github_env(environment_overrides.Environment(branch).tfvars())
 
-# Convert branch name to lowercase, remove special characters, and save to branch_concat
-# Remove special characters
-branch_concat = re.sub(r"[/\-]", "", branch).lower()[:20] #Max 20 characters for branch name 
-
-
-print (f"Branch name: {branch}")
-print (f"Branch name concat: {branch_concat}")
-
-env_file = os.getenv('GITHUB_ENV')
-with open(env_file, "a") as myfile:
-    myfile.write("TF_VAR_branch=" + branch)
-
-print ("TF_VAR_branch set to " + branch + "for .github/terraform/main.tf")
+logger.info("TF_VAR_branch set to {} for .github/terraform/main.tf".format(branch))
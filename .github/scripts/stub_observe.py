@@ -0,0 +1,294 @@
+"""
+Local stand-in for the Observe API used by query_observe.py, for benchmarks and offline runs.
+
+Serves /v1/login and /v1/meta/export/query. Export queries answer with synthetic NDJSON rows for the
+sources named in the pipeline: validation aggregates or their per slice partials, event_time/BUNDLE_TIMESTAMP
+rows for lag pipelines, per minute events/bytes for ingest rate and breakdown pipelines, or FunctionAppLogs
+messages. Rows are streamed with chunked transfer encoding so bodies of millions of rows are never held in
+memory. Latency, throttling (429) and server errors can be injected.
+
+Run standalone and point the scripts at it with OBSERVE_BASE_URL:
+
+    python stub_observe.py --port 8080 --rows 100000 --latency-secs 0.2
+    OBSERVE_BASE_URL=http://127.0.0.1:8080 python query_observe.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SOURCES = ['EventHub', 'ResourceManagement', 'VmMetrics']
+
+# Rows are written to the socket in batches of this many
+_BATCH_ROWS = 1000
+
+
+class StubObserve:
+    """
+    Stub Observe API server running in a background thread. Use as a context manager:
+
+        with StubObserve(rows=1000) as stub:
+            os.environ["OBSERVE_BASE_URL"] = stub.url
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, rows: int = 1, row_bytes: int = 0,
+                 latency_secs: float = 0.0, throttle_rate: float = 0.0, error_rate: float = 0.0,
+                 data_delay_secs: float = 0.0, lag_secs: float = 30.0, seed: int = None):
+        """
+        @param host: interface to listen on
+        @param port: port to listen on, 0 picks a free one
+        @param rows: rows returned per export query, spread over the sources in the pipeline
+        @param row_bytes: padding added to each row, to simulate wide raw rows
+        @param latency_secs: delay before the response headers of each export query
+        @param throttle_rate: fraction of export queries answered with 429
+        @param error_rate: fraction of export queries answered with 500
+        @param data_delay_secs: export queries return no rows until this long after the server started
+        @param lag_secs: mean ingestion lag of the rows returned to lag pipelines
+        @param seed: seed for the injected failures, for repeatable runs
+        """
+        self.rows = rows
+        self.row_bytes = row_bytes
+        self.latency_secs = latency_secs
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.data_delay_secs = data_delay_secs
+        self.lag_secs = lag_secs
+        self.random = random.Random(seed)
+        self.started_at = time.time()
+        self.counters = {"login": 0, "query": 0, "throttled": 0, "errors": 0, "rows_sent": 0}
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(_StubHandler):
+            server_stub = stub
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self) -> "StubObserve":
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-observe", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def inject_failure(self) -> int:
+        """@return: status code to answer with instead of data, or None"""
+        with self._lock:
+            draw = self.random.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/v1/login"):
+            self.server_stub.count("login")
+            self._send_json(200, {"ok": True, "access_key": "stub-access-key"})
+        elif self.path.startswith("/v1/meta/export/query"):
+            self._export_query(body)
+        else:
+            self._send_json(404, {"message": "not found"})
+
+    def _export_query(self, body: bytes):
+        stub = self.server_stub
+        stub.count("query")
+        if stub.latency_secs:
+            time.sleep(stub.latency_secs)
+
+        status = stub.inject_failure()
+        if status == 429:
+            stub.count("throttled")
+            self._send_json(429, {"message": "throttled"}, headers={"Retry-After": "0"})
+            return
+        if status == 500:
+            stub.count("errors")
+            self._send_json(500, {"message": "injected error"})
+            return
+
+        try:
+            pipeline = json.loads(body)["query"]["stages"][0]["pipeline"]
+        except (ValueError, KeyError, IndexError):
+            self._send_json(400, {"message": "invalid query"})
+            return
+
+        sources = [source for source in SOURCES if re.search(r"'{}'".format(source), pipeline)] or SOURCES
+        rows = stub.rows if time.time() - stub.started_at >= stub.data_delay_secs else 0
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        now_ns = time.time_ns()
+        padding = "x" * stub.row_bytes
+        try:
+            if "FunctionAppLogs" in pipeline:
+                self._write_function_logs(rows, now_ns)
+            else:
+                self._write_rows(sources, rows, now_ns, padding, lag_rows="event_time" in pipeline,
+                                 rate_rows="event_bytes" in pipeline, partial_rows="_distinct_" in pipeline,
+                                 breakdown_rows="resourceId" in pipeline)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients stop reading once they have a verdict
+            self.close_connection = True
+
+    def _write_rows(self, sources: list, rows: int, now_ns: int, padding: str, lag_rows: bool, rate_rows: bool,
+                    partial_rows: bool, breakdown_rows: bool):
+        stub = self.server_stub
+        sent = 0
+        while sent < rows:
+            batch = min(_BATCH_ROWS, rows - sent)
+            lines = []
+            for index in range(sent, sent + batch):
+                if lag_rows:
+                    # Spread ingest times over the last hour with exponentially distributed lag
+                    ingest_ns = now_ns - int(stub.random.random() * 3600 * 10 ** 9)
+                    row = {
+                        "source": sources[index % len(sources)],
+                        "event_time": str(ingest_ns - int(stub.random.expovariate(1 / stub.lag_secs) * 10 ** 9)),
+                        "BUNDLE_TIMESTAMP": str(ingest_ns),
+                    }
+                elif breakdown_rows:
+                    # Ten resources per minute going back from now, the first one sending most of the events
+                    minute = time.gmtime(now_ns // 10 ** 9 - 60 * (index // 10))
+                    resource = index % 10
+                    events = int(stub.random.uniform(0.5, 1.5) * (5000 if resource == 0 else 100))
+                    row = {
+                        "category": ["FunctionAppLogs", "AuditEvent", "AllMetrics"][resource % 3],
+                        "appName": "app-{}".format(resource % 4),
+                        "resource": "/SUBSCRIPTIONS/SUB/RESOURCEGROUPS/RG/PROVIDERS/RES-{}".format(resource),
+                        "minute": time.strftime('%Y-%m-%d %H:%M', minute),
+                        "events": str(events),
+                        "bytes": str(events * 800),
+                    }
+                elif rate_rows:
+                    # One row per source and minute, going back from now
+                    minute = time.gmtime(now_ns // 10 ** 9 - 60 * (index // len(sources)))
+                    events = int(stub.random.uniform(0.5, 1.5) * 1000)
+                    row = {
+                        "source": sources[index % len(sources)],
+                        "minute": time.strftime('%Y-%m-%d %H:%M', minute),
+                        "events": str(events),
+                        "bytes": str(events * 1500),
+                    }
+                elif partial_rows:
+                    # One row per source and distinct value, the same values in every slice
+                    row = {
+                        "source": sources[index % len(sources)],
+                        "_distinct_msg_count": "value-{}".format(index // len(sources)),
+                        "earliest_ts": str(now_ns - 60 * 10 ** 9 - index),
+                    }
+                else:
+                    row = {
+                        "source": sources[index % len(sources)],
+                        "msg_count": str(index + 1),
+                        "earliest_ts": str(now_ns - 60 * 10 ** 9),
+                    }
+                if padding:
+                    row["message"] = padding
+                lines.append(json.dumps(row))
+            self._write_chunk(("\n".join(lines) + "\n").encode())
+            sent += batch
+            stub.count("rows_sent", batch)
+        self._write_chunk(b"")
+
+    def _write_function_logs(self, rows: int, now_ns: int):
+        # FunctionAppLogs messages of rows invocations spread over the last hour, on a new host every 100
+        stub = self.server_stub
+        functions = ["eventhub_trigger_func", "timer_resources_func", "timer_vm_metrics_func"]
+        lines = []
+        for index in range(rows):
+            event_ns = now_ns - int((rows - index) * 3600 * 10 ** 9 / rows)
+            host = "host-{}".format(index // 100)
+            function = functions[index % len(functions)]
+            if index % 100 == 0:
+                lines.append({"event_time": str(event_ns - 1), "host_instance": host, "function": "",
+                              "message": "Host started ({}ms)".format(int(stub.random.uniform(500, 3000)))})
+            if function == "eventhub_trigger_func":
+                lines.append({"event_time": str(event_ns - 1), "host_instance": host,
+                              "function": "Functions." + function,
+                              "message": "Trigger Details: PartitionId: {}, Offset: 0-100, SequenceNumber: 0-9, "
+                                         "Count: {}".format(index % 32, stub.random.randint(1, 100))})
+            status = "Failed" if stub.random.random() < 0.02 else "Succeeded"
+            lines.append({"event_time": str(event_ns), "host_instance": host, "function": "Functions." + function,
+                          "message": "Executed 'Functions.{}' ({}, Id={}, Duration={}ms)".format(
+                              function, status, index, int(stub.random.expovariate(1 / 800)))})
+        self._write_chunk("".join(json.dumps(line) + "\n" for line in lines).encode())
+        stub.count("rows_sent", len(lines))
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _send_json(self, status: int, content: dict, headers: dict = None):
+        data = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stub of the Observe login and export query API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rows", type=int, default=1, help="Rows per export query (default: 1)")
+    parser.add_argument("--row-bytes", type=int, default=0, help="Padding per row (default: 0)")
+    parser.add_argument("--latency-secs", type=float, default=0.0, help="Delay per export query (default: 0)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of queries answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of queries answered 500")
+    parser.add_argument("--lag-secs", type=float, default=30.0,
+                        help="Mean ingestion lag of rows returned to lag pipelines (default: 30)")
+    parser.add_argument("--data-delay-secs", type=float, default=0.0,
+                        help="Return no rows until this long after start (default: 0)")
+    args = parser.parse_args()
+
+    stub = StubObserve(args.host, args.port, rows=args.rows, row_bytes=args.row_bytes,
+                       latency_secs=args.latency_secs, throttle_rate=args.throttle_rate,
+                       error_rate=args.error_rate, data_delay_secs=args.data_delay_secs,
+                       lag_secs=args.lag_secs)
+    print("Stub Observe API listening on {}".format(stub.url))
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+        print(json.dumps(stub.counters))
@@ -0,0 +1,212 @@
+"""
+Reads the sizing settings of this module from its Terraform files without running Terraform.
+
+Parses the top level blocks (resource, data, variable, output, locals) of *.tf files and the assignments
+of *.tfvars files. Attribute values that are literals become Python values; anything else (references,
+interpolations, function calls, maps) is kept as an Expression holding the source text. References of
+the form var.NAME resolve to the tfvars value or the variable's default, as do conditionals on them.
+"""
+import glob
+import os
+import re
+
+_ATTRIBUTE = re.compile(r'^\s*([A-Za-z_][\w-]*)\s*=\s*(.*)$', re.S)
+_BLOCK_HEADER = re.compile(r'^\s*([A-Za-z_][\w-]*)((?:\s+"[^"]*")*)\s*$')
+_VARIABLE_REFERENCE = re.compile(r'^var\.([A-Za-z_][\w-]*)$')
+_MAP_ENTRY = re.compile(r'("[^"]*"|[A-Za-z_][\w-]*)\s*[:=]\s*("(?:[^"\\]|\\.)*"|[^,\n]+)')
+_LIST_ITEM = re.compile(r'"(?:[^"\\]|\\.)*"|[^,\s]+')
+# condition ? true_value : false_value, with simple operands
+_CONDITIONAL = re.compile(r'^([^?:]+?)\s*\?\s*([^?:]+?)\s*:\s*([^?:]+)$')
+
+
+class Expression(str):
+    """Terraform expression that is not a literal, e.g. var.location or "${local.sub}" """
+
+
+class Block:
+    def __init__(self, kind: str, labels: list, attributes: dict, blocks: list):
+        """
+        @param kind: e.g. resource
+        @param labels: e.g. ["azurerm_eventhub", "observe_eventhub"]
+        @param attributes: attribute name to value
+        @param blocks: nested blocks
+        """
+        self.kind = kind
+        self.labels = labels
+        self.attributes = attributes
+        self.blocks = blocks
+
+    def __repr__(self):
+        return "Block({} {})".format(self.kind, " ".join(self.labels))
+
+
+class TerraformConfig:
+    def __init__(self, blocks: list, tfvars: dict = None):
+        self.blocks = blocks
+        self.tfvars = tfvars or {}
+
+    @classmethod
+    def load(cls, directory: str, var_files: list = ()) -> "TerraformConfig":
+        """
+        @param directory: Terraform root module
+        @param var_files: *.tfvars files, later files take precedence
+        @return: parsed configuration
+        """
+        blocks = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.tf"))):
+            with open(path) as tf_file:
+                blocks.extend(parse_blocks(tf_file.read()))
+        tfvars = {}
+        for path in var_files:
+            with open(path) as tfvars_file:
+                tfvars.update(parse_body(tfvars_file.read()).attributes)
+        return cls(blocks, tfvars)
+
+    def resources(self, resource_type: str = None) -> list:
+        """@return: resource blocks, optionally only those of one type"""
+        return [block for block in self.blocks
+                if block.kind == "resource" and (resource_type is None or block.labels[0] == resource_type)]
+
+    def resource(self, resource_type: str, name: str = None) -> Block:
+        """@return: the named resource, or the only/first one of the type when no name is given"""
+        for block in self.resources(resource_type):
+            if name is None or block.labels[1] == name:
+                return block
+        raise KeyError("resource {}.{} not found".format(resource_type, name or "*"))
+
+    def variable(self, name: str):
+        """@return: the tfvars value of the variable, else its default, else None"""
+        if name in self.tfvars:
+            return self.tfvars[name]
+        for block in self.blocks:
+            if block.kind == "variable" and block.labels == [name]:
+                return block.attributes.get("default")
+        raise KeyError("variable {} not found".format(name))
+
+    def attribute(self, resource_type: str, name: str, attribute: str, default=None):
+        """@return: value of the resource attribute with var.NAME references resolved"""
+        return self.resolve(self.resource(resource_type, name).attributes.get(attribute, default))
+
+    def resolve(self, value):
+        """@return: value with var.NAME references and conditionals on them resolved, where possible"""
+        if isinstance(value, Expression):
+            match = _VARIABLE_REFERENCE.match(value)
+            if match:
+                return self.variable(match.group(1))
+            match = _CONDITIONAL.match(value)
+            if match:
+                condition = self.resolve(parse_value(match.group(1)))
+                if isinstance(condition, bool):
+                    return self.resolve(parse_value(match.group(2) if condition else match.group(3)))
+        return value
+
+
+def parse_blocks(text: str) -> list:
+    """@return: top level blocks of a .tf file"""
+    return parse_body(text).blocks
+
+
+def parse_body(text: str) -> Block:
+    """@return: attributes and nested blocks of a block body, or of a whole file"""
+    text = _strip_comments(text)
+    attributes = {}
+    blocks = []
+    position = 0
+    while position < len(text):
+        end = _statement_end(text, position)
+        statement = text[position:end].strip()
+        position = end + 1
+        if not statement:
+            continue
+        if statement.endswith("}") and "{" in statement:
+            header, _, body = statement.partition("{")
+            header_match = _BLOCK_HEADER.match(header)
+            if header_match and "=" not in header:
+                labels = re.findall(r'"([^"]*)"', header_match.group(2))
+                nested = parse_body(body[:-1])
+                blocks.append(Block(header_match.group(1), labels, nested.attributes, nested.blocks))
+                continue
+        attribute_match = _ATTRIBUTE.match(statement)
+        if attribute_match:
+            attributes[attribute_match.group(1)] = parse_value(attribute_match.group(2))
+    return Block("body", [], attributes, blocks)
+
+
+def parse_value(raw: str):
+    """@return: str, int, float or bool for literals, Expression otherwise"""
+    raw = raw.strip()
+    if re.fullmatch(r'"(?:[^"\\$]|\\.|\$(?!\{))*"', raw):
+        return raw[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if re.fullmatch(r'-?\d+', raw):
+        return int(raw)
+    if re.fullmatch(r'-?\d+\.\d+', raw):
+        return float(raw)
+    if raw in ("true", "false"):
+        return raw == "true"
+    if raw == "null":
+        return None
+    if raw.startswith("{") and raw.endswith("}") and "{" not in raw[1:-1]:
+        # Flat map of literals, e.g. the location_abbreviation default
+        entries = _MAP_ENTRY.findall(raw[1:-1])
+        values = {key.strip('"'): parse_value(value) for key, value in entries}
+        if not any(isinstance(value, Expression) for value in values.values()):
+            return values
+    if raw.startswith("[") and raw.endswith("]") and "[" not in raw[1:-1]:
+        values = [parse_value(value) for value in _LIST_ITEM.findall(raw[1:-1])]
+        if not any(isinstance(value, Expression) for value in values):
+            return values
+    return Expression(raw)
+
+
+def _statement_end(text: str, position: int) -> int:
+    """@return: index of the newline ending the statement at position, outside strings and brackets"""
+    depth = 0
+    in_string = False
+    index = position
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            if char == "\\":
+                index += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[(":
+            depth += 1
+        elif char in "}])":
+            depth -= 1
+        elif char == "\n" and depth <= 0:
+            return index
+        index += 1
+    return len(text)
+
+
+def _strip_comments(text: str) -> str:
+    output = []
+    in_string = False
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            output.append(char)
+            if char == "\\" and index + 1 < len(text):
+                output.append(text[index + 1])
+                index += 1
+            elif char == '"':
+                in_string = False
+            index += 1
+        elif char == '"':
+            in_string = True
+            output.append(char)
+            index += 1
+        elif char == "#" or text.startswith("//", index):
+            newline = text.find("\n", index)
+            index = len(text) if newline < 0 else newline
+        elif text.startswith("/*", index):
+            close = text.find("*/", index + 2)
+            index = len(text) if close < 0 else close + 2
+        else:
+            output.append(char)
+            index += 1
+    return "".join(output)
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import query_observe
+from capacity_planner import consumer_eps_from_load_test, measure_ingest, plan
+
+CURRENT = {
+    "eventhub_sku": "Standard",
+    "throughput_units": 1,
+    "auto_inflate": False,
+    "maximum_throughput_units": 1,
+    "partition_count": 4,
+    "plan_sku": "Y1",
+    "timer_schedules": {"ResourceManagement": "0 */5 * * * *", "VmMetrics": "30 */5 * * * *"},
+}
+
+
+class TokenManagerStub:
+    def get(self) -> str:
+        return "token"
+
+
+def plan_sku(current_sku: str, eventhub_lag_secs: float) -> tuple:
+    """@return: (recommended plan SKU, notes) with a 300s SLO, 30% headroom and a 30s cold start"""
+    result = plan(dict(CURRENT, plan_sku=current_sku), 100, 1000, eventhub_lag_secs, {}, 300, 0.3, 500, 30)
+    assert result["tfvars"]["service_plan_sku_name"] == result["recommended"]["plan_sku"]
+    return result["recommended"]["plan_sku"], result["notes"]
+
+
+@pytest.mark.parametrize("current_sku", ["Y1", "EP1", "EP3"])
+def test_plan_sku_is_kept_when_measurements_do_not_call_for_a_change(current_sku):
+    lag_secs = 20 if current_sku == "Y1" else 200
+    sku, notes = plan_sku(current_sku, lag_secs)
+    assert sku == current_sku
+    assert not any("plan" in note for note in notes)
+
+
+def test_consumption_plan_is_upgraded_when_cold_starts_break_the_slo():
+    sku, notes = plan_sku("Y1", 200)
+    assert sku == "EP1"
+    assert any("upgrade from Y1" in note for note in notes)
+
+
+def test_elastic_premium_plan_downgrade_is_called_out():
+    sku, notes = plan_sku("EP2", 20)
+    assert sku == "Y1"
+    assert any(note.startswith("Downgrade:") and "EP2" in note for note in notes)
+
+
+def test_missing_plan_sku_defaults_to_consumption():
+    assert plan_sku(None, 20)[0] == "Y1"
+
+
+def test_load_test_records_are_converted_to_events_per_partition(tmp_path):
+    load_test = tmp_path / "load_test.json"
+    load_test.write_text(json.dumps({"partitions": 4, "records_per_event": 10, "steps": [
+        {"target_rate": 400, "delivered_ratio": 1.0, "delivered_records_rate": 4000.0},
+        {"target_rate": 800, "delivered_ratio": 0.8, "delivered_records_rate": 6400.0},
+    ]}))
+    assert consumer_eps_from_load_test(str(load_test)) == 100.0
+
+
+def test_observe_rows_are_converted_to_events(monkeypatch):
+    rows = [{"source": "EventHub", "minute": "2024-05-28 12:00", "events": "6000", "bytes": "600000"},
+            {"source": "EventHub", "minute": "2024-05-28 12:01", "events": "1200", "bytes": "120000"}]
+    monkeypatch.setattr(query_observe, "get_token_manager", lambda: TokenManagerStub())
+    monkeypatch.setattr(query_observe, "query_dataset", lambda *args, **kwargs: (row for row in rows))
+    measured = measure_ingest(["EventHub"], "2024-05-28T12:00:00Z", "2024-05-28T12:02:00Z", records_per_event=10)
+    assert measured["EventHub"] == {"mean_eps": 6.0, "peak_eps": 10.0, "event_bytes": 1000.0}
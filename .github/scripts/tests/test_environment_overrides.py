@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import environment_overrides
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+LONG_BRANCHES = ["feature-a-very-long-branch-name-one", "feature-a-very-long-branch-name-two"]
+
+
+def names(config: dict, attribute: str = "name") -> dict:
+    return {resource_type: entry[attribute] for resource_type, resources in config["resource"].items()
+            for entry in resources.values() if attribute in entry}
+
+
+@pytest.mark.parametrize("resource_type, prefix", [("azurerm_storage_account", "ghsa"),
+                                                   ("azurerm_key_vault", "ghkv")])
+def test_long_branches_get_hashed_compact_names(resource_type, prefix):
+    compact = {branch: environment_overrides.Environment(branch).resource_name(resource_type)
+               for branch in LONG_BRANCHES}
+
+    for branch, name in compact.items():
+        assert len(name) == environment_overrides.COMPACT_MAX_LENGTH
+        assert name == prefix + "featureaverylong" + hashlib.sha1(branch.encode()).hexdigest()[:4]
+    assert len(set(compact.values())) == len(LONG_BRANCHES)
+
+
+def test_short_branches_keep_their_compact_names():
+    environment = environment_overrides.Environment("Feature-A", "westeurope", "weu")
+
+    assert environment.resource_name("azurerm_storage_account") == "ghsafeatureaweu"
+    assert environment.resource_name("azurerm_key_vault") == "ghkvfeatureaweu"
+
+
+def test_long_branches_pass_validation_without_collisions():
+    generated = environment_overrides.generate(LONG_BRANCHES)
+
+    assert set(generated) == set(LONG_BRANCHES)
+
+
+def test_dots_in_branches_become_hyphens_in_names():
+    environment, config = environment_overrides.generate(["release-1.2"])["release-1.2"]
+
+    resource_names = names(config)
+    assert resource_names["azurerm_eventhub_namespace"] == "gh-ehns-release-1-2"
+    assert resource_names["azurerm_linux_function_app"] == "gh-fa-release-1-2"
+    assert resource_names["azurerm_resource_group"] == "gh-rg-release-1-2"
+    assert resource_names["azurerm_storage_account"] == "ghsarelease12"
+    assert names(config, "display_name")["azuread_application"] == "gh-app-release-1-2"
+    # Tags, the Observe token and the Terraform state keep the branch as it is
+    assert config["resource"]["azurerm_resource_group"]["observe_resource_group"]["tags"]["branch"] == "release-1.2"
+    assert environment.tfvars() == {"branch": "release-1.2"}
+
+
+def test_branches_differing_only_in_dots_collide():
+    with pytest.raises(ValueError, match="is used by release-1.2, release-1-2"):
+        environment_overrides.generate(["release-1.2", "release-1-2"])
+
+
+def run_wrapper(script: str, tmp_path, ref: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, GITHUB_REF=ref, GITHUB_ENV=str(tmp_path / "github_env"))
+    env.pop("GITHUB_HEAD_REF", None)
+    return subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, script)], cwd=tmp_path, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def test_create_override_collection_writes_override_of_the_branch(tmp_path):
+    process = run_wrapper("create_override_collection.py", tmp_path, "refs/heads/nikhil/add-CI-OB-29418")
+
+    with open(tmp_path / "override.tf.json") as json_file:
+        config = json.load(json_file)
+    assert config == environment_overrides.generate(["nikhil-add-CI-OB-29418"])["nikhil-add-CI-OB-29418"][1]
+    assert names(config)["azurerm_resource_group"] == "gh-rg-nikhil-add-CI-OB-29418"
+    assert " - INFO - Branch name: nikhil-add-CI-OB-29418" in process.stderr
+    assert " - INFO - Contents of override.tf.json\n" in process.stderr
+    assert not (tmp_path / "github_env").exists()
+
+
+def test_set_additional_tf_variables_appends_branch_to_github_env(tmp_path):
+    (tmp_path / "github_env").write_text("EXISTING=1\n")
+
+    process = run_wrapper("set_additional_tf_variables.py", tmp_path, "refs/heads/nikhil/add-CI-OB-29418")
+
+    assert (tmp_path / "github_env").read_text() == "EXISTING=1\nTF_VAR_branch=nikhil-add-CI-OB-29418\n"
+    assert " - INFO - TF_VAR_branch set to nikhil-add-CI-OB-29418 for .github/terraform/main.tf" in process.stderr
+    assert not (tmp_path / "override.tf.json").exists()
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+import fleet
+import query_observe
+
+
+class TokenManagerStub:
+    def __init__(self, error: Exception = None):
+        self.error = error
+
+    def get(self) -> str:
+        if self.error is not None:
+            raise self.error
+        return "token"
+
+
+def test_failed_tenant_login_fails_only_its_deployments(monkeypatch):
+    deployments = [query_observe.Deployment(name=name, customer_id=customer, domain="observeinc.com",
+                                            dataset_id="1", token_id="t", collection_version="v",
+                                            start_time_iso="2024-05-28T12:00:00.000Z")
+                   for name, customer in (("east", "111"), ("west", "222"), ("north", "111"))]
+    managers = {("111", "observeinc.com"): TokenManagerStub(ConnectionError("tenant down")),
+                ("222", "observeinc.com"): TokenManagerStub()}
+    validated = []
+
+    def validate_deployment(deployment, sources, **kwargs):
+        validated.append(deployment.name)
+        return {"name": deployment.name, "customer_id": deployment.customer_id,
+                "results": {source: True for source in sources}, "valid": True, "duration_secs": 1.0, "error": None}
+
+    monkeypatch.setattr(query_observe, "get_token_manager",
+                        lambda customer_id, domain, *credentials: managers[(customer_id, domain)])
+    monkeypatch.setattr(fleet, "validate_deployment", validate_deployment)
+
+    reports = fleet.validate_fleet(deployments, ["EventHub"], workers=2)
+
+    assert validated == ["west"]
+    assert [(report["name"], report["valid"]) for report in reports] == [("east", False), ("west", True),
+                                                                         ("north", False)]
+    assert "tenant down" in reports[0]["error"]
+    assert reports[0]["results"] == {"EventHub": False}
+
+
+def test_manifest_entries_name_their_tenant_credentials(tmp_path, monkeypatch):
+    monkeypatch.setenv("OBSERVE_USER_EMAIL_EU", "eu@example.com")
+    monkeypatch.setenv("OBSERVE_USER_PASSWORD_EU", "secret")
+    manifest = tmp_path / "fleet.json"
+    common = {"azure_dataset_id": "1", "observe_token_id": "t", "azure_collection_function": "v",
+              "start_time": "2024-05-28T12:00:00.000Z", "observe_domain": "observeinc.com"}
+    manifest.write_text(json.dumps({"deployments": [
+        dict(common, name="us", observe_customer="111"),
+        dict(common, name="eu", observe_customer="222", user_email_env="OBSERVE_USER_EMAIL_EU",
+             password_env="OBSERVE_USER_PASSWORD_EU"),
+    ]}))
+    us, eu = fleet.load_manifest(str(manifest))
+    assert (us.user_email_env, us.password_env) == ("OBSERVE_USER_EMAIL", "OBSERVE_USER_PASSWORD")
+    assert (eu.user_email_env, eu.password_env) == ("OBSERVE_USER_EMAIL_EU", "OBSERVE_USER_PASSWORD_EU")
+
+    monkeypatch.delenv("OBSERVE_USER_PASSWORD_EU")
+    with pytest.raises(ValueError, match=r"\$OBSERVE_USER_PASSWORD_EU"):
+        fleet.load_manifest(str(manifest))
+
+
+def test_tenant_logs_in_with_its_named_credentials(monkeypatch):
+    monkeypatch.setenv("OBSERVE_USER_EMAIL_EU", "eu@example.com")
+    monkeypatch.setenv("OBSERVE_USER_PASSWORD_EU", "secret")
+    monkeypatch.setenv("OBSERVE_TOKEN_CACHE", "")
+    logins = []
+
+    class Response:
+        status_code = 200
+        content = b"{}"
+        text = '{"access_key": "key"}'
+
+        class elapsed:
+            @staticmethod
+            def total_seconds():
+                return 0.0
+
+    def post(client, path, data, headers):
+        logins.append((client.customer_id, json.loads(data)["user_email"], json.loads(data)["user_password"]))
+        return Response()
+
+    monkeypatch.setattr(query_observe.ObserveClient, "post", post)
+    deployment = query_observe.Deployment(name="eu", customer_id="333", domain="observeinc.com",
+                                          user_email_env="OBSERVE_USER_EMAIL_EU",
+                                          password_env="OBSERVE_USER_PASSWORD_EU")
+    assert deployment.token_manager().get() == "key"
+    assert logins == [("333", "eu@example.com", "secret")]
+    assert deployment.token_manager() is not query_observe.get_token_manager("333", "observeinc.com")
+
+
+def test_configured_session_is_shared_by_all_tenant_clients():
+    query_observe.configure_session(pool_size=24)
+    first = query_observe.get_client("444", "observeinc.com")
+    second = query_observe.get_client("555", "observeinc.com")
+    assert first.session is second.session
+    assert first.session.get_adapter("https://444.observeinc.com")._pool_maxsize == 24
@@ -0,0 +1,112 @@
+import function_report
+from function_report import FunctionLogReport
+
+SECOND_NS = 10 ** 9
+# 2024-05-28T12:00:00Z
+START_NS = 1716897600 * SECOND_NS
+
+
+def executed(secs: float, function: str, duration_ms: int, host: str = "host-1", status: str = "Succeeded") -> dict:
+    return {"event_time": str(START_NS + int(secs * SECOND_NS)), "host_instance": host,
+            "message": "Executed 'Functions.{}' ({}, Id=0b2c-{}, Duration={}ms)".format(
+                function, status, int(secs), duration_ms)}
+
+
+def host_started(secs: float, duration_ms: int, host: str = "host-1") -> dict:
+    return {"event_time": str(START_NS + int(secs * SECOND_NS)), "host_instance": host,
+            "message": "Host started ({}ms)".format(duration_ms)}
+
+
+def fold(*items) -> dict:
+    report = FunctionLogReport(600)
+    for item in items:
+        report.add(item)
+    return report.report()
+
+
+def functions(report: dict) -> dict:
+    return {function["function"]: function for function in report["functions"]}
+
+
+def test_first_invocation_per_function_after_host_start_is_cold():
+    report = fold(host_started(0, 1500),
+                  executed(5, "event_hub_trigger", 4000),
+                  executed(10, "event_hub_trigger", 200),
+                  executed(15, "timer_resources_func", 9000),
+                  executed(20, "timer_resources_func", 800))
+
+    assert report["cold_starts"] == 1
+    assert report["host_startup_secs"]["max"] == 1.5
+    trigger = functions(report)["event_hub_trigger"]
+    assert trigger["invocations"] == 2
+    assert trigger["cold_invocations"] == 1
+    assert trigger["cold_duration_secs"]["max"] == 4.0
+    assert trigger["warm_duration_secs"]["max"] == 0.2
+    assert functions(report)["timer_resources_func"]["cold_invocations"] == 1
+
+
+def test_invocations_on_hosts_started_before_the_window_are_warm():
+    report = fold(executed(5, "event_hub_trigger", 4000, host="host-0"),
+                  host_started(10, 1500, host="host-1"),
+                  executed(15, "event_hub_trigger", 3000, host="host-0"),
+                  executed(20, "event_hub_trigger", 5000, host="host-1"))
+
+    trigger = functions(report)["event_hub_trigger"]
+    assert trigger["invocations"] == 3
+    assert trigger["cold_invocations"] == 1
+    assert trigger["cold_duration_secs"]["max"] == 5.0
+
+
+def test_host_restart_makes_the_next_invocation_cold_again():
+    report = fold(host_started(0, 1000),
+                  executed(5, "event_hub_trigger", 4000),
+                  host_started(60, 2000),
+                  executed(65, "event_hub_trigger", 3000),
+                  executed(70, "event_hub_trigger", 100))
+
+    assert report["cold_starts"] == 2
+    assert functions(report)["event_hub_trigger"]["cold_invocations"] == 2
+
+
+def test_failures_batches_and_bins():
+    report = fold(executed(5, "event_hub_trigger", 100),
+                  executed(700, "event_hub_trigger", 300, status="Failed"),
+                  {"event_time": str(START_NS + 700 * SECOND_NS), "function": "Functions.event_hub_trigger",
+                   "message": "Trigger Details: PartitionId: 3, Offset: 100-200, EnqueueTimeUtc: 2024-05-28T12:11:39Z, "
+                              "SequenceNumber: 5-14, Count: 10"},
+                  {"event_time": "not a time", "message": "Host started (10ms)"},
+                  {"event_time": str(START_NS), "message": "Unrelated"})
+
+    trigger = functions(report)["event_hub_trigger"]
+    assert trigger["failed"] == 1
+    assert trigger["failure_rate"] == 0.5
+    assert trigger["batch_size"]["max"] == 10
+    assert [(bin_report["start"], bin_report["failed"]) for bin_report in trigger["bins"]] == [
+        ("2024-05-28T12:00:00Z", 0), ("2024-05-28T12:10:00Z", 1)]
+    assert report["skipped_rows"] == 2
+    assert report["cold_starts"] == 0
+
+
+def test_measure_functions_sorts_rows_by_time(monkeypatch):
+    class TokenManagerStub:
+        def get(self) -> str:
+            return "token"
+
+    rows = [executed(5, "event_hub_trigger", 4000), host_started(0, 1500), executed(10, "event_hub_trigger", 200)]
+    monkeypatch.setattr(function_report.query_observe, "get_token_manager", lambda: TokenManagerStub())
+    monkeypatch.setattr(function_report.query_observe, "query_dataset", lambda *args, **kwargs: (row for row in rows))
+
+    report = function_report.measure_functions("2024-05-28T12:00:00Z", "2024-05-28T13:00:00Z", 600).report()
+
+    assert functions(report)["event_hub_trigger"]["cold_invocations"] == 1
+    assert functions(report)["event_hub_trigger"]["cold_duration_secs"]["max"] == 4.0
+
+
+def test_markdown_reports_a_failed_query():
+    report = dict(errors={"functions": "RuntimeError('FunctionAppLogs query failed')"},
+                  **FunctionLogReport(600).report())
+
+    lines = function_report.markdown(report).splitlines()
+
+    assert lines[2] == ":x: Function log query failed: RuntimeError('FunctionAppLogs query failed')"
+    assert lines[-1] == "|---|---|---|---|---|---|---|---|---|---|---|"
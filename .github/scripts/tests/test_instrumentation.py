@@ -0,0 +1,40 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import Metrics, ThreadProfiler
+
+
+def _worker_only(count: int) -> int:
+    return sum(range(count))
+
+
+def _function_names(stats) -> set:
+    return {name for _, _, name in stats.stats}
+
+
+def test_thread_profiler_includes_worker_threads(tmp_path):
+    profiler = ThreadProfiler()
+    profiler.enable()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        assert list(executor.map(_worker_only, [10, 20, 30])) == [45, 190, 435]
+    thread = threading.Thread(target=_worker_only, args=(5,))
+    thread.start()
+    thread.join()
+    profiler.disable()
+
+    stats = profiler.stats()
+    assert "_worker_only" in _function_names(stats)
+    calls = [call_count for (_, _, name), (_, call_count, _, _, _) in stats.stats.items() if name == "_worker_only"]
+    assert sum(calls) == 4
+    path = tmp_path / "profile.out"
+    profiler.dump_stats(str(path))
+    assert path.stat().st_size > 0
+
+
+def test_timed_calls_are_summarized_per_phase():
+    recorder = Metrics()
+    for rows in (10, 20):
+        with recorder.timed("query", source="EventHub") as call:
+            call["rows"] = rows
+    entry, = recorder.summary()
+    assert (entry["phase"], entry["labels"], entry["calls"], entry["rows"]) == ("query", {"source": "EventHub"}, 2, 30)
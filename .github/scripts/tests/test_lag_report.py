@@ -0,0 +1,82 @@
+import pytest
+
+import lag_report
+from lag_report import SourceLag
+
+SECOND_NS = 10 ** 9
+# 2024-05-28T12:00:00Z
+START_NS = 1716897600 * SECOND_NS
+
+
+def lag_row(ingest_secs: float, lag_secs: float) -> dict:
+    ingest_ns = START_NS + int(ingest_secs * SECOND_NS)
+    return {"source": "EventHub", "event_time": str(ingest_ns - int(lag_secs * SECOND_NS)),
+            "BUNDLE_TIMESTAMP": str(ingest_ns)}
+
+
+def source_lag(lags: list, bin_secs: int = 300) -> SourceLag:
+    """@return: lag of one row per second with the given lags"""
+    lag = SourceLag("EventHub", bin_secs)
+    for index, lag_secs in enumerate(lags):
+        lag.add(lag_row(index, lag_secs))
+    return lag
+
+
+def test_lag_percentiles_and_bins_by_ingest_time():
+    lag = SourceLag("EventHub", 300)
+    for ingest_secs, lag_secs in ((10, 5), (20, 15), (299, 25), (300, 100), (900, 40)):
+        lag.add(lag_row(ingest_secs, lag_secs))
+
+    report = lag.report()
+
+    assert report["lag_secs"]["count"] == 5
+    assert report["lag_secs"]["max"] == 100
+    assert report["lag_secs"]["p50"] == pytest.approx(25, rel=0.01)
+    assert [(bin_report["start"], bin_report["count"], bin_report["max"]) for bin_report in report["bins"]] == [
+        ("2024-05-28T12:00:00Z", 3, 25), ("2024-05-28T12:05:00Z", 1, 100), ("2024-05-28T12:15:00Z", 1, 40)]
+
+
+def test_negative_lag_counts_as_none_and_bad_rows_are_skipped():
+    lag = SourceLag("VmMetrics", 60)
+    lag.add(lag_row(0, -30))
+    lag.add({"event_time": None, "BUNDLE_TIMESTAMP": str(START_NS)})
+    lag.add({"BUNDLE_TIMESTAMP": str(START_NS)})
+
+    report = lag.report()
+
+    assert report["lag_secs"]["max"] == 0
+    assert report["skipped_rows"] == 2
+
+
+def test_slo_violations_name_the_statistic_and_threshold():
+    report = source_lag([10] * 90 + [400] * 10).report()
+
+    assert lag_report.check_slo(report, {"p50": 60, "p95": 300, "max": 1800}) == [
+        "EventHub: p95 lag {:.1f}s > SLO 300.0s".format(report["lag_secs"]["p95"])]
+    assert report["lag_secs"]["p95"] == pytest.approx(400, rel=0.01)
+
+
+def test_lag_within_slo_passes():
+    report = source_lag([10] * 100).report()
+
+    assert lag_report.check_slo(report, {"p95": 300, "max": 1800}) == []
+
+
+def test_source_without_rows_violates_the_slo():
+    report = SourceLag("VmMetrics", 60).report()
+
+    assert lag_report.check_slo(report, {"p95": 300}) == ["VmMetrics: no rows in window"]
+
+
+def test_markdown_lists_violations_and_failed_sources():
+    report = source_lag([10] * 90 + [400] * 10).report()
+    violations = lag_report.check_slo(report, {"p95": 300})
+
+    text = lag_report.markdown([report], violations, {"VmMetrics": "RuntimeError('VmMetrics: Lag query failed')"})
+
+    lag = report["lag_secs"]
+    assert "| EventHub | 100 | {:.1f} | {:.1f} | {:.1f} | 400.0 |".format(lag["p50"], lag["p95"], lag["p99"]) in text
+    assert "| :x: VmMetrics | query failed | | | | |" in text
+    assert "- :x: EventHub: p95 lag" in text
+    assert "All sources within SLO" not in text
+    assert "All sources within SLO" in lag_report.markdown([source_lag([10]).report()], [])
@@ -0,0 +1,27 @@
+import random
+
+from load_generator import HttpSink, StubSink, make_event, run_load_test
+
+
+def test_make_event_batches_tagged_records():
+    event = make_event("run", 7, 3, 100, random.Random(1))
+    assert len(event["records"]) == 3
+    assert {record["properties"]["appName"] for record in event["records"]} == {"loadgen-run"}
+    assert all(len(record["properties"]["message"]) == 100 for record in event["records"])
+
+
+def test_delivered_rates_count_events_and_records_apart():
+    stub_sink = StubSink().start()
+    sink = HttpSink(stub_sink.url)
+    try:
+        results = run_load_test(sink, stub_sink, [20], 0.5, 0.2, [0, 1], records_per_event=5, message_bytes=50,
+                                run_id="run", seed=1)
+    finally:
+        sink.close()
+        stub_sink.stop()
+    step = results[0]
+    assert (step["events"], step["records"], step["delivered"]) == (10, 50, 50)
+    assert step["delivered_ratio"] == 1.0
+    assert step["delivered_event_rate"] == step["target_rate"] == 20
+    assert step["delivered_records_rate"] == 100
+    assert stub_sink.partitions == {"0": 5, "1": 5}
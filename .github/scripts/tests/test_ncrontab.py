@@ -0,0 +1,84 @@
+import datetime
+from datetime import timezone
+
+import pytest
+
+from ncrontab import Schedule
+
+
+def utc(*args) -> datetime.datetime:
+    return datetime.datetime(*args, tzinfo=timezone.utc)
+
+
+def test_every_five_minutes_at_second_thirty():
+    schedule = Schedule("30 */5 * * * *")
+    assert schedule.next_fire(utc(2024, 5, 28, 12, 0, 0)) == utc(2024, 5, 28, 12, 0, 30)
+    assert schedule.next_fire(utc(2024, 5, 28, 12, 0, 30)) == utc(2024, 5, 28, 12, 5, 30)
+    assert schedule.max_interval_secs() == 300
+
+
+def test_five_fields_fire_at_second_zero():
+    schedule = Schedule("0 * * * *")
+    assert schedule.next_fire(utc(2024, 5, 28, 12, 0, 0)) == utc(2024, 5, 28, 13, 0, 0)
+    assert schedule.max_interval_secs() == 3600
+
+
+def test_next_fire_rolls_over_day_month_and_year():
+    schedule = Schedule("0 0 0 1 1 *")
+    assert schedule.next_fire(utc(2024, 5, 28, 12, 0, 0)) == utc(2025, 1, 1)
+
+
+def test_next_fire_takes_naive_times_as_utc_and_converts_others():
+    schedule = Schedule("0 0 12 * * *")
+    assert schedule.next_fire(datetime.datetime(2024, 5, 28, 11, 0, 0)) == utc(2024, 5, 28, 12)
+    cest = timezone(datetime.timedelta(hours=2))
+    assert schedule.next_fire(datetime.datetime(2024, 5, 28, 14, 30, tzinfo=cest)) == utc(2024, 5, 29, 12)
+
+
+def test_day_of_month_and_day_of_week_must_both_match():
+    # The 13th that is a Friday
+    schedule = Schedule("0 0 0 13 * FRI")
+    assert schedule.next_fire(utc(2024, 1, 1)) == utc(2024, 9, 13)
+
+
+def test_sunday_is_zero_and_seven():
+    assert Schedule("0 0 0 * * 0").next_fire(utc(2024, 5, 28)) == utc(2024, 6, 2)
+    assert Schedule("0 0 0 * * 7").next_fire(utc(2024, 5, 28)) == utc(2024, 6, 2)
+
+
+def test_ranges_lists_steps_and_names():
+    schedule = Schedule("0 0,30 9-17/4 * JAN-MAR MON-FRI")
+    assert schedule.hours == [9, 13, 17]
+    assert schedule.minutes == [0, 30]
+    assert schedule.months == {1, 2, 3}
+    assert schedule.days_of_week == {1, 2, 3, 4, 5}
+    assert Schedule("5/20 * * * * *").seconds == [5, 25, 45]
+
+
+def test_matches():
+    schedule = Schedule("30 */5 * * * *")
+    assert schedule.matches(utc(2024, 5, 28, 12, 10, 30))
+    assert not schedule.matches(utc(2024, 5, 28, 12, 11, 30))
+
+
+def test_fires_lists_firings_in_window():
+    fires = list(Schedule("0 */15 * * * *").fires(utc(2024, 5, 28, 12), utc(2024, 5, 28, 13)))
+    assert fires == [utc(2024, 5, 28, 12, 15), utc(2024, 5, 28, 12, 30), utc(2024, 5, 28, 12, 45),
+                     utc(2024, 5, 28, 13)]
+
+
+def test_max_interval_of_weekday_schedule_spans_the_weekend():
+    # Friday 18:00 to Monday 06:00
+    assert Schedule("0 0 6,18 * * MON-FRI").max_interval_secs() == 60 * 3600
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "0 0 0 * * * *", "60 * * * * *", "0 0 24 * * *",
+                                        "0 0 0 0 * *", "0 */0 * * * *", "0 0 0 * FOO *", "0 5-1 * * * *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        Schedule(expression)
+
+
+def test_schedule_that_never_fires():
+    with pytest.raises(ValueError):
+        Schedule("0 0 0 30 2 *").next_fire(utc(2024, 1, 1))
@@ -0,0 +1,90 @@
+import gc
+import json
+
+import pytest
+import requests
+
+import query_observe
+from instrumentation import Metrics
+from query_observe import NdjsonRows
+
+
+class StreamedResponse:
+    def __init__(self, lines: list, status_code: int = 200):
+        self.lines = lines
+        self.status_code = status_code
+        self.closed = False
+        self.elapsed = type("Elapsed", (), {"total_seconds": lambda self: 0.0})()
+        self.text = ""
+
+    def iter_lines(self, chunk_size: int):
+        for line in self.lines:
+            if isinstance(line, Exception):
+                raise line
+            yield line
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(request=requests.Request(url="http://stub"), response=self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = Metrics()
+    monkeypatch.setattr(query_observe, "metrics", recorder)
+    return recorder
+
+
+def test_rows_are_decoded_and_the_response_closed_when_exhausted(recorder):
+    response = StreamedResponse([b'{"a": 1}', b"", b'{"a": 2}'])
+    call = recorder.start("query")
+    assert list(NdjsonRows(response, call)) == [{"a": 1}, {"a": 2}]
+    assert response.closed
+    assert (call["rows"], call["bytes"]) == (2, 19)
+    assert "duration_secs" in call
+
+
+def test_rows_dropped_before_reading_close_the_response(recorder):
+    response = StreamedResponse([b'{"a": 1}'])
+    call = recorder.start("query")
+    rows = NdjsonRows(response, call)
+    del rows
+    gc.collect()
+    assert response.closed
+    assert call["rows"] == 0 and "duration_secs" in call
+
+
+def test_close_is_idempotent_and_decode_errors_close(recorder):
+    response = StreamedResponse([b"not json"])
+    rows = NdjsonRows(response)
+    with pytest.raises(json.JSONDecodeError):
+        next(rows)
+    assert response.closed
+    rows.close()
+    assert list(rows) == []
+
+
+def test_failed_streamed_query_closes_its_response(recorder):
+    response = StreamedResponse([], status_code=500)
+
+    class Client:
+        customer_id = "1"
+
+        def post(self, path, **kwargs):
+            return response
+
+    assert query_observe.send_query("token", "{}", type="openapi", url_extension="/export/query", stream=True,
+                                    client=Client()) is None
+    assert response.closed
+
+
+def test_closed_rows_stop_without_reading_further(recorder):
+    response = StreamedResponse([b'{"a": 1}', b'{"a": 2}'])
+    rows = NdjsonRows(response)
+    assert next(rows) == {"a": 1}
+    rows.close()
+    assert response.closed
+    assert list(rows) == []
@@ -0,0 +1,108 @@
+import json
+import os
+import stat
+import threading
+
+import pytest
+
+import observe_auth
+from observe_auth import TokenManager
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(observe_auth.time, "time", clock.time)
+    return clock
+
+
+def counting_login():
+    tokens = []
+
+    def login():
+        tokens.append("token-{}".format(len(tokens) + 1))
+        return tokens[-1]
+    return login
+
+
+def test_token_is_reused_until_it_expires(clock):
+    manager = TokenManager(counting_login(), "customer", cache_path="", ttl_mins=1)
+    assert manager.get() == "token-1"
+    clock.now += 59
+    assert manager.get() == "token-1"
+    clock.now += 1
+    assert manager.get() == "token-2"
+    assert manager.stats() == {"cache_hits": 1, "disk_hits": 0, "logins": 2}
+
+
+def test_refresh_replaces_rejected_token_once(clock):
+    manager = TokenManager(counting_login(), "customer", cache_path="", ttl_mins=60)
+    rejected = manager.get()
+    assert manager.refresh(rejected) == "token-2"
+    # Another thread reporting the same rejected token gets the new one without a login
+    assert manager.refresh(rejected) == "token-2"
+    assert manager.stats()["logins"] == 2
+
+
+def test_concurrent_get_logs_in_once(clock):
+    manager = TokenManager(counting_login(), "customer", cache_path="", ttl_mins=60)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(manager.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tokens == ["token-1"] * 8
+    assert manager.stats()["logins"] == 1
+
+
+def test_disk_cache_is_shared_between_managers(clock, tmp_path):
+    cache_path = str(tmp_path / "observe" / "token.json")
+    first = TokenManager(counting_login(), "customer", cache_path=cache_path, ttl_mins=60)
+    assert first.get() == "token-1"
+    assert stat.S_IMODE(os.stat(cache_path).st_mode) == 0o600
+
+    second = TokenManager(counting_login(), "customer", cache_path=cache_path, ttl_mins=60)
+    assert second.get() == "token-1"
+    assert second.stats() == {"cache_hits": 0, "disk_hits": 1, "logins": 0}
+
+    other_account = TokenManager(counting_login(), "other", cache_path=cache_path, ttl_mins=60)
+    assert other_account.get() == "token-1"
+    assert other_account.stats()["logins"] == 1
+    with open(cache_path) as cache_file:
+        assert len(json.load(cache_file)) == 2
+
+
+def test_expired_disk_cache_entries_are_ignored_and_dropped(clock, tmp_path):
+    cache_path = str(tmp_path / "token.json")
+    TokenManager(counting_login(), "customer", cache_path=cache_path, ttl_mins=1).get()
+    clock.now += 120
+    manager = TokenManager(counting_login(), "other", cache_path=cache_path, ttl_mins=1)
+    manager.get()
+    assert TokenManager(counting_login(), "customer", cache_path=cache_path, ttl_mins=1)._read_disk_cache() is None
+    with open(cache_path) as cache_file:
+        assert list(json.load(cache_file)) == [manager.cache_key]
+
+
+def test_corrupt_disk_cache_logs_in(clock, tmp_path):
+    cache_path = tmp_path / "token.json"
+    cache_path.write_text("not json")
+    manager = TokenManager(counting_login(), "customer", cache_path=str(cache_path), ttl_mins=60)
+    assert manager.get() == "token-1"
+    assert manager.stats()["logins"] == 1
+
+
+def test_defaults_from_environment(monkeypatch):
+    monkeypatch.setenv("OBSERVE_TOKEN_CACHE", "")
+    monkeypatch.setenv("OBSERVE_TOKEN_TTL_MINS", "5")
+    manager = TokenManager(counting_login(), "customer")
+    assert manager.cache_path is None
+    assert manager.ttl_secs == 300
@@ -0,0 +1,121 @@
+import pytest
+import requests
+
+import observe_client
+from observe_client import ObserveClient, RateLimiter
+
+
+class Response:
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class SessionStub:
+    """Returns, or raises, the scripted outcomes in order"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(observe_client.time, "sleep", sleeps.append)
+    # Upper bound of the jitter, so the delays are deterministic
+    monkeypatch.setattr(observe_client.random, "uniform", lambda low, high: high)
+    return sleeps
+
+
+def client(session: SessionStub, **kwargs) -> ObserveClient:
+    return ObserveClient("123", "observeinc.com", base_url="http://stub", session=session, backoff_secs=1,
+                         backoff_max_secs=30, max_requests_per_sec=0, **kwargs)
+
+
+def test_throttled_and_server_errors_are_retried_with_exponential_backoff(sleeps):
+    failures = [Response(429), Response(500), Response(503)]
+    session = SessionStub(*failures, Response(200))
+    observe = client(session, max_retries=4)
+
+    response = observe.post("/v1/meta/export/query", json={}, stream=True)
+
+    assert response.status_code == 200
+    assert sleeps == [1, 2, 4]
+    assert observe.retries == 3
+    assert all(failure.closed for failure in failures)
+    assert all(url == "http://stub/v1/meta/export/query" for url, _ in session.calls)
+    assert session.calls[0][1]["timeout"] == observe.timeout
+
+
+def test_last_response_is_returned_when_retries_run_out(sleeps):
+    session = SessionStub(Response(502), Response(502), Response(502))
+    observe = client(session, max_retries=2)
+
+    response = observe.post("/v1/login")
+
+    assert response.status_code == 502
+    assert not response.closed
+    assert len(session.calls) == 3
+    assert sleeps == [1, 2]
+
+
+def test_client_errors_are_not_retried(sleeps):
+    session = SessionStub(Response(400), Response(200))
+
+    assert client(session, max_retries=4).post("/v1/login").status_code == 400
+    assert sleeps == []
+
+
+def test_connection_errors_are_retried_then_raised(sleeps):
+    session = SessionStub(requests.exceptions.ConnectionError("reset"), Response(200))
+    assert client(session, max_retries=1).post("/v1/login").status_code == 200
+    assert sleeps == [1]
+
+    session = SessionStub(*[requests.exceptions.ConnectTimeout("timed out")] * 3)
+    with pytest.raises(requests.exceptions.ConnectTimeout):
+        client(session, max_retries=2).post("/v1/login")
+    assert len(session.calls) == 3
+
+
+def test_retry_after_extends_the_backoff_up_to_its_cap(sleeps):
+    session = SessionStub(Response(429, {"Retry-After": "7"}), Response(429, {"Retry-After": "600"}),
+                          Response(503, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), Response(200))
+
+    client(session, max_retries=4).post("/v1/login")
+
+    assert sleeps == [7, 30, 4]
+
+
+def test_backoff_is_full_jitter_capped_at_backoff_max(monkeypatch):
+    bounds = []
+    monkeypatch.setattr(observe_client.random, "uniform", lambda low, high: bounds.append((low, high)) or low)
+    observe = client(SessionStub(), max_retries=10)
+
+    delays = [observe._backoff(attempt) for attempt in range(7)]
+
+    assert bounds == [(0, 1), (0, 2), (0, 4), (0, 8), (0, 16), (0, 30), (0, 30)]
+    assert delays == [0] * 7
+
+
+def test_rate_limiter_spaces_requests_after_the_burst(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(observe_client.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(observe_client.time, "sleep", lambda secs: now.__setitem__(0, now[0] + secs))
+    limiter = RateLimiter(rate=2, burst=2)
+
+    waits = [limiter.acquire() for _ in range(4)]
+
+    assert waits == [0, 0, 0.5, 0.5]
+    assert now[0] == 101.0
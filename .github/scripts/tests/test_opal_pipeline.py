@@ -0,0 +1,286 @@
+import random
+import re
+import threading
+
+import pytest
+
+import pipeline_config
+from opal_pipeline import Filter, MakeCol, PickCol, Pipeline, SetValidFrom, Statsby, StatsbyMerge, referenced_columns
+
+TOKEN = "ds1token"
+VERSION = "https://example.com/azure-collection-functions-0.11.3.zip"
+
+# Hand-written pipelines of the baseline pipeline_config.py, with earliest_ts: min() instead of first_not_null()
+BASELINE_PIPELINES = {
+    'EventHub':
+        "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id))| "
+        "filter _ob_datastream_token_id = '{}'|"
+        "filter (string(EXTRA.collection_version) = '{}')|"
+        "filter (string(EXTRA.source) = 'EventHub')| "
+        "make_col timestamp:parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS')| "
+        "make_col timestamp:if_null(timestamp,parse_isotime(string(FIELDS.time)))| "
+        "set_valid_from options(max_time_diff:30m), timestamp|"
+        "make_col FIELDS:parse_json(string(FIELDS))|"
+        "make_col source: string(EXTRA.source)|"
+        "make_col category:string(FIELDS.category)|"
+        "make_col appName:string(FIELDS.properties.appName)|"
+        "make_col message:string(FIELDS.properties.message)|"
+        "make_col time_string:string(FIELDS.time)|"
+        "pick_col timestamp, time_string, source, category, appName, message|"
+        "statsby msg_count: count_distinct(message), earliest_ts: min(timestamp), group_by(source)",
+    'ResourceManagement':
+        "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id))| "
+        "filter _ob_datastream_token_id = '{}'|"
+        "filter (string(EXTRA.collection_version) = '{}')|"
+        "filter (string(EXTRA.source) = 'ResourceManagement')|"
+        "make_col source: string(EXTRA.source)|"
+        "make_col type:string(FIELDS.type)|"
+        "statsby msg_count: count_distinct(type), earliest_ts: min(BUNDLE_TIMESTAMP), group_by(source)",
+    'VmMetrics':
+        "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id))| "
+        "filter _ob_datastream_token_id = '{}'|"
+        "filter (string(EXTRA.collection_version) = '{}')|"
+        "filter (string(EXTRA.source) = 'VmMetrics')| "
+        "make_col time_string: string(FIELDS.timeseries[0].data[0].timeStamp)|"
+        "make_col timestamp:parse_isotime(string(FIELDS.timeseries[0].data[0].timeStamp))| "
+        "make_col metric_name:string(FIELDS.name.value)|"
+        "make_col FIELDS:parse_json(string(FIELDS))|"
+        "make_col source: string(EXTRA.source)|"
+        "statsby msg_count: count_distinct(metric_name), earliest_ts: min(BUNDLE_TIMESTAMP), group_by(source)",
+}
+
+# Optimized pipelines sent to Observe. A change here changes the production validation queries
+GOLDEN_PIPELINES = {
+    'EventHub':
+        "filter (string(EXTRA.collection_version) = '{1}') | "
+        "filter (string(EXTRA.source) = 'EventHub') | "
+        "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id)) | "
+        "filter _ob_datastream_token_id = '{0}' | "
+        "make_col timestamp:parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS') | "
+        "make_col timestamp:if_null(timestamp,parse_isotime(string(FIELDS.time))) | "
+        "set_valid_from options(max_time_diff:30m), timestamp | "
+        "make_col FIELDS:parse_json(string(FIELDS)) | "
+        "make_col source:string(EXTRA.source) | "
+        "make_col message:string(FIELDS.properties.message) | "
+        "pick_col timestamp, source, message | "
+        "statsby msg_count: count_distinct(message), earliest_ts: min(timestamp), group_by(source)",
+    'ResourceManagement':
+        "filter (string(EXTRA.collection_version) = '{1}') | "
+        "filter (string(EXTRA.source) = 'ResourceManagement') | "
+        "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id)) | "
+        "filter _ob_datastream_token_id = '{0}' | "
+        "make_col source:string(EXTRA.source) | "
+        "make_col type:string(FIELDS.type) | "
+        "statsby msg_count: count_distinct(type), earliest_ts: min(BUNDLE_TIMESTAMP), group_by(source)",
+    'VmMetrics':
+        "filter (string(EXTRA.collection_version) = '{1}') | "
+        "filter (string(EXTRA.source) = 'VmMetrics') | "
+        "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id)) | "
+        "filter _ob_datastream_token_id = '{0}' | "
+        "make_col metric_name:string(FIELDS.name.value) | "
+        "make_col source:string(EXTRA.source) | "
+        "statsby msg_count: count_distinct(metric_name), earliest_ts: min(BUNDLE_TIMESTAMP), group_by(source)",
+}
+
+GOLDEN_FUSED_PIPELINE = (
+    "filter (string(EXTRA.collection_version) = '{1}') | "
+    "filter (string(EXTRA.source) = 'EventHub' or string(EXTRA.source) = 'ResourceManagement' "
+    "or string(EXTRA.source) = 'VmMetrics') | "
+    "make_col _ob_datastream_token_id:coalesce(DATASTREAM_TOKEN_ID, string(EXTRA.datastream_token_id)) | "
+    "filter _ob_datastream_token_id = '{0}' | "
+    "make_col source:string(EXTRA.source) | "
+    "make_col timestamp:parse_timestamp(string(FIELDS.time), 'MM/DD/YYYY HH24:MI:SS') | "
+    "make_col timestamp:if_null(timestamp,parse_isotime(string(FIELDS.time))) | "
+    "make_col msg_key:case(source = 'EventHub', string(FIELDS.properties.message), "
+    "source = 'ResourceManagement', string(FIELDS.type), source = 'VmMetrics', string(FIELDS.name.value)) | "
+    "make_col msg_ts:case(source = 'EventHub', timestamp, source = 'ResourceManagement', BUNDLE_TIMESTAMP, "
+    "source = 'VmMetrics', BUNDLE_TIMESTAMP) | "
+    "statsby msg_count: count_distinct(msg_key), earliest_ts: min(msg_ts), group_by(source)"
+)
+
+
+def stages_of(pipeline: str) -> list:
+    """@return: stages of a rendered pipeline, with the whitespace differences of hand-written pipelines removed"""
+    return [re.sub(r"^make_col (\w+):\s*", r"make_col \1:", stage.strip()) for stage in pipeline.split("|")]
+
+
+def source_pipeline(source: str) -> Pipeline:
+    return pipeline_config.collection_pipeline([source], TOKEN, VERSION).then(*pipeline_config.source_stages[source])
+
+
+@pytest.mark.parametrize("source", sorted(BASELINE_PIPELINES))
+def test_unoptimized_pipeline_matches_baseline(source):
+    expected = stages_of(BASELINE_PIPELINES[source].format(TOKEN, VERSION))
+    assert stages_of(source_pipeline(source).render(optimize=False)) == expected
+
+
+@pytest.mark.parametrize("source", sorted(GOLDEN_PIPELINES))
+def test_build_pipeline_golden(source):
+    assert pipeline_config.build_pipeline(source, TOKEN, VERSION) == GOLDEN_PIPELINES[source].format(TOKEN, VERSION)
+
+
+@pytest.mark.parametrize("source", sorted(BASELINE_PIPELINES))
+def test_optimized_pipeline_keeps_filters_and_aggregates_of_baseline(source):
+    baseline = stages_of(BASELINE_PIPELINES[source].format(TOKEN, VERSION))
+    optimized = stages_of(pipeline_config.build_pipeline(source, TOKEN, VERSION))
+    assert sorted(stage for stage in optimized if stage.startswith("filter")) == \
+        sorted(stage for stage in baseline if stage.startswith("filter"))
+    assert optimized[-1] == baseline[-1]
+    assert [stage for stage in optimized if stage.startswith("set_valid_from")] == \
+        [stage for stage in baseline if stage.startswith("set_valid_from")]
+    # Only make_col stages are dropped, in their original order
+    kept = [stage for stage in baseline if stage in optimized]
+    assert [stage for stage in optimized if stage.startswith("make_col")] == \
+        [stage for stage in kept if stage.startswith("make_col")]
+
+
+def test_fused_pipeline_golden():
+    sources = list(pipeline_config.fused_source_columns)
+    assert pipeline_config.fused_pipeline(sources, TOKEN, VERSION) == GOLDEN_FUSED_PIPELINE.format(TOKEN, VERSION)
+
+
+def test_approximate_partial_pipeline_is_the_full_pipeline():
+    for source in pipeline_config.source_stages:
+        assert pipeline_config.build_pipeline(source, TOKEN, VERSION, partial=True, exact_distinct=False) == \
+            pipeline_config.build_pipeline(source, TOKEN, VERSION)
+
+
+def test_referenced_columns_skips_literals_fields_and_functions():
+    assert referenced_columns("string(FIELDS.time) = 'a b' and x > 1") == {"FIELDS", "x"}
+    assert referenced_columns("if_null(timestamp, parse_isotime(\"true\"))") == {"timestamp"}
+    assert referenced_columns("not a in (true, null)") == {"a"}
+
+
+def test_push_filters_moves_filters_before_unrelated_make_col():
+    stages = Pipeline._push_filters([MakeCol("a", "x"), MakeCol("b", "y"), Filter("z = 1")])
+    assert [stage.render() for stage in stages] == ["filter z = 1", "make_col a:x", "make_col b:y"]
+
+
+def test_push_filters_stops_at_the_stage_producing_its_column():
+    stages = Pipeline._push_filters([MakeCol("a", "x"), MakeCol("b", "y"), Filter("a = 1")])
+    assert [stage.render() for stage in stages] == ["make_col a:x", "filter a = 1", "make_col b:y"]
+
+
+@pytest.mark.parametrize("barrier", [PickCol("z"), SetValidFrom("z"), Statsby({"n": "count()"}, ["z"])])
+def test_push_filters_does_not_cross_barriers(barrier):
+    stages = Pipeline._push_filters([MakeCol("a", "x"), barrier, Filter("z = 1")])
+    assert stages[-1].render() == "filter z = 1"
+
+
+def test_push_filters_keeps_filter_order():
+    stages = Pipeline._push_filters([MakeCol("a", "x"), Filter("y = 1"), Filter("z = 2")])
+    assert [stage.render() for stage in stages] == ["filter y = 1", "filter z = 2", "make_col a:x"]
+
+
+def test_prune_drops_unused_make_col_and_trims_pick_col():
+    stages = Pipeline._prune([MakeCol("a", "x"), MakeCol("b", "a"), MakeCol("c", "y"), PickCol("b", "c"),
+                              Statsby({"n": "count_distinct(b)"})])
+    assert [stage.render() for stage in stages] == \
+        ["make_col a:x", "make_col b:a", "pick_col b", "statsby n: count_distinct(b)"]
+
+
+def test_prune_keeps_everything_without_final_projection():
+    stages = [MakeCol("a", "x"), Filter("y = 1"), MakeCol("b", "z")]
+    assert Pipeline._prune(stages) == stages
+
+
+def test_prune_keeps_make_col_read_by_a_filter():
+    stages = Pipeline._prune([MakeCol("a", "x"), Filter("a = 1"), Statsby({"n": "count()"})])
+    assert [stage.render() for stage in stages] == ["make_col a:x", "filter a = 1", "statsby n: count()"]
+
+
+STATSBY = Statsby({"n": "count()", "total": "sum(v)", "low": "min(t)", "high": "max(t)", "keys": "count_distinct(k)"},
+                  group_by=["g"])
+
+
+def aggregate(rows: list) -> dict:
+    """@return: STATSBY over rows, per group"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row["g"], []).append(row)
+    return {g: {"g": g, "n": len(items), "total": sum(row["v"] for row in items),
+                "low": min(row["t"] for row in items), "high": max(row["t"] for row in items),
+                "keys": len({row["k"] for row in items})} for g, items in groups.items()}
+
+
+def partial_rows(rows: list, exact_distinct: bool) -> list:
+    """@return: rows of STATSBY.partial(exact_distinct) over rows, with numbers as strings like the export API"""
+    key = (lambda row: (row["g"], row["k"])) if exact_distinct else (lambda row: row["g"])
+    groups = {}
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+    result = []
+    for group, items in groups.items():
+        partial = {"g": items[0]["g"], "n": str(len(items)), "total": str(sum(row["v"] for row in items)),
+                   "low": str(min(row["t"] for row in items)), "high": str(max(row["t"] for row in items))}
+        if exact_distinct:
+            partial["_distinct_keys"] = items[0]["k"]
+        else:
+            partial["keys"] = str(len({row["k"] for row in items}))
+        result.append(partial)
+    return result
+
+
+def random_rows(count: int, seed: int = 1) -> list:
+    generator = random.Random(seed)
+    return [{"g": generator.choice("ab"), "v": generator.randint(0, 100), "t": index,
+             "k": "key-{}".format(generator.randint(0, 20))} for index in range(count)]
+
+
+def test_partial_stages():
+    stages = STATSBY.partial()
+    assert [stage.render() for stage in stages] == [
+        "make_col _distinct_keys:k",
+        "statsby n: count(), total: sum(v), low: min(t), high: max(t), group_by(g, _distinct_keys)",
+    ]
+    assert [stage.render() for stage in STATSBY.partial(exact_distinct=False)] == [
+        "statsby n: count(), total: sum(v), low: min(t), high: max(t), keys: count_distinct(k), group_by(g)",
+    ]
+
+
+def test_partial_rejects_aggregates_that_do_not_merge():
+    with pytest.raises(ValueError):
+        Statsby({"first": "first_not_null(t)"}).partial()
+    with pytest.raises(ValueError):
+        Pipeline([MakeCol("a", "x")]).partial()
+
+
+@pytest.mark.parametrize("slices", [1, 3, 7])
+def test_exact_merge_equals_single_query(slices):
+    rows = random_rows(200)
+    size = -(-len(rows) // slices)
+    partials = [row for index in range(0, len(rows), size) for row in partial_rows(rows[index:index + size], True)]
+    random.Random(slices).shuffle(partials)
+    merged = {row["g"]: row for row in STATSBY.merge(partials)}
+    assert merged == aggregate(rows)
+
+
+def test_approximate_merge_sums_distinct_counts_per_slice():
+    rows = random_rows(200)
+    slices = [rows[:100], rows[100:]]
+    merged = {row["g"]: row for row in STATSBY.merge(
+        [row for part in slices for row in partial_rows(part, False)], exact_distinct=False)}
+    expected = aggregate(rows)
+    for group, row in merged.items():
+        assert row["keys"] == sum(aggregate(part)[group]["keys"] for part in slices if group in aggregate(part))
+        assert row["keys"] >= expected[group]["keys"]
+        assert {name: value for name, value in row.items() if name != "keys"} == \
+            {name: value for name, value in expected[group].items() if name != "keys"}
+
+
+def test_merge_of_no_rows_is_empty():
+    assert STATSBY.merge([]) == []
+
+
+def test_statsby_merge_from_threads():
+    rows = random_rows(2000)
+    partials = [row for index in range(0, len(rows), 100) for row in partial_rows(rows[index:index + 100], True)]
+    merged = StatsbyMerge(STATSBY)
+    threads = [threading.Thread(target=lambda part: [merged.add(row) for row in part], args=(partials[index::4],))
+               for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert merged.added == len(partials)
+    assert {row["g"]: row for row in merged.rows()} == aggregate(rows)
@@ -0,0 +1,72 @@
+"""End-to-end runs of query_observe.py --wait against the stub Observe API"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+from datetime import timezone
+
+import pytest
+
+from stub_observe import StubObserve
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "query_observe.py")
+
+
+def run_wait(base_url: str, workdir, *args) -> tuple:
+    """@return: (exit code, metrics report, output) of query_observe.py --wait run in workdir"""
+    env = dict(os.environ)
+    env.update({
+        "OBSERVE_BASE_URL": base_url,
+        "OBSERVE_CUSTOMER": "123456789",
+        "OBSERVE_DOMAIN": "stub.local",
+        "OBSERVE_USER_EMAIL": "test@stub.local",
+        "OBSERVE_USER_PASSWORD": "test",
+        "OBSERVE_TOKEN_CACHE": "",
+        "OBSERVE_BACKOFF_SECS": "0.01",
+        "AZURE_DATASET_ID": "41000000",
+        "OBSERVE_TOKEN_ID": "ds1test",
+        "AZURE_COLLECTION_FUNCTION": "test",
+        "CURRENT_TIME_ISO": (datetime.datetime.now(timezone.utc) - datetime.timedelta(minutes=5)).strftime(
+            '%Y-%m-%dT%H:%M:%S.000Z'),
+    })
+    env.pop("GITHUB_STEP_SUMMARY", None)
+    completed = subprocess.run([sys.executable, SCRIPT, "--wait", "--poll-schedule-secs", "0.5",
+                                "--metrics-json", "metrics.json"] + list(args),
+                               cwd=str(workdir), env=env, capture_output=True, text=True, timeout=120)
+    with open(os.path.join(str(workdir), "metrics.json")) as metrics_file:
+        report = json.load(metrics_file)
+    return completed.returncode, report, completed.stdout + completed.stderr
+
+
+@pytest.mark.parametrize("args", [[], ["--sequential"], ["--fused"], ["--fused", "--slices", "3"]])
+def test_wait_passes_once_data_arrives(tmp_path, args):
+    with StubObserve(rows=30, data_delay_secs=1.5) as stub:
+        code, report, output = run_wait(stub.url, tmp_path, "--deadline-mins", "1", *args)
+    assert code == 0, output
+    assert report["counters"]["poll_attempts"] >= 2
+    assert all("time_to_data_secs_{}".format(source) in report["counters"]
+               for source in ("EventHub", "ResourceManagement", "VmMetrics"))
+    assert stub.counters["login"] == 1
+    for source in ("EventHub", "ResourceManagement", "VmMetrics"):
+        with open(str(tmp_path / "{}.json".format(source))) as json_file:
+            assert isinstance(json.load(json_file), list)
+
+
+def test_wait_keeps_polling_through_server_errors(tmp_path):
+    with StubObserve(rows=30, error_rate=0.6, seed=7) as stub:
+        code, report, output = run_wait(stub.url, tmp_path, "--deadline-mins", "1", "--sequential")
+    assert code == 0, output
+    assert stub.counters["errors"] > 0
+
+
+def test_wait_keeps_polling_while_observe_is_unreachable(tmp_path):
+    # A port that was listened on and closed again refuses connections
+    stub = StubObserve()
+    base_url = stub.url
+    stub.server.server_close()
+    code, report, output = run_wait(base_url, tmp_path, "--deadline-mins", "0.05", "--sequential")
+    assert code == 1
+    assert "Login raised" in output
+    assert "Deadline of 0.05 mins reached" in output
+    assert report["counters"]["poll_attempts"] >= 2
@@ -0,0 +1,51 @@
+import argparse
+
+import report_common
+from validation_state import format_iso, parse_iso
+
+
+def parse(*args) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    report_common.add_window_arguments(parser)
+    return parser.parse_args(list(args))
+
+
+def test_window_ends_now_by_default():
+    start_time, end_time = report_common.report_window(parse("--window-mins", "90"))
+
+    assert (parse_iso(end_time) - parse_iso(start_time)).total_seconds() == 90 * 60
+    assert end_time.endswith("Z") and "." not in end_time
+
+
+def test_explicit_window_is_kept():
+    args = parse("--start", "2024-05-28T12:00:00Z", "--end", "2024-05-28T13:00:00Z")
+
+    assert report_common.report_window(args) == ("2024-05-28T12:00:00Z", "2024-05-28T13:00:00Z")
+
+
+def test_format_iso_round_trips_parse_iso():
+    assert format_iso(1716897600) == "2024-05-28T12:00:00Z"
+    assert parse_iso(format_iso(1716897600.9)).timestamp() == 1716897600
+
+
+def test_failed_query_is_recorded_and_returns_the_default():
+    errors = {}
+
+    def fail():
+        raise RuntimeError("query failed")
+
+    assert report_common.run_query(errors, "EventHub", "EventHub: Lag measurement", fail, default=[]) == []
+    assert report_common.run_query(errors, "VmMetrics", "VmMetrics: Lag measurement", lambda: 5) == 5
+    assert errors == {"EventHub": "RuntimeError('query failed')"}
+
+
+def test_step_summary_is_appended_only_when_set(monkeypatch, tmp_path):
+    monkeypatch.delenv("GITHUB_STEP_SUMMARY", raising=False)
+    report_common.append_step_summary("ignored\n")
+
+    summary = tmp_path / "summary.md"
+    summary.write_text("## Validation\n")
+    monkeypatch.setenv("GITHUB_STEP_SUMMARY", str(summary))
+    report_common.append_step_summary("## Ingestion Lag\n")
+
+    assert summary.read_text() == "## Validation\n## Ingestion Lag\n"
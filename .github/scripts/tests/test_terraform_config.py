@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from terraform_config import Expression, TerraformConfig, parse_blocks, parse_body, parse_value
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..")
+
+MODULE = '''
+# Sizing of the Event Hub
+variable "eventhub_sku" {
+  type    = string
+  default = "Standard" // trailing comment
+}
+
+variable "partition_count" {
+  default = 4
+}
+
+variable "auto_inflate" {
+  default = false
+}
+
+variable "location_abbreviation" {
+  default = {
+    "eastus"     = "eu",
+    "westeurope" = "we",
+  }
+}
+
+/* block
+   comment */
+resource "azurerm_eventhub_namespace" "namespace" {
+  name     = "ns-${var.location}"
+  sku      = var.eventhub_sku
+  capacity = var.auto_inflate ? var.partition_count : null
+  tags = {
+    owner = "ci # not a comment"
+  }
+}
+
+resource "azurerm_eventhub" "hub" {
+  name              = "hub"
+  partition_count   = var.partition_count
+  message_retention = 7
+  enabled           = true
+  ratio             = 0.5
+  zones             = ["1", "2"]
+  capture_description {
+    enabled = false
+  }
+}
+'''
+
+
+@pytest.fixture
+def config():
+    return TerraformConfig(parse_blocks(MODULE))
+
+
+def test_parse_value_literals():
+    assert parse_value('"text"') == "text"
+    assert parse_value('"say \\"hi\\""') == 'say "hi"'
+    assert parse_value("42") == 42
+    assert parse_value("-1.5") == -1.5
+    assert parse_value("true") is True
+    assert parse_value("null") is None
+    assert parse_value('["a", "b"]') == ["a", "b"]
+    assert parse_value('{ a = 1, "b" = "x" }') == {"a": 1, "b": "x"}
+
+
+def test_parse_value_expressions():
+    for raw in ('"ns-${var.location}"', "var.location", "lower(var.name)", "[var.a]"):
+        value = parse_value(raw)
+        assert isinstance(value, Expression)
+        assert value == raw
+
+
+def test_blocks_attributes_and_nested_blocks(config):
+    hub = config.resource("azurerm_eventhub", "hub")
+    assert hub.attributes["message_retention"] == 7
+    assert hub.attributes["enabled"] is True
+    assert hub.attributes["ratio"] == 0.5
+    assert hub.attributes["zones"] == ["1", "2"]
+    assert [(block.kind, block.attributes) for block in hub.blocks] == [("capture_description", {"enabled": False})]
+    assert [block.labels for block in config.resources()] == [["azurerm_eventhub_namespace", "namespace"],
+                                                              ["azurerm_eventhub", "hub"]]
+
+
+def test_comments_are_stripped_outside_strings(config):
+    assert config.variable("eventhub_sku") == "Standard"
+    assert config.resource("azurerm_eventhub_namespace").attributes["tags"] == {"owner": "ci # not a comment"}
+
+
+def test_variable_references_and_conditionals_resolve(config):
+    assert config.attribute("azurerm_eventhub", "hub", "partition_count") == 4
+    assert config.attribute("azurerm_eventhub_namespace", "namespace", "sku") == "Standard"
+    assert config.attribute("azurerm_eventhub_namespace", "namespace", "name") == '"ns-${var.location}"'
+    assert config.attribute("azurerm_eventhub_namespace", "namespace", "capacity") is None
+    assert config.variable("location_abbreviation") == {"eastus": "eu", "westeurope": "we"}
+
+
+def test_tfvars_take_precedence(config):
+    config.tfvars = parse_body('auto_inflate = true\npartition_count = 32\n').attributes
+    assert config.attribute("azurerm_eventhub", "hub", "partition_count") == 32
+    assert config.attribute("azurerm_eventhub_namespace", "namespace", "capacity") == 32
+
+
+def test_missing_resources_and_variables(config):
+    with pytest.raises(KeyError):
+        config.resource("azurerm_key_vault")
+    with pytest.raises(KeyError):
+        config.variable("nope")
+    assert config.attribute("azurerm_eventhub", "hub", "missing", default=3) == 3
+
+
+def test_load_repository_module(tmp_path):
+    var_file = tmp_path / "sizing.tfvars"
+    var_file.write_text('eventhub_partition_count = 8\n')
+    config = TerraformConfig.load(REPO_ROOT, [str(var_file)])
+    assert config.resource("azurerm_eventhub", "observe_eventhub")
+    assert config.attribute("azurerm_eventhub", "observe_eventhub", "partition_count") == 8
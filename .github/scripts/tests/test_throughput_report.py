@@ -0,0 +1,63 @@
+import pytest
+
+from throughput_report import Breakdown, analyze_skew
+
+ROWS = [
+    {"minute": "2024-05-28 12:00", "category": "FunctionAppLogs", "appName": "app-0",
+     "resource": "/SUBSCRIPTIONS/S/RES-0", "events": "3000", "bytes": "300000"},
+    {"minute": "2024-05-28 12:01", "category": "FunctionAppLogs", "appName": "app-0",
+     "resource": "/subscriptions/s/res-0", "events": "6000", "bytes": "600000"},
+    {"minute": "2024-05-28 12:01", "category": "AuditEvent", "appName": None,
+     "resource": "/subscriptions/s/res-1", "events": "1000", "bytes": "50000"},
+    {"minute": "not a minute", "events": "5"},
+]
+
+
+@pytest.fixture
+def breakdown():
+    breakdown = Breakdown(120, 600, records_per_event=10)
+    for row in ROWS:
+        breakdown.add(row)
+    return breakdown
+
+
+def test_breakdown_counts_records_and_reports_event_rates(breakdown):
+    report = breakdown.report(top_k=1)
+    assert (report["records"], report["bytes"], report["skipped_rows"]) == (10000, 950000, 1)
+    # 10000 records of 10 per event over the 600s window, all in one 120s bin
+    assert report["mean_eps"] == pytest.approx(10000 / 10 / 600)
+    assert report["peak_eps"] == pytest.approx(10000 / 10 / 120)
+    assert report["bins"] == [{"start": "2024-05-28T12:00:00Z", "records": 10000,
+                               "eps": pytest.approx(10000 / 10 / 120)}]
+    assert report["distinct"] == {"category": 2, "appName": 2, "resource": 2}
+
+
+def test_top_keys_merge_resource_case_and_missing_values(breakdown):
+    resource, = breakdown.top("resource", 1)
+    assert resource["key"] == "/subscriptions/s/res-0"
+    assert (resource["records"], resource["share"], resource["bytes_per_record"]) == (9000, 0.9, 100.0)
+    assert [top["key"] for top in breakdown.top("appName", 2)] == ["app-0", "(none)"]
+
+
+def test_volume_findings_compare_events_with_event_limits(breakdown):
+    # 8.3 events/s at the peak, from 83 records/s, fit one throughput unit and 4 consumers of 5 events/s
+    analysis = analyze_skew(breakdown, {}, 4, 1, 5)
+    assert analysis["ingress_eps_limit"] == 1000
+    assert analysis["even_partition_peak_eps"] == pytest.approx(breakdown.peak_eps() / 4)
+    assert not any(finding.startswith("Volume") for finding in analysis["findings"])
+    assert "No Event Hub trigger details in the FunctionAppLogs, the partition spread is assumed even" \
+           in analysis["findings"]
+    assert any(finding.startswith("Heavy hitter: category FunctionAppLogs sends 90%")
+               for finding in analysis["findings"])
+
+    analysis = analyze_skew(breakdown, {}, 4, 1, 2)
+    assert any(finding.startswith("Volume: even spread over 4 partitions") for finding in analysis["findings"])
+
+
+def test_partition_skew_from_trigger_details(breakdown):
+    # The busiest partition gets 70% of the 8.3 events/s peak, an even share would be 2.1 events/s
+    analysis = analyze_skew(breakdown, {0: 700, 1: 100, 2: 100, 3: 100}, 4, 1, 4)
+    assert analysis["busiest_partition_ratio"] == pytest.approx(2.8)
+    assert analysis["partitions_active"] == 4
+    skew, = [finding for finding in analysis["findings"] if finding.startswith("Partition skew")]
+    assert "falls behind at the peak although the total rate fits the partitions" in skew
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+import pipeline_config
+import query_observe
+
+SOURCES = ["EventHub", "ResourceManagement", "VmMetrics"]
+START_TIME_ISO = "2024-05-28T12:00:00.000Z"
+START_NS = 1716897600 * 10 ** 9
+MINUTE_NS = 60 * 10 ** 9
+
+
+class TokenManagerStub:
+    def get(self) -> str:
+        return "token"
+
+
+class Rows:
+    """Streamed query response recording how many rows were read and whether it was closed"""
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for row in self.rows:
+            self.read += 1
+            yield row
+
+    def close(self):
+        self.closed = True
+
+
+def row(source: str, msg_count: int = 5, earliest_mins: int = 1) -> dict:
+    return {"source": source, "msg_count": str(msg_count), "earliest_ts": str(START_NS + earliest_mins * MINUTE_NS)}
+
+
+def respond(monkeypatch, rows: list) -> tuple:
+    """@return: (response returned by every query_dataset call, arguments of the calls)"""
+    response = Rows(rows)
+    queries = []
+    monkeypatch.setattr(query_observe, "query_dataset", lambda **kwargs: queries.append(kwargs) or response)
+    return response, queries
+
+
+@pytest.fixture(autouse=True)
+def workdir(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def validate() -> dict:
+    return query_observe.validate_fused(SOURCES, 30, TokenManagerStub(), None,
+                                        query_observe.Deployment(start_time_iso=START_TIME_ISO, token_id="ds1",
+                                                                 collection_version="v1"))
+
+
+def test_one_query_validates_every_source(monkeypatch, workdir):
+    _, queries = respond(monkeypatch, [row("VmMetrics", earliest_mins=45), row("EventHub"),
+                                       row("ResourceManagement", msg_count=0)])
+
+    assert validate() == {"EventHub": True, "ResourceManagement": False, "VmMetrics": False}
+    assert len(queries) == 1
+    assert queries[0]["pipeline"] == pipeline_config.fused_pipeline(SOURCES, "ds1", "v1", exact_distinct=False)
+    assert queries[0]["startTime"] == START_TIME_ISO
+    for source in SOURCES:
+        with open(str(workdir / "{}.json".format(source))) as json_file:
+            assert [item["source"] for item in json.load(json_file)] == [source]
+
+
+def test_response_is_only_read_until_every_source_has_a_row(monkeypatch):
+    response, _ = respond(monkeypatch, [row("EventHub"), row("Unknown"), row("EventHub", earliest_mins=45),
+                                        row("VmMetrics"), row("ResourceManagement"), row("VmMetrics")])
+
+    assert validate() == {source: True for source in SOURCES}
+    assert response.read == 5
+    assert response.closed
+
+
+def test_sources_without_rows_fail(monkeypatch):
+    response, _ = respond(monkeypatch, [row("EventHub")])
+
+    assert validate() == {"EventHub": True, "ResourceManagement": False, "VmMetrics": False}
+    assert response.closed
+
+
+def test_failed_query_fails_every_source(monkeypatch):
+    monkeypatch.setattr(query_observe, "query_dataset", lambda **kwargs: None)
+
+    assert validate() == {source: False for source in SOURCES}
+
+
+def test_fused_pipeline_scans_once_and_groups_by_source():
+    pipeline = pipeline_config.fused_pipeline(["EventHub", "VmMetrics"])
+
+    assert pipeline.count("statsby") == 1
+    assert "group_by(source)" in pipeline
+    assert "case(source = 'EventHub', string(FIELDS.properties.message), " \
+           "source = 'VmMetrics', string(FIELDS.name.value))" in pipeline
+    assert "filter (string(EXTRA.source) = 'EventHub' or string(EXTRA.source) = 'VmMetrics')" in pipeline
+    assert "ResourceManagement" not in pipeline
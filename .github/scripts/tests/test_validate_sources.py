@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+import query_observe
+
+SOURCES = ["EventHub", "ResourceManagement", "VmMetrics"]
+
+
+class CountingTokenManager:
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.logins = 0
+
+    def get(self) -> str:
+        self.logins += 1
+        if self.error is not None:
+            raise self.error
+        return "token"
+
+
+@pytest.fixture
+def token_manager(monkeypatch):
+    manager = CountingTokenManager()
+    monkeypatch.setattr(query_observe.Deployment, "token_manager", lambda deployment: manager)
+    return manager
+
+
+def test_sources_are_validated_in_parallel_with_the_shared_login(monkeypatch, token_manager):
+    # Every check waits for the others, so this only passes if all of them run at the same time
+    barrier = threading.Barrier(len(SOURCES), timeout=5)
+    calls = {}
+
+    def validate_azure_data(source, stale_checks_mins, manager, state, deployment, slices):
+        calls[source] = (manager, threading.current_thread().name)
+        barrier.wait()
+        return source != "VmMetrics"
+
+    monkeypatch.setattr(query_observe, "validate_azure_data", validate_azure_data)
+
+    results = query_observe.validate_sources(SOURCES, 30, deployment=query_observe.Deployment())
+
+    assert results == {"EventHub": True, "ResourceManagement": True, "VmMetrics": False}
+    assert token_manager.logins == 1
+    assert all(manager is token_manager for manager, _ in calls.values())
+    assert all(thread.startswith("validate") for _, thread in calls.values())
+    assert len({thread for _, thread in calls.values()}) == len(SOURCES)
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_a_raising_source_only_fails_itself(monkeypatch, token_manager, concurrent):
+    def validate_azure_data(source, *args):
+        if source == "ResourceManagement":
+            raise ConnectionError("reset")
+        return True
+
+    monkeypatch.setattr(query_observe, "validate_azure_data", validate_azure_data)
+
+    results = query_observe.validate_sources(SOURCES, 30, concurrent=concurrent,
+                                             deployment=query_observe.Deployment())
+
+    assert results == {"EventHub": True, "ResourceManagement": False, "VmMetrics": True}
+
+
+def test_sequential_validation_runs_in_source_order(monkeypatch, token_manager):
+    order = []
+    monkeypatch.setattr(query_observe, "validate_azure_data",
+                        lambda source, *args: order.append((source, threading.current_thread().name)) or True)
+
+    query_observe.validate_sources(SOURCES, 30, concurrent=False, deployment=query_observe.Deployment())
+
+    assert order == [(source, threading.current_thread().name) for source in SOURCES]
+    assert token_manager.logins == 1
+
+
+def test_failed_login_fails_every_source_without_querying(monkeypatch):
+    manager = CountingTokenManager(ConnectionError("login refused"))
+    monkeypatch.setattr(query_observe.Deployment, "token_manager", lambda deployment: manager)
+    monkeypatch.setattr(query_observe, "validate_azure_data",
+                        lambda *args: pytest.fail("validated without a login"))
+
+    results = query_observe.validate_sources(SOURCES, 30, deployment=query_observe.Deployment())
+
+    assert results == {source: False for source in SOURCES}
+    assert manager.logins == 1
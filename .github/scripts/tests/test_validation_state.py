@@ -0,0 +1,71 @@
+import json
+
+from validation_state import ValidationState, parse_iso
+
+START = "2024-05-28T12:00:00.000Z"
+
+
+def test_parse_iso_with_and_without_fraction():
+    assert parse_iso(START) == parse_iso("2024-05-28T12:00:00Z")
+    assert parse_iso("2024-05-28T12:00:00Z").tzinfo is not None
+
+
+def test_first_window_starts_at_the_run_start():
+    state = ValidationState(None, "run")
+    assert state.window_start("EventHub", START) == START
+
+
+def test_window_starts_overlap_before_the_watermark():
+    state = ValidationState(None, "run", overlap_secs=120)
+    state.advance("EventHub", "2024-05-28T12:10:00Z")
+    assert state.window_start("EventHub", START) == "2024-05-28T12:08:00Z"
+    # The overlap never reaches back before the run start
+    state.advance("EventHub", "2024-05-28T12:01:00Z")
+    assert state.window_start("EventHub", START) == START
+    assert state.window_start("VmMetrics", START) == START
+
+
+def test_merge_sums_counts_and_keeps_the_earliest_timestamp():
+    state = ValidationState(None, "run")
+    assert state.aggregate("EventHub") is None
+    state.merge("EventHub", {"msg_count": "3", "earliest_ts": "2000"})
+    state.merge("EventHub", {"msg_count": 2, "earliest_ts": 1000})
+    state.merge("EventHub", {"msg_count": 1, "earliest_ts": None})
+    assert state.aggregate("EventHub") == {"source": "EventHub", "msg_count": 6, "earliest_ts": 1000}
+
+
+def test_source_without_rows_has_no_aggregate():
+    state = ValidationState(None, "run")
+    state.advance("VmMetrics", "2024-05-28T12:10:00Z")
+    assert state.aggregate("VmMetrics") is None
+
+
+def test_state_survives_restarts_of_the_same_run(tmp_path):
+    path = str(tmp_path / "validation_state.json")
+    state = ValidationState(path, "run")
+    state.merge("EventHub", {"msg_count": 3, "earliest_ts": 1000})
+    state.advance("EventHub", "2024-05-28T12:10:00Z")
+
+    restored = ValidationState(path, "run", overlap_secs=0)
+    assert restored.aggregate("EventHub") == {"source": "EventHub", "msg_count": 3, "earliest_ts": 1000}
+    assert restored.window_start("EventHub", START) == "2024-05-28T12:10:00Z"
+
+
+def test_state_of_another_run_is_discarded(tmp_path):
+    path = str(tmp_path / "validation_state.json")
+    state = ValidationState(path, "run")
+    state.merge("EventHub", {"msg_count": 3, "earliest_ts": 1000})
+    state.advance("EventHub", "2024-05-28T12:10:00Z")
+
+    other = ValidationState(path, "other run")
+    assert other.aggregate("EventHub") is None
+    assert other.window_start("EventHub", START) == START
+    other.save()
+    with open(path) as state_file:
+        assert json.load(state_file) == {"run_key": "other run", "sources": {}}
+
+
+def test_corrupt_state_file_is_ignored(tmp_path):
+    path = tmp_path / "validation_state.json"
+    path.write_text("{")
+    assert ValidationState(str(path), "run").sources == {}
@@ -0,0 +1,304 @@
+"""
+Breakdown of the EventHub traffic by category, appName and emitting resource, to tell partition or
+consumer skew apart from total volume as the cause of ingestion lag.
+
+Counts records and bytes per key and minute in Observe (pipeline_config.build_breakdown_pipeline), rebinned
+to --bin-mins, and reports per dimension the top-K heavy hitters with their share, mean and peak events/sec.
+Observe stores a row per diagnostic record, rates are converted to Event Hub events with --records-per-event.
+The events each partition delivered to the Event Hub trigger are read from the "Trigger Details" messages of
+the FunctionAppLogs (function_app_debug_logs). Together with the partition count and throughput units of the
+Terraform files, the skew analysis compares the busiest partition with an even spread and with the rate one
+consumer drains from a partition.
+
+Uses the same environment variables as query_observe.py:
+
+    python throughput_report.py --window-mins 60 --bin-mins 5 --top-k 10 --output throughput_report.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+from contextlib import closing
+from datetime import timezone
+
+import pipeline_config # type: ignore
+import query_observe # type: ignore
+from capacity_planner import RECORDS_PER_EVENT, TU_INGRESS_EVENTS_PER_SEC, current_sizing # type: ignore
+from function_report import TRIGGER_DETAILS # type: ignore
+from report_common import add_window_arguments, append_step_summary, report_window, run_query # type: ignore
+from terraform_config import TerraformConfig # type: ignore
+from validation_state import format_iso, parse_iso # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ("category", "appName", "resource")
+# Busiest partition over the mean of all partitions above which the partitions count as skewed
+PARTITION_SKEW_RATIO = 2.0
+# Share of all records above which a single key is reported as dominating the traffic
+DOMINANT_SHARE = 0.5
+
+
+class Breakdown:
+    """
+    Records and bytes per dimension key, in total and per time bin. Observe stores a row per diagnostic record,
+    the rates are in Event Hub events of records_per_event records.
+    """
+
+    def __init__(self, bin_secs: int, window_secs: float, records_per_event: float = RECORDS_PER_EVENT):
+        """
+        @param bin_secs: width of the time bins, a multiple of 60
+        @param window_secs: length of the queried window, for the mean rates
+        @param records_per_event: records per Event Hub event, converts record counts to events/sec
+        """
+        self.bin_secs = bin_secs
+        self.window_secs = max(window_secs, 1)
+        self.records_per_event = records_per_event
+        self.records = 0
+        self.bytes = 0
+        self.bins = {}
+        self.keys = {dimension: {} for dimension in DIMENSIONS}
+        self.skipped_rows = 0
+
+    def add(self, item: dict):
+        """@param item: row of pipeline_config.build_breakdown_pipeline()"""
+        try:
+            minute = datetime.datetime.strptime(item["minute"], '%Y-%m-%d %H:%M').replace(tzinfo=timezone.utc)
+            records = int(item["events"])
+            record_bytes = int(item.get("bytes") or 0)
+        except (KeyError, TypeError, ValueError):
+            self.skipped_rows += 1
+            return
+        epoch = int(minute.timestamp())
+        bin_start = epoch - epoch % self.bin_secs
+        self.records += records
+        self.bytes += record_bytes
+        self.bins[bin_start] = self.bins.get(bin_start, 0) + records
+        for dimension in DIMENSIONS:
+            # Azure is not consistent about the case of resource ids
+            key = item.get(dimension) or "(none)"
+            if dimension == "resource":
+                key = key.lower()
+            stats = self.keys[dimension].setdefault(key, {"records": 0, "bytes": 0, "bins": {}})
+            stats["records"] += records
+            stats["bytes"] += record_bytes
+            stats["bins"][bin_start] = stats["bins"].get(bin_start, 0) + records
+
+    def eps(self, records: int, secs: float) -> float:
+        """@return: Event Hub events/sec of the records received over secs"""
+        return records / self.records_per_event / secs
+
+    def peak_eps(self) -> float:
+        return self.eps(max(self.bins.values(), default=0), self.bin_secs)
+
+    def top(self, dimension: str, top_k: int) -> list:
+        """@return: the top_k keys of the dimension by records, with share, mean and peak events/sec and bytes"""
+        ranked = sorted(self.keys[dimension].items(), key=lambda entry: entry[1]["records"], reverse=True)
+        return [{
+            "key": key,
+            "records": stats["records"],
+            "share": stats["records"] / self.records if self.records else 0.0,
+            "mean_eps": self.eps(stats["records"], self.window_secs),
+            "peak_eps": self.eps(max(stats["bins"].values()), self.bin_secs),
+            "bytes": stats["bytes"],
+            "bytes_per_record": stats["bytes"] / stats["records"] if stats["records"] else 0.0,
+        } for key, stats in ranked[:top_k]]
+
+    def report(self, top_k: int) -> dict:
+        return {
+            "records": self.records,
+            "records_per_event": self.records_per_event,
+            "bytes": self.bytes,
+            "mean_eps": self.eps(self.records, self.window_secs),
+            "peak_eps": self.peak_eps(),
+            "distinct": {dimension: len(keys) for dimension, keys in self.keys.items()},
+            "top": {dimension: self.top(dimension, top_k) for dimension in DIMENSIONS},
+            "bins": [{"start": format_iso(bin_start), "records": records, "eps": self.eps(records, self.bin_secs)}
+                     for bin_start, records in sorted(self.bins.items())],
+            "skipped_rows": self.skipped_rows,
+        }
+
+
+def measure_breakdown(start_time: str, end_time: str, bin_secs: int, slices: int = 1,
+                      records_per_event: float = RECORDS_PER_EVENT) -> Breakdown:
+    """
+    @param start_time: start of the window as ISO time
+    @param end_time: end of the window as ISO time
+    @param bin_secs: width of the time bins, a multiple of 60
+    @param slices: split the window into sub-windows queried in parallel, see query_observe.query_sliced
+    @param records_per_event: see Breakdown
+    @return: records and bytes per key
+    """
+    token_manager = query_observe.get_token_manager()
+    pipeline = pipeline_config.build_breakdown_pipeline(partial=slices > 1)
+    if slices > 1:
+        rows = query_observe.query_sliced(token_manager.get(), os.environ.get("AZURE_DATASET_ID"), pipeline,
+                                          pipeline_config.breakdown_stages[-1], start_time, end_time, slices,
+                                          token_manager=token_manager)
+        rows = None if rows is None else (row for row in rows)
+    else:
+        rows = query_observe.query_dataset(token_manager.get(), os.environ.get("AZURE_DATASET_ID"), pipeline=pipeline,
+                                           startTime=start_time, endTime=end_time, token_manager=token_manager,
+                                           stream=True)
+    if rows is None:
+        raise RuntimeError("Breakdown query failed")
+
+    breakdown = Breakdown(bin_secs, (parse_iso(end_time) - parse_iso(start_time)).total_seconds(), records_per_event)
+    with closing(rows):
+        for item in rows:
+            breakdown.add(item)
+    logger.info("{} records, {} resources, {} categories".format(breakdown.records, len(breakdown.keys["resource"]),
+                                                                 len(breakdown.keys["category"])))
+    return breakdown
+
+
+def measure_partitions(start_time: str, end_time: str) -> dict:
+    """
+    @return: events delivered to the Event Hub trigger per partition id, from the FunctionAppLogs trigger details
+    """
+    token_manager = query_observe.get_token_manager()
+    rows = query_observe.query_dataset(token_manager.get(), os.environ.get("AZURE_DATASET_ID"),
+                                       pipeline=pipeline_config.build_function_log_pipeline(), startTime=start_time,
+                                       endTime=end_time, token_manager=token_manager, stream=True)
+    if rows is None:
+        raise RuntimeError("FunctionAppLogs query failed")
+
+    partitions = {}
+    with closing(rows):
+        for item in rows:
+            match = TRIGGER_DETAILS.search(item.get("message") or "")
+            if match:
+                partition = int(match.group("partition"))
+                partitions[partition] = partitions.get(partition, 0) + int(match.group("count"))
+    return partitions
+
+
+def analyze_skew(breakdown: Breakdown, partition_events: dict, partition_count: int, throughput_units: int,
+                 consumer_eps_per_partition: float) -> dict:
+    """
+    @param breakdown: see measure_breakdown, its rates are in events like the limits compared with
+    @param partition_events: see measure_partitions, empty when the function logs are not available
+    @param partition_count: partitions of the Event Hub
+    @param throughput_units: throughput units of the namespace, the maximum with auto-inflate
+    @param consumer_eps_per_partition: events/sec a function instance drains from one partition
+    @return: partition spread, the busiest partition's peak rate and the findings
+    """
+    peak_eps = breakdown.peak_eps()
+    consumed = sum(partition_events.values())
+    # Events published without a partition key are spread round-robin, assume an even spread without logs
+    busiest_share = max(partition_events.values()) / consumed if consumed else 1 / partition_count
+    mean_share = 1 / partition_count
+    analysis = {
+        "partition_count": partition_count,
+        "partitions_active": len(partition_events) if consumed else None,
+        "partition_events": {str(partition): events for partition, events in sorted(partition_events.items())},
+        "busiest_partition_ratio": busiest_share / mean_share,
+        "busiest_partition_peak_eps": peak_eps * busiest_share,
+        "even_partition_peak_eps": peak_eps * mean_share,
+        "consumer_eps_per_partition": consumer_eps_per_partition,
+        "ingress_eps_limit": throughput_units * TU_INGRESS_EVENTS_PER_SEC,
+        "findings": [],
+    }
+    findings = analysis["findings"]
+
+    if peak_eps > analysis["ingress_eps_limit"]:
+        findings.append("Volume: the peak of {:.0f} events/s exceeds the {:.0f} events/s ingress of {} throughput "
+                        "units".format(peak_eps, analysis["ingress_eps_limit"], throughput_units))
+    if analysis["even_partition_peak_eps"] > consumer_eps_per_partition:
+        findings.append("Volume: even spread over {} partitions, each gets {:.0f} events/s at the peak, more than "
+                        "the {:.0f} events/s a consumer drains".format(partition_count,
+                                                                      analysis["even_partition_peak_eps"],
+                                                                      consumer_eps_per_partition))
+    if consumed and analysis["busiest_partition_ratio"] > PARTITION_SKEW_RATIO:
+        finding = "Partition skew: the busiest partition delivered {:.1f}x the mean, {} of {} partitions delivered " \
+                  "events".format(analysis["busiest_partition_ratio"], len(partition_events), partition_count)
+        if analysis["busiest_partition_peak_eps"] > consumer_eps_per_partition >= analysis["even_partition_peak_eps"]:
+            finding += ". Its consumer falls behind at the peak although the total rate fits the partitions"
+        findings.append(finding)
+    for dimension in DIMENSIONS:
+        for top in breakdown.top(dimension, 1):
+            if top["share"] > DOMINANT_SHARE:
+                findings.append("Heavy hitter: {} {} sends {:.0%} of the records, peaking at {:.0f} events/s".format(
+                    dimension, top["key"], top["share"], top["peak_eps"]))
+    if not consumed:
+        findings.append("No Event Hub trigger details in the FunctionAppLogs, the partition spread is assumed even")
+    if not any(finding.split(":")[0] in ("Volume", "Partition skew") for finding in findings):
+        findings.append("Neither the total volume nor the partition spread exceeds the consumer capacity")
+    return analysis
+
+
+def markdown(report: dict) -> str:
+    skew = report["skew"]
+    lines = [
+        "## EventHub Throughput Breakdown",
+        "",
+        "{} records, mean {:.1f} events/s, peak {:.1f} events/s of {:g} records. Busiest partition {:.1f}x the mean "
+        "of {} partitions".format(report["records"], report["mean_eps"], report["peak_eps"],
+                                  report["records_per_event"], skew["busiest_partition_ratio"],
+                                  skew["partition_count"]),
+        "",
+    ]
+    lines.extend("- :x: {} query failed: {}".format(query, error) for query, error in report["errors"].items())
+    lines.extend("- {}".format(finding) for finding in skew["findings"])
+    for dimension in DIMENSIONS:
+        lines.extend([
+            "",
+            "| {} | Records | Share | Mean events/s | Peak events/s | Bytes/record |".format(dimension),
+            "|---|---|---|---|---|---|",
+        ])
+        for top in report["top"][dimension]:
+            lines.append("| {} | {} | {:.1%} | {:.2f} | {:.2f} | {:.0f} |".format(
+                top["key"], top["records"], top["share"], top["mean_eps"], top["peak_eps"], top["bytes_per_record"]))
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Breaks EventHub throughput down by category, appName and resource")
+    add_window_arguments(parser)
+    parser.add_argument("--bin-mins", type=int, default=5, help="Width of the time bins (default: 5)")
+    parser.add_argument("--top-k", type=int, default=10, help="Heavy hitters reported per dimension (default: 10)")
+    parser.add_argument("--terraform-dir", default=os.path.join(os.path.dirname(__file__), "..", ".."),
+                        help="Terraform root module for the partition count and throughput units "
+                             "(default: the repository root)")
+    parser.add_argument("--var-file", action="append", default=[], help="tfvars file(s) overriding defaults")
+    parser.add_argument("--partitions", type=int, help="Partition count, instead of reading it from Terraform")
+    parser.add_argument("--consumer-eps-per-partition", type=float, default=500,
+                        help="events/sec a function instance drains from one partition (default: 500)")
+    parser.add_argument("--records-per-event", type=float, default=RECORDS_PER_EVENT,
+                        help="Diagnostic records per Event Hub event, converts the rows measured in Observe to "
+                             "events (default: {})".format(RECORDS_PER_EVENT))
+    parser.add_argument("--slices", type=int, default=1,
+                        help="Split the window into this many sub-windows queried in parallel (default: 1)")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    start_time, end_time = report_window(args)
+
+    sizing = current_sizing(TerraformConfig.load(args.terraform_dir, args.var_file))
+    # A failed query is recorded in the report, which is still written from whatever was measured
+    errors = {}
+    breakdown = run_query(
+        errors, "breakdown", "Breakdown query",
+        lambda: measure_breakdown(start_time, end_time, args.bin_mins * 60, args.slices, args.records_per_event),
+        default=Breakdown(args.bin_mins * 60, (parse_iso(end_time) - parse_iso(start_time)).total_seconds(),
+                          args.records_per_event))
+    partition_events = run_query(errors, "partitions", "FunctionAppLogs query",
+                                 lambda: measure_partitions(start_time, end_time), default={})
+
+    result = dict(start=start_time, end=end_time, errors=errors, **breakdown.report(args.top_k))
+    result["skew"] = analyze_skew(breakdown, partition_events, args.partitions or sizing["partition_count"],
+                                  sizing["maximum_throughput_units"],
+                                  args.consumer_eps_per_partition)
+    for finding in result["skew"]["findings"]:
+        logger.info(finding)
+
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(result, json_file, indent=4)
+        logger.info("Throughput report written to {}".format(args.output))
+    append_step_summary(markdown(result))
+    if errors:
+        sys.exit(1)
@@ -0,0 +1,122 @@
+import datetime
+import json
+import logging
+import os
+import threading
+from datetime import timezone
+
+logger = logging.getLogger(__name__)
+
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def parse_iso(timestamp: str) -> datetime.datetime:
+    """Parses the ISO timestamps used for query windows, with or without fractional seconds"""
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+def format_iso(epoch_secs: float) -> str:
+    """Formats a Unix time as the ISO timestamps used for query windows and report time bins"""
+    return datetime.datetime.fromtimestamp(epoch_secs, timezone.utc).strftime(ISO_FORMAT)
+
+
+class ValidationState:
+    """
+    Per-source watermark and partial aggregates of the validation queries, so each poll only
+    queries the slice of data since the previous poll and merges it into the running result.
+
+    Persisted to a small JSON file so it also survives process restarts. The state is discarded
+    when it belongs to a different run (deployment, token or Terraform finish time).
+    """
+
+    def __init__(self, path: str, run_key: str, overlap_secs: float = 120):
+        """
+        @param path: state file, None keeps the state in memory only
+        @param run_key: identifies the validation run the state belongs to
+        @param overlap_secs: how far before the watermark the next slice starts, to pick up late data
+        """
+        self.path = path
+        self.run_key = run_key
+        self.overlap = datetime.timedelta(seconds=overlap_secs)
+        self.sources = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def window_start(self, source: str, start_time: str) -> str:
+        """
+        @param source: source being queried
+        @param start_time: start of the full validation window as ISO time
+        @return: start of the next slice to query as ISO time
+        """
+        with self._lock:
+            watermark = self.sources.get(source, {}).get("watermark")
+        if watermark is None:
+            return start_time
+        slice_start = parse_iso(watermark) - self.overlap
+        if slice_start <= parse_iso(start_time):
+            return start_time
+        return slice_start.strftime(ISO_FORMAT)
+
+    def merge(self, source: str, item: dict):
+        """
+        Merges a query result row into the source's running aggregates.
+        msg_count is summed, so rows seen in the overlap of two slices can be counted twice; it is
+        only used to check for the presence of data. earliest_ts is the minimum over all slices.
+
+        @param source: source the row belongs to
+        @param item: row with msg_count and earliest_ts (ns) columns
+        """
+        with self._lock:
+            entry = self.sources.setdefault(source, {"watermark": None, "msg_count": 0, "earliest_ts": None})
+            entry["msg_count"] += int(item["msg_count"])
+            if item.get("earliest_ts") is not None:
+                earliest_ts = int(item["earliest_ts"])
+                if entry["earliest_ts"] is None or earliest_ts < entry["earliest_ts"]:
+                    entry["earliest_ts"] = earliest_ts
+
+    def advance(self, source: str, end_time: str):
+        """
+        Moves the source's watermark to the end of a slice that was read completely and saves the state.
+
+        @param source: source that was queried
+        @param end_time: end of the queried slice as ISO time
+        """
+        with self._lock:
+            entry = self.sources.setdefault(source, {"watermark": None, "msg_count": 0, "earliest_ts": None})
+            entry["watermark"] = end_time
+        self.save()
+
+    def aggregate(self, source: str) -> dict:
+        """
+        @param source: source to look up
+        @return: merged row {msg_count, earliest_ts} like a single query over the whole window, None without data
+        """
+        with self._lock:
+            entry = self.sources.get(source)
+            if entry is None or entry["earliest_ts"] is None:
+                return None
+            return {"source": source, "msg_count": entry["msg_count"], "earliest_ts": entry["earliest_ts"]}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            content = {"run_key": self.run_key, "sources": self.sources}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as state_file:
+                json.dump(content, state_file, indent=4)
+            os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as state_file:
+                content = json.load(state_file)
+        except (OSError, ValueError):
+            return
+        if content.get("run_key") != self.run_key:
+            logger.info("Ignoring validation state in {} from a different run".format(self.path))
+            return
+        self.sources = content.get("sources", {})
+        logger.info("Loaded validation state from {}".format(self.path))
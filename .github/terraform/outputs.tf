@@ -12,4 +12,14 @@ output "azure_dataset_id" {
 output "azure_collection_function" {
   description = "Azure Dataset Id"
   value       = module.terraform-azure-collection.function_url
-} 
\ No newline at end of file
+}
+
+output "timer_resources_func_schedule" {
+  description = "NCRONTAB schedule of the resources function"
+  value       = module.terraform-azure-collection.timer_resources_func_schedule
+}
+
+output "timer_vm_metrics_func_schedule" {
+  description = "NCRONTAB schedule of the vm metrics function"
+  value       = module.terraform-azure-collection.timer_vm_metrics_func_schedule
+}
@@ -6,6 +6,16 @@ locals {
   region        = lookup(var.location_abbreviation, var.location, "none-found")
   keyvault_name = "${local.region}${var.observe_customer}${local.sub}"
   sub           = substr(data.azurerm_subscription.primary.subscription_id, -8, -1)
+
+  is_elastic_premium = substr(var.service_plan_sku_name, 0, 2) == "EP"
+  # Event Hub trigger host.json settings, only those that are set so the host defaults apply otherwise
+  eventhub_trigger_settings = {
+    for name, value in {
+      AzureFunctionsJobHost__extensions__eventHubs__maxEventBatchSize        = var.eventhub_max_event_batch_size
+      AzureFunctionsJobHost__extensions__eventHubs__prefetchCount            = var.eventhub_prefetch_count
+      AzureFunctionsJobHost__extensions__eventHubs__batchCheckpointFrequency = var.eventhub_batch_checkpoint_frequency
+    } : name => tostring(value) if value != null
+  }
 }
 
 # Obtains current client config from az login, allowing terraform to run.
@@ -116,18 +126,28 @@ resource "azurerm_eventhub_namespace" "observe_eventhub_namespace" {
   location            = azurerm_resource_group.observe_resource_group.location
   resource_group_name = azurerm_resource_group.observe_resource_group.name
   sku                 = "Standard"
-  capacity            = 2
+  capacity            = var.eventhub_namespace_capacity
+
+  auto_inflate_enabled     = var.eventhub_auto_inflate_enabled
+  maximum_throughput_units = var.eventhub_auto_inflate_enabled ? var.eventhub_maximum_throughput_units : null
 
   tags = {
     created_by = "Observe Terraform"
   }
+
+  lifecycle {
+    precondition {
+      condition     = !var.eventhub_auto_inflate_enabled || var.eventhub_namespace_capacity <= var.eventhub_maximum_throughput_units
+      error_message = "eventhub_namespace_capacity must not exceed eventhub_maximum_throughput_units when auto-inflate is enabled."
+    }
+  }
 }
 
 resource "azurerm_eventhub" "observe_eventhub" {
   name                = "observeEventHub-${var.observe_customer}-${var.location}-${local.sub}"
   namespace_name      = azurerm_eventhub_namespace.observe_eventhub_namespace.name
   resource_group_name = azurerm_resource_group.observe_resource_group.name
-  partition_count     = 32
+  partition_count     = var.eventhub_partition_count
   message_retention   = 7
 }
 
@@ -146,7 +166,9 @@ resource "azurerm_service_plan" "observe_service_plan" {
   location            = azurerm_resource_group.observe_resource_group.location
   resource_group_name = azurerm_resource_group.observe_resource_group.name
   os_type             = "Linux"
-  sku_name            = "Y1"
+  sku_name            = var.service_plan_sku_name
+
+  maximum_elastic_worker_count = local.is_elastic_premium ? var.service_plan_maximum_elastic_worker_count : null
 }
 
 resource "azurerm_storage_account" "observe_storage_account" {
@@ -172,7 +194,7 @@ resource "azurerm_linux_function_app" "observe_collect_function_app" {
   storage_account_name       = azurerm_storage_account.observe_storage_account.name
   storage_account_access_key = azurerm_storage_account.observe_storage_account.primary_access_key
 
-  app_settings = {
+  app_settings = merge({
     WEBSITE_RUN_FROM_PACKAGE                      = var.func_url
     AzureWebJobsDisableHomepage                   = true
     OBSERVE_DOMAIN                                = var.observe_domain
@@ -188,13 +210,15 @@ resource "azurerm_linux_function_app" "observe_collect_function_app" {
     EVENTHUB_TRIGGER_FUNCTION_EVENTHUB_CONNECTION = "${azurerm_eventhub_authorization_rule.observe_eventhub_access_policy.primary_connection_string}"
     # Pending resolution of https://github.com/hashicorp/terraform-provider-azurerm/issues/18026
     # APPINSIGHTS_INSTRUMENTATIONKEY = azurerm_application_insights.observe_insights.instrumentation_key 
-  }
+  }, local.eventhub_trigger_settings)
 
   identity {
     type = "SystemAssigned"
   }
 
   site_config {
+    elastic_instance_minimum = local.is_elastic_premium ? var.function_app_elastic_instance_minimum : null
+
     application_stack {
       python_version = "3.9"
     }
@@ -7,7 +7,18 @@ output "eventhub_namespace_id" {
   description = "Resource ID of the eventhub namespace used for Observe collection."
   value       = azurerm_eventhub_namespace.observe_eventhub_namespace.id
 }
+
 output "function_url" {
   description = "Function URL used for Observe collection."
   value       = var.func_url
-}
\ No newline at end of file
+}
+
+output "timer_resources_func_schedule" {
+  description = "NCRONTAB schedule of the resources function."
+  value       = var.timer_resources_func_schedule
+}
+
+output "timer_vm_metrics_func_schedule" {
+  description = "NCRONTAB schedule of the vm metrics function."
+  value       = var.timer_vm_metrics_func_schedule
+}
@@ -141,3 +141,81 @@ variable "function_app_debug_logs" {
   default     = false
   description = "Enables routing of function app logs to eventhub for debugging eventhub & function app"
 }
+
+variable "eventhub_namespace_capacity" {
+  type        = number
+  default     = 2
+  description = "Throughput units of the Standard Event Hub namespace, or the initial units when auto-inflate is enabled"
+}
+
+variable "eventhub_auto_inflate_enabled" {
+  type        = bool
+  default     = false
+  description = "Scale the Event Hub namespace up to eventhub_maximum_throughput_units under load"
+}
+
+variable "eventhub_maximum_throughput_units" {
+  type        = number
+  default     = 10
+  description = "Maximum throughput units when auto-inflate is enabled (1-40)"
+
+  validation {
+    condition     = var.eventhub_maximum_throughput_units >= 1 && var.eventhub_maximum_throughput_units <= 40
+    error_message = "eventhub_maximum_throughput_units must be between 1 and 40."
+  }
+}
+
+variable "eventhub_partition_count" {
+  type        = number
+  default     = 32
+  description = "Partitions of the Event Hub (1-32). Changing it recreates the Event Hub"
+
+  validation {
+    condition     = var.eventhub_partition_count >= 1 && var.eventhub_partition_count <= 32
+    error_message = "eventhub_partition_count must be between 1 and 32 on a Standard namespace."
+  }
+}
+
+# Event Hub trigger settings passed to the function host, the host defaults apply when null
+# https://learn.microsoft.com/en-us/azure/azure-functions/functions-bindings-event-hubs#hostjson-settings
+
+variable "eventhub_max_event_batch_size" {
+  type        = number
+  default     = null
+  description = "Maximum events per Event Hub trigger invocation"
+}
+
+variable "eventhub_prefetch_count" {
+  type        = number
+  default     = null
+  description = "Events prefetched from each partition by the Event Hub trigger"
+}
+
+variable "eventhub_batch_checkpoint_frequency" {
+  type        = number
+  default     = null
+  description = "Event Hub trigger batches processed between checkpoints"
+}
+
+variable "service_plan_sku_name" {
+  type        = string
+  default     = "Y1"
+  description = "Function app plan: Y1 (Consumption) or EP1/EP2/EP3 (Elastic Premium, no cold starts)"
+
+  validation {
+    condition     = contains(["Y1", "EP1", "EP2", "EP3"], var.service_plan_sku_name)
+    error_message = "service_plan_sku_name must be one of Y1, EP1, EP2, EP3."
+  }
+}
+
+variable "service_plan_maximum_elastic_worker_count" {
+  type        = number
+  default     = 20
+  description = "Maximum instances of an Elastic Premium plan"
+}
+
+variable "function_app_elastic_instance_minimum" {
+  type        = number
+  default     = 1
+  description = "Always ready instances of the function app on an Elastic Premium plan"
+}